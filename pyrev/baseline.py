@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Baseline of problems already known in a project, so that only new ones
+are reported when adopting pyrev for an existing manuscript.
+
+Each problem is recorded as a fingerprint, one per line, sorted:
+
+ <source name> <rule id> <hash>
+
+The hash is made of the rule id, the description and the raw content
+with line and column numbers dropped, so fingerprints survive lines
+added or removed elsewhere in the file. Identical problems in a file
+are recorded as many times as they appear.
+'''
+
+import hashlib
+import os
+import re
+import tempfile
+
+from collections import Counter
+
+from logging import getLogger, NullHandler
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+BASELINE_HEADER = u'# pyrev baseline v1'
+HASH_LENGTH = 16
+
+r_position = re.compile(r'\b[CL]\d+\b')
+r_spaces = re.compile(r'\s+')
+
+
+def _normalize(text):
+    return r_spaces.sub(u' ', text).strip()
+
+
+def get_fingerprint(problem):
+    '''
+    Returns a tuple (source name, rule id, hash) for a ParseProblem.
+    '''
+    rule = problem.rule
+    content = problem.raw_content or u''
+    if type(content) is list:
+        content = u'\n'.join(content)
+    if type(content) is str:
+        content = content.decode('utf-8', 'replace')
+    desc = _normalize(r_position.sub(u'', problem.desc))
+    data = u'\0'.join([rule, desc, _normalize(content)])
+    digest = hashlib.sha1(data.encode('utf-8')).hexdigest()[:HASH_LENGTH]
+    return (problem.source_name or u'', rule, digest)
+
+
+class Baseline(object):
+    def __init__(self, path, update=False, logger=None):
+        '''
+        update: if True, problems are recorded instead of being left out.
+        '''
+        self.path = path
+        self.update_mode = update
+        self.logger = logger or local_logger
+        # fingerprint -> count
+        self.fingerprints = Counter()
+        # Fingerprints not matched by accept() yet.
+        self._remaining = Counter()
+        # Fingerprints of problems passed to accept() in update mode.
+        self._found = Counter()
+        self.num_suppressed = 0
+
+    def load(self):
+        '''
+        Loads fingerprints. Returns False if the file doesn't exist.
+        Raises IOError or ValueError when it's broken.
+        '''
+        if not os.path.exists(self.path):
+            return False
+        fingerprints = Counter()
+        with open(self.path) as f:
+            for (num, line) in enumerate(f, 1):
+                line = line.decode('utf-8').rstrip(u'\n')
+                if not line or line.startswith(u'#'):
+                    continue
+                fingerprint = tuple(line.rsplit(u' ', 2))
+                if len(fingerprint) != 3:
+                    raise ValueError(u'Malformed line {} in "{}"'
+                                     .format(num, self.path))
+                fingerprints[fingerprint] += 1
+        self.fingerprints = fingerprints
+        self._remaining = Counter(fingerprints)
+        return True
+
+    def accept(self, problem):
+        '''
+        Returns True if a problem should be reported: it's not in the
+        baseline, or not matched by problems accepted so far.
+        Always False in update mode.
+        '''
+        fingerprint = get_fingerprint(problem)
+        if self.update_mode:
+            self._found[fingerprint] += 1
+            return False
+        if self._remaining[fingerprint] > 0:
+            self._remaining[fingerprint] -= 1
+            self.num_suppressed += 1
+            return False
+        return True
+
+    def filter(self, problems):
+        return filter(self.accept, problems)
+
+    def finish(self, source_names=None):
+        '''
+        Saves fingerprints of problems found in update mode.
+        source_names: files actually linted. Fingerprints of other files
+          are kept. If None, all are replaced.
+        '''
+        if not self.update_mode:
+            if self.num_suppressed:
+                self.logger.info(u'{} known problem(s) in baseline'
+                                 .format(self.num_suppressed))
+            return
+        if source_names is None:
+            fingerprints = Counter()
+        else:
+            source_names = set(source_names)
+            fingerprints = Counter(
+                dict(filter(lambda x: x[0][0] not in source_names,
+                            self.fingerprints.items())))
+        fingerprints.update(self._found)
+        self.fingerprints = fingerprints
+        if self.save():
+            self.logger.info(u'Baseline "{}" updated with {} problem(s)'
+                             .format(self.path,
+                                     sum(self._found.values())))
+
+    def save(self):
+        '''
+        Saves fingerprints atomically. Returns True when successful.
+        '''
+        lines = [BASELINE_HEADER]
+        for fingerprint in sorted(self.fingerprints.elements()):
+            lines.append(u' '.join(fingerprint))
+        path_dir = os.path.dirname(os.path.abspath(self.path))
+        try:
+            (fd, temp_path) = tempfile.mkstemp(dir=path_dir)
+            with os.fdopen(fd, 'w') as f:
+                f.write((u'\n'.join(lines) + u'\n').encode('utf-8'))
+            os.rename(temp_path, self.path)
+            return True
+        except (IOError, OSError) as e:
+            self.logger.error(u'Failed to save baseline "{}": {}'
+                              .format(self.path, e))
+            return False
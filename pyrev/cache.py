@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Caches shared among pyrev tools.
+'''
+
+import json
+import os
+import tempfile
+
+from collections import OrderedDict
+
+from logging import getLogger, NullHandler
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+# Entries kept in a StampCache file. Entries not used recently are dropped
+# when saving, so that a cache shared by all projects stays small.
+STAMP_CACHE_ENTRIES = 10000
+
+
+def get_cache_dir():
+    '''
+    Returns a directory where pyrev may store its caches.
+    ($XDG_CACHE_HOME/pyrev, or ~/.cache/pyrev)
+    The directory may not exist yet.
+    '''
+    base_dir = (os.environ.get('XDG_CACHE_HOME')
+                or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base_dir, 'pyrev')
+
+
+def file_stamp(path):
+    '''
+    Returns (size, mtime) for a file, which is used to detect changes
+    without reading the content.
+    '''
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime)
+
+
+class StampCache(object):
+    '''
+    Remembers a value computed from a file, keyed by its path.
+    Each value is valid while (size, mtime) of the file stays same.
+
+    When cache_path is given, values are loaded from and saved to
+    the JSON file, so that they survive across runs. At most max_entries
+    recently used ones are saved.
+    Values must be serializable with json.
+    '''
+
+    def __init__(self, cache_path=None, logger=None,
+                 max_entries=STAMP_CACHE_ENTRIES):
+        self.cache_path = cache_path
+        self.logger = logger or local_logger
+        self.max_entries = max_entries
+        # path (unicode) -> [size, mtime, value], least recently used first
+        self._entries = OrderedDict()
+        self._modified = False
+        if cache_path and os.path.isfile(cache_path):
+            try:
+                with open(cache_path) as f:
+                    self._entries = json.load(f,
+                                              object_pairs_hook=OrderedDict)
+            except (IOError, ValueError) as e:
+                self.logger.debug(u'Ignoring broken cache "{}": {}'
+                                  .format(cache_path, e))
+
+    def _get_key(self, path):
+        # json loads keys as unicode, which must match str paths.
+        if type(path) is str:
+            return path.decode('utf-8', 'replace')
+        return path
+
+    def get(self, path, stamp):
+        '''
+        Returns a value for path if stamp matches. None otherwise.
+        '''
+        key = self._get_key(path)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        # Move it to the most recent position.
+        self._entries[key] = entry
+        if (entry[0], entry[1]) == tuple(stamp):
+            return entry[2]
+        return None
+
+    def put(self, path, stamp, value):
+        key = self._get_key(path)
+        self._entries.pop(key, None)
+        self._entries[key] = [stamp[0], stamp[1], value]
+        self._modified = True
+
+    def save(self):
+        '''
+        Saves values into cache_path if needed.
+        Failures are just logged since a cache is not mandatory.
+        '''
+        if not self.cache_path or not self._modified:
+            return
+        cache_dir = os.path.dirname(self.cache_path)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            (fd, temp_path) = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._entries, f)
+            os.rename(temp_path, self.cache_path)
+            self._modified = False
+        except (IOError, OSError) as e:
+            self.logger.debug(u'Failed to save cache "{}": {}'
+                              .format(self.cache_path, e))
+
+
+class LRUCache(object):
+    '''
+    Keeps values while their total cost is within max_cost.
+    Least recently used values are evicted first.
+
+    Cost is given by callers (e.g. size of a source file).
+    '''
+
+    def __init__(self, max_cost):
+        self.max_cost = max_cost
+        self.total_cost = 0
+        # key -> (value, cost)
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        # Move it to the most recent position.
+        self._entries[key] = entry
+        return entry[0]
+
+    def put(self, key, value, cost):
+        self.pop(key)
+        self._entries[key] = (value, cost)
+        self.total_cost += cost
+        # The latest entry is kept even if it exceeds max_cost by itself.
+        while self.total_cost > self.max_cost and len(self._entries) > 1:
+            (_, (_, evicted_cost)) = self._entries.popitem(last=False)
+            self.total_cost -= evicted_cost
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self.total_cost -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        self._entries.clear()
+        self.total_cost = 0
+
+    def keys(self):
+        return self._entries.keys()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Sends lint requests to a running lint server (see server.py).
+
+This is imported by pyrev on every run, so must stay light: no parser,
+no project.
+'''
+
+import json
+import os
+import socket
+
+from cache import get_cache_dir
+from version import VERSION
+
+from logging import getLogger, NullHandler
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+# Overrides the default socket path.
+SOCKET_ENV = 'PYREV_SOCKET'
+
+CONNECT_TIMEOUT = 1.0
+# Linting a large project for the first time may take this long.
+RESPONSE_TIMEOUT = 300.0
+
+
+def get_socket_path():
+    return (os.environ.get(SOCKET_ENV)
+            or os.path.join(get_cache_dir(), 'serve.sock'))
+
+
+def send_request(request, socket_path=None, logger=None):
+    '''
+    Sends a request (dict) and returns the response (dict).
+    Returns None if no server is running or it failed to respond, where
+    callers should do the work by themselves.
+    '''
+    logger = logger or local_logger
+    socket_path = socket_path or get_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(socket_path)
+        sock.settimeout(RESPONSE_TIMEOUT)
+        request = dict(request, version=VERSION)
+        sock.sendall(json.dumps(request) + '\n')
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        response = json.loads(''.join(chunks))
+    except (socket.error, ValueError) as e:
+        logger.debug(u'No response from "{}": {}'.format(socket_path, e))
+        return None
+    finally:
+        sock.close()
+    if type(response) is not dict or response.get('version') != VERSION:
+        # Started with another version of pyrev.
+        logger.debug(u'Ignoring server of version {}'
+                     .format(response.get('version')
+                             if type(response) is dict else None))
+        return None
+    return response
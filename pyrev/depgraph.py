@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Dependencies among source files of a project, built from results of
+parsing each file (FileResult):
+
+ defines ... ids of blocks others may refer to ("//list[l1]")
+ references ... ids referred to ("@<list>{l1}", "@<chap>{ch1}")
+ includes, images ... files read for the file
+
+The graph is saved next to the project (DEPS_FILENAME in source_dir).
+Each entry has a digest of the file and files it includes, so that only
+changed files need to be parsed again to bring the graph up to date.
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+
+from collections import OrderedDict
+
+from logging import getLogger, NullHandler
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+DEPS_FILENAME = '.pyrev-deps.json'
+DEPS_VERSION = 1
+
+# Inlines checked against blocks found so far (see Parser.allowed_inlines),
+# mapped to the block names they may refer to.
+CHECKED_REFERENCES = {'list': ('list', 'listnum'),
+                      'img': ('image',)}
+# Other inlines referring to a block, or to a chapter by its id.
+# Nothing is checked for them (yet), so they don't change results.
+CHAPTER_REFERENCES = set(['chap', 'chapref', 'title'])
+OTHER_REFERENCES = set(['table']) | CHAPTER_REFERENCES
+DEFINING_BLOCKS = set(['list', 'listnum', 'image', 'table'])
+
+
+def _get_digest(storage, source_dir, data, includes):
+    h = hashlib.sha1(data)
+    for rel_path in includes:
+        try:
+            included = storage.read(os.path.join(source_dir, rel_path))
+            digest = hashlib.sha1(included).hexdigest()
+        except (IOError, OSError):
+            digest = u'missing'
+        h.update(u'\0{}\0{}'.format(rel_path, digest).encode('utf-8'))
+    return h.hexdigest()
+
+
+def get_file_deps(result, source_dir):
+    '''
+    Returns dependencies (dict) of a file from its FileResult.
+    'digest' is left to the caller.
+    '''
+    defines = set()
+    for block in result.blocks:
+        if block.name in DEFINING_BLOCKS and block.params:
+            defines.add((block.name, block.params[0]))
+    references = set()
+    for inline in result.inlines:
+        if (inline.name in CHECKED_REFERENCES
+            or inline.name in OTHER_REFERENCES):
+            references.add((inline.name, inline.raw_content))
+    rel_path = lambda x: os.path.relpath(x, source_dir)
+    return {'defines': sorted(map(list, defines)),
+            'references': sorted(map(list, references)),
+            'includes': sorted(set(map(rel_path, result.includes))),
+            'images': sorted(set(map(lambda x: x[2].rel_path,
+                                     result.referenced_images))),
+            'has_bookmarks': bool(result.bookmarks)}
+
+
+def _refers_to(deps, ids, chapter_id, checked_only):
+    '''
+    Returns True if deps refer to any of ids (block name, id) or
+    chapter_id. With checked_only, only references which can change
+    results are considered.
+    '''
+    for (name, ref_id) in deps['references']:
+        for block_name in CHECKED_REFERENCES.get(name, ()):
+            if (block_name, ref_id) in ids:
+                return True
+        if checked_only:
+            continue
+        if name == 'table' and ('table', ref_id) in ids:
+            return True
+        if name in CHAPTER_REFERENCES:
+            target = ref_id
+        elif '|' in ref_id:
+            # e.g. "@<list>{ch1|l1}"
+            target = ref_id.split('|', 1)[0]
+        else:
+            continue
+        if target == chapter_id:
+            return True
+    return False
+
+
+class DependencyGraph(object):
+    def __init__(self, source_dir, path=None, logger=None):
+        '''
+        path: where the graph is saved. If None, DEPS_FILENAME in
+          source_dir is used.
+        '''
+        self.source_dir = source_dir
+        self.path = path or os.path.join(source_dir, DEPS_FILENAME)
+        self.logger = logger or local_logger
+        # filename -> deps (see get_file_deps()), in catalog order.
+        self.files = OrderedDict()
+
+    def load(self):
+        '''
+        Loads the graph saved previously. Returns False if not available.
+        '''
+        if not os.path.isfile(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                d = json.load(f)
+        except (IOError, ValueError) as e:
+            self.logger.debug(u'Ignoring broken graph "{}": {}'
+                              .format(self.path, e))
+            return False
+        if d.get('version') != DEPS_VERSION:
+            return False
+        self.files = OrderedDict(d['files'])
+        return True
+
+    def save(self):
+        '''
+        Saves the graph atomically. Returns True when successful.
+        '''
+        graph_dir = os.path.dirname(os.path.abspath(self.path))
+        try:
+            (fd, temp_path) = tempfile.mkstemp(dir=graph_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': DEPS_VERSION,
+                           'files': self.files.items()},
+                          f, indent=1, sort_keys=True,
+                          separators=(',', ': '))
+            os.rename(temp_path, self.path)
+            return True
+        except (IOError, OSError) as e:
+            self.logger.error(u'Failed to save graph "{}": {}'
+                              .format(self.path, e))
+            return False
+
+    def get_deps(self, project, filename, result, data=None):
+        '''
+        Returns deps of a file with its digest.
+        data: content of the file if already read.
+        '''
+        deps = get_file_deps(result, self.source_dir)
+        if data is None:
+            data = project.storage.read(os.path.join(self.source_dir,
+                                                     filename))
+        deps['digest'] = _get_digest(project.storage, self.source_dir,
+                                     data, deps['includes'])
+        return deps
+
+    def is_valid(self, project, data, deps):
+        '''
+        Returns True if deps are for data (content of the file) and
+        files included from it.
+        '''
+        return (deps is not None
+                and deps['digest'] == _get_digest(project.storage,
+                                                  self.source_dir, data,
+                                                  deps['includes']))
+
+    def refresh(self, project, get_result):
+        '''
+        Brings the graph up to date with source files of project, calling
+        get_result(filename) for FileResult of files changed since.
+        Returns filenames whose deps were updated.
+        '''
+        files = OrderedDict()
+        updated = []
+        for filename in project.source_filenames:
+            path = os.path.join(self.source_dir, filename)
+            try:
+                data = project.storage.read(path)
+            except (IOError, OSError):
+                continue
+            deps = self.files.get(filename)
+            if not self.is_valid(project, data, deps):
+                deps = self.get_deps(project, filename,
+                                     get_result(filename), data)
+                updated.append(filename)
+            files[filename] = deps
+        self.files = files
+        self.logger.debug(u'Dependencies of {} of {} file(s) updated'
+                          .format(len(updated), len(files)))
+        return updated
+
+    def get_referring(self, filename, checked_only=False):
+        '''
+        Returns files referring to filename's blocks or chapter id.
+        '''
+        deps = self.files.get(filename)
+        ids = set(map(tuple, deps['defines'])) if deps else set()
+        chapter_id = os.path.splitext(filename)[0]
+        return filter(lambda x: x != filename
+                      and _refers_to(self.files[x], ids, chapter_id,
+                                     checked_only),
+                      self.files)
+
+    def get_affected(self, changed, previous=None):
+        '''
+        Returns files (in catalog order) whose results may change when
+        files in "changed" (paths relative to source_dir) change.
+        The graph must be up to date with the change.
+
+        previous: a dict mapping changed source files to their deps
+          before the change. Ids they defined are looked for too, since
+          references to removed blocks must be reported.
+
+        Inlines are checked only against blocks in the same or preceding
+        files, and a file without bookmarks is reported only when no
+        preceding file has them (see Parser.merge_file_result()).
+        Changes of config or catalog files are not considered here.
+        '''
+        previous = previous or {}
+        changed = set(map(os.path.normpath, changed))
+        filenames = self.files.keys()
+        affected = set()
+        for (index, filename) in enumerate(filenames):
+            deps = self.files[filename]
+            old_deps = previous.get(filename, deps)
+            if filename in changed:
+                affected.add(filename)
+            elif changed.intersection(deps['includes']
+                                      + old_deps['includes']
+                                      + deps['images']
+                                      + old_deps['images']):
+                affected.add(filename)
+            else:
+                continue
+            ids = set(map(tuple, deps['defines'] + old_deps['defines']))
+            bookmarks_changed = (deps['has_bookmarks']
+                                 != old_deps['has_bookmarks'])
+            for later in filenames[index + 1:]:
+                later_deps = self.files[later]
+                if (_refers_to(later_deps, ids, None, True)
+                    or (bookmarks_changed
+                        and not later_deps['has_bookmarks'])):
+                    affected.add(later)
+        return filter(lambda x: x in affected, filenames)
@@ -20,18 +20,160 @@ from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
 from logging import getLogger, StreamHandler
 
-from main import lint
+from fingerprint import MANIFEST_FILENAME
+from main import lint, add_lint_arguments
 from version import VERSION
 
-import utils
+# Like main.py, modules for each subcommand are imported in the subcommand.
 
+import json
 import os
 import shutil
 import sys
 
 
 def lintstr(args, logger):
-    pass
+    '''
+    Lints snippets given as newline-delimited JSON from stdin, writing
+    a JSON line for each of them. See snippet.py
+    '''
+    from main import _get_level
+    from snippet import SnippetLinter
+    linter = SnippetLinter(_get_level(args.unacceptable_level),
+                           logger=logger)
+    count = linter.serve(sys.stdin, sys.stdout)
+    logger.debug(u'Linted {} snippet(s)'.format(count))
+    return 0
+
+
+def toc(args, logger):
+    '''
+    Prints a table of contents for a project, either in JSON or in
+    pdftk's dump_data_utf8 format.
+    '''
+    from project import ReVIEWProject
+    from toc import TocBuilder, format_json, format_pdftk
+    source_dir = ReVIEWProject.guess_source_dir(os.path.abspath(args.path))
+    if not source_dir:
+        logger.error(u'Failed to detect source_dir')
+        return 1
+    project = ReVIEWProject.instantiate(source_dir, logger=logger)
+    if not project:
+        logger.error(u'Failed to instanciate Re:VIEW Project ({}).'
+                     .format(source_dir))
+        return 1
+    builder = TocBuilder(project, logger=logger)
+    bookmarks = builder.build()
+    if args.format == 'pdftk':
+        for line in format_pdftk(bookmarks):
+            sys.stdout.write(u'{}\n'.format(line).encode('utf-8'))
+    else:
+        sys.stdout.write(format_json(bookmarks).encode('utf-8') + '\n')
+    for problem in builder.problems:
+        logger.warning(unicode(problem))
+    logger.info(builder.get_throughput())
+    return 0
+
+
+def fingerprint(args, logger):
+    '''
+    Prints digests of a project and its chapters, and which chapters
+    changed since the previous run.
+    '''
+    from fingerprint import Fingerprinter
+    from project import ReVIEWProject
+    source_dir = ReVIEWProject.guess_source_dir(os.path.abspath(args.path))
+    if not source_dir:
+        logger.error(u'Failed to detect source_dir')
+        return 1
+    project = ReVIEWProject.instantiate(source_dir, logger=logger)
+    if not project:
+        logger.error(u'Failed to instanciate Re:VIEW Project ({}).'
+                     .format(source_dir))
+        return 1
+    fingerprinter = Fingerprinter(project, manifest_path=args.manifest,
+                                  logger=logger)
+    fingerprinter.compute()
+    changed_chapters = fingerprinter.get_changed_chapters()
+    if args.format == 'json':
+        d = {'digest': fingerprinter.digest,
+             'changed': fingerprinter.is_changed(),
+             'common_changed': fingerprinter.is_common_changed(),
+             'chapters': fingerprinter.chapters,
+             'changed_chapters': changed_chapters}
+        sys.stdout.write(json.dumps(d, indent=2, separators=(',', ': '))
+                         + '\n')
+    else:
+        sys.stdout.write(u'{} (project{})\n'
+                         .format(fingerprinter.digest,
+                                 u', changed' if fingerprinter.is_changed()
+                                 else u'').encode('utf-8'))
+        for (filename, digest) in fingerprinter.chapters.iteritems():
+            sys.stdout.write(u'{} {}{}\n'
+                             .format(digest, filename,
+                                     u' (changed)'
+                                     if filename in changed_chapters
+                                     else u'').encode('utf-8'))
+    logger.info(u'Hashed {} of {} file(s)'
+                .format(fingerprinter.num_hashed, len(fingerprinter.files)))
+    if not args.no_save:
+        fingerprinter.save()
+    return 0
+
+
+def watch(args, logger):
+    '''
+    Lints a project, then prints differences of problems whenever
+    its files change.
+    '''
+    from main import _get_level
+    from project import ReVIEWProject
+    from watch import Watcher, PollingMonitor, create_monitor
+    source_dir = ReVIEWProject.guess_source_dir(os.path.abspath(args.path))
+    if not source_dir:
+        logger.error(u'Failed to detect source_dir')
+        return 1
+    watcher = Watcher(source_dir, _get_level(args.unacceptable_level),
+                      logger=logger,
+                      cache_bytes=args.cache_mb * 1024 * 1024)
+    if args.poll:
+        monitor = PollingMonitor()
+    else:
+        monitor = create_monitor(logger)
+    dump_func = lambda x: (sys.stdout.write(u'{}\n'.format(x)
+                                            .encode('utf-8')),
+                           sys.stdout.flush())
+    try:
+        return watcher.run(monitor, dump_func)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        monitor.close()
+
+
+def serve_lsp(args, logger):
+    '''
+    Runs a Language Server Protocol server over stdin and stdout.
+    '''
+    from main import _get_level
+    from lsp import LanguageServer, MessageReader
+    server = LanguageServer(MessageReader(sys.stdin.fileno()), sys.stdout,
+                            _get_level(args.unacceptable_level),
+                            logger=logger)
+    return server.run()
+
+
+def serve(args, logger):
+    '''
+    Runs a lint server, which pyrev forwards requests to while it runs.
+    '''
+    from parsecache import ParseCache
+    from server import LintServer
+    parse_cache = None if args.no_cache else ParseCache(logger=logger)
+    server = LintServer(args.socket, workers=args.workers,
+                        max_projects=args.max_projects,
+                        parse_cache=parse_cache, logger=logger)
+    return server.serve_forever()
 
 
 def copy_document(args, logger):
@@ -42,6 +184,7 @@ def copy_document(args, logger):
     dst can be a directory or a file, whose name may be different from
     the original.
     '''
+    import utils
     return utils.copy_document(args.src, args.dst, logger)
 
 
@@ -53,6 +196,7 @@ def move_document(args, logger):
     dst can be a directory or a file, whose name may be different from
     the original.
     '''
+    import utils
     return utils.move_document(args.src, args.dst, logger)
 
 
@@ -76,17 +220,105 @@ def devel():
 
     # Lint
     parser_lint = subparsers.add_parser('lint', help='Do lint check')
-    parser_lint.add_argument('filename')
-    parser_lint.add_argument('-u', '--unacceptable_level',
-                             action='store',
-                             default='CRITICAL',
-                             help=(u'Error level that aborts the check.'))
+    add_lint_arguments(parser_lint)
     parser_lint.set_defaults(func=lint)
 
     parser_lintstr = subparsers.add_parser('lintstr',
-                                           help='Check a given string')
+                                           help=(u'Check snippets given as'
+                                                 u' JSON lines from stdin'))
+    parser_lintstr.add_argument('-u', '--unacceptable_level',
+                                action='store',
+                                default='CRITICAL',
+                                help=(u'Error level that aborts the check'
+                                      u' of a snippet.'))
     parser_lintstr.set_defaults(func=lintstr)
 
+    # Table of contents
+    parser_toc = subparsers.add_parser('toc',
+                                       help=u'Print table of contents')
+    parser_toc.add_argument('path')
+    parser_toc.add_argument('-f', '--format',
+                            choices=['json', 'pdftk'],
+                            default='json',
+                            help=u'Output format.')
+    parser_toc.set_defaults(func=toc)
+
+    # Fingerprint
+    parser_fp = subparsers.add_parser('fingerprint',
+                                      help=(u'Print digests of project'
+                                            u' inputs'))
+    parser_fp.add_argument('path')
+    parser_fp.add_argument('-f', '--format',
+                           choices=['text', 'json'],
+                           default='text',
+                           help=u'Output format.')
+    parser_fp.add_argument('-m', '--manifest',
+                           help=(u'Manifest file remembering the previous'
+                                 u' run. (source_dir)/{} by default.'
+                                 .format(MANIFEST_FILENAME)))
+    parser_fp.add_argument('--no-save',
+                           action='store_true',
+                           help=u'Do not update the manifest.')
+    parser_fp.set_defaults(func=fingerprint)
+
+    # Watch
+    parser_watch = subparsers.add_parser('watch',
+                                         help=(u'Lint a project whenever'
+                                               u' its files change'))
+    parser_watch.add_argument('path')
+    parser_watch.add_argument('-u', '--unacceptable_level',
+                              action='store',
+                              default='CRITICAL',
+                              help=(u'Error level that aborts the check.'))
+    parser_watch.add_argument('--poll',
+                              action='store_true',
+                              help=u'Poll stats of files even if inotify'
+                              u' is available.')
+    parser_watch.add_argument('--cache-mb',
+                              action='store',
+                              type=int,
+                              default=16,
+                              help=(u'Upper limit of parse results kept in'
+                                    u' memory, approximated by total size'
+                                    u' of their source files.'))
+    parser_watch.set_defaults(func=watch)
+
+    # Language server
+    parser_lsp = subparsers.add_parser('lsp',
+                                       help=(u'Run a language server over'
+                                             u' stdio'))
+    parser_lsp.add_argument('-u', '--unacceptable_level',
+                            action='store',
+                            default='CRITICAL',
+                            help=(u'Error level that aborts the check.'))
+    parser_lsp.set_defaults(func=serve_lsp)
+
+    # Lint server
+    parser_serve = subparsers.add_parser('serve',
+                                         help=(u'Run a lint server over'
+                                               u' a Unix domain socket'))
+    parser_serve.add_argument('-s', '--socket',
+                              help=(u'Path of the socket. $PYREV_SOCKET or'
+                                    u' ~/.cache/pyrev/serve.sock by'
+                                    u' default.'))
+    parser_serve.add_argument('-w', '--workers',
+                              action='store',
+                              type=int,
+                              default=2,
+                              help=u'Number of worker processes.')
+    parser_serve.add_argument('--max-projects',
+                              action='store',
+                              type=int,
+                              default=8,
+                              help=(u'Number of projects each worker keeps'
+                                    u' in memory.'))
+    parser_serve.add_argument('--no-cache',
+                              action='store_true',
+                              help=(u'Do not reuse results cached on disk'
+                                    u' when a worker lints a project for'
+                                    u' the first time.'))
+    parser_serve.set_defaults(func=serve)
+
     # Copy-Document
     parser_ic = subparsers.add_parser('copy-document',
                                       help=u'Copy a single document')
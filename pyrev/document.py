@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+
+from parser import Parser
+
+from logging import getLogger, NullHandler
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+
+class ReVIEWDocument(object):
+    '''
+    Represents a single source (.re) file in a ReVIEWProject.
+
+    The file is parsed only when its content (bookmarks, blocks, etc.) is
+    first asked. Use ReVIEWProject.get_document() instead of instantiating
+    this directly, so that parsed documents are cached.
+    '''
+
+    def __init__(self, project, filename, logger=None):
+        self.project = project
+        self.filename = filename
+        self.path = os.path.normpath(os.path.join(project.source_dir,
+                                                  filename))
+        self.logger = logger or project.logger or local_logger
+        # (size, mtime) of the file when it was parsed.
+        self.stamp = None
+        self._parser = None
+
+    def get_stamp(self):
+        st = self.project.storage.stat(self.path)
+        return (st.st_size, st.st_mtime)
+
+    def is_stale(self):
+        '''
+        Returns True if the file is modified after it was parsed.
+        '''
+        if self.stamp is None:
+            return False
+        try:
+            return self.get_stamp() != self.stamp
+        except OSError:
+            return True
+
+    def is_parsed(self):
+        return self._parser is not None
+
+    def parse(self):
+        '''
+        Parses the file (again). Usually called implicitly.
+        '''
+        self.logger.debug(u'Parsing document "{}"'.format(self.filename))
+        self.stamp = self.get_stamp()
+        parser = Parser(project=self.project, logger=self.logger)
+        parser.parse_file(self.path,
+                          self.project.get_base_level(self.filename),
+                          self.filename)
+        self._parser = parser
+
+    @property
+    def parser(self):
+        if self._parser is None:
+            self.parse()
+        return self._parser
+
+    @property
+    def size(self):
+        '''
+        Size of the file in bytes when parsed (or now, if not parsed yet).
+        '''
+        if self.stamp:
+            return self.stamp[0]
+        return self.project.storage.stat(self.path).st_size
+
+    @property
+    def bookmarks(self):
+        return self.parser.bookmarks
+
+    @property
+    def blocks(self):
+        return self.parser.all_blocks
+
+    @property
+    def inlines(self):
+        return self.parser.all_inlines
+
+    @property
+    def problems(self):
+        return self.parser.reporter.problems
+
+    @property
+    def images(self):
+        '''
+        Returns a list of ProjectImage used by "//image" or "//indepimage"
+        in this document, in order of appearance without duplicates.
+        '''
+        images = []
+        for (_, _, image) in self.parser.referenced_images:
+            if image not in images:
+                images.append(image)
+        return images
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Records how expensive each source file is: lines, bytes, parse time and
+memory retained after parsing it (blocks, inlines and problems kept by
+the Parser).
+
+Memory is measured with tracemalloc where available. Otherwise (Python 2
+without the pytracemalloc patch) it is estimated from sizes of blocks,
+inlines and problems added by the file. The estimate misses other memory
+(e.g. caches) and allocator overhead, so reports label it as such.
+'''
+
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+DEFAULT_TOP = 10
+
+
+def _get_size(obj):
+    '''
+    Returns approximate bytes of an object with its attributes, and
+    elements of lists among them (e.g. Block.uni_lines).
+    '''
+    size = sys.getsizeof(obj)
+    attrs = getattr(obj, '__dict__', None)
+    if attrs is None:
+        return size
+    size += sys.getsizeof(attrs)
+    for value in attrs.itervalues():
+        size += sys.getsizeof(value)
+        if type(value) in [list, tuple]:
+            size += sum(map(sys.getsizeof, value))
+    return size
+
+
+class FileStat(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.lines = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.memory = 0
+        self.blocks = 0
+        self.inlines = 0
+        self.problems = 0
+
+    @property
+    def lines_per_second(self):
+        return self.lines / self.seconds if self.seconds else 0.0
+
+
+class FileStats(object):
+    def __init__(self, timer=time.time, use_tracemalloc=True):
+        self.timer = timer
+        self.use_tracemalloc = bool(tracemalloc and use_tracemalloc)
+        # FileStat in order of parsing.
+        self.stats = []
+
+    def _get_traced(self):
+        return tracemalloc.get_traced_memory()[0]
+
+    def attach(self, parser):
+        '''
+        Starts recording files parsed with Parser.parse_file().
+        '''
+        if self.use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        parse_file = parser.parse_file
+        parse_file_inter = parser._parse_file_inter
+        current = []
+
+        def wrapped_parse_file_inter(lines, *args, **kwargs):
+            # Lines of the file itself. Included ones are not counted.
+            if current and type(lines) is list:
+                current[-1].lines = len(lines)
+                current[-1].bytes = sum(map(len, lines))
+            return parse_file_inter(lines, *args, **kwargs)
+
+        def wrapped_parse_file(path, base_level, source_name, *args,
+                               **kwargs):
+            stat = FileStat(source_name)
+            num_blocks = len(parser.all_blocks)
+            inlines = lambda: (len(parser.all_inlines)
+                               + len(parser._current_inlines))
+            num_inlines = inlines()
+            num_problems = len(parser.reporter.problems)
+            traced = self._get_traced() if self.use_tracemalloc else 0
+            current.append(stat)
+            start = self.timer()
+            try:
+                return parse_file(path, base_level, source_name, *args,
+                                  **kwargs)
+            finally:
+                stat.seconds = self.timer() - start
+                current.pop()
+                stat.blocks = len(parser.all_blocks) - num_blocks
+                stat.inlines = inlines() - num_inlines
+                stat.problems = len(parser.reporter.problems) - num_problems
+                if self.use_tracemalloc:
+                    stat.memory = self._get_traced() - traced
+                else:
+                    new_inlines = (parser.all_inlines
+                                   + parser._current_inlines)[num_inlines:]
+                    stat.memory = sum(map(
+                        _get_size,
+                        parser.all_blocks[num_blocks:] + new_inlines
+                        + parser.reporter.problems[num_problems:]))
+                self.stats.append(stat)
+
+        parser._parse_file_inter = wrapped_parse_file_inter
+        parser.parse_file = wrapped_parse_file
+
+    def get_slowest(self, top=DEFAULT_TOP):
+        return sorted(self.stats, key=lambda x: -x.seconds)[:top]
+
+    def get_heaviest(self, top=DEFAULT_TOP):
+        return sorted(self.stats, key=lambda x: -x.memory)[:top]
+
+    def _dump_table(self, stats, dump_func):
+        if self.use_tracemalloc:
+            memory_label = u'Memory(KB)'
+        else:
+            memory_label = u'Est.Mem(KB)'
+        dump_func(u'{:<30} {:>8} {:>10} {:>9} {:>9} {:>11} {:>7} {:>7}'
+                  u' {:>8}'.format(u'File', u'Lines', u'Bytes', u'Time(ms)',
+                                   u'Lines/s', memory_label, u'Blocks',
+                                   u'Inlines', u'Problems'))
+        for stat in stats:
+            dump_func(u'{:<30} {:>8} {:>10} {:>9.1f} {:>9.0f} {:>11.1f}'
+                      u' {:>7} {:>7} {:>8}'
+                      .format(stat.filename, stat.lines, stat.bytes,
+                              stat.seconds * 1000, stat.lines_per_second,
+                              stat.memory / 1024.0, stat.blocks,
+                              stat.inlines, stat.problems))
+
+    def dump(self, dump_func, top=DEFAULT_TOP):
+        dump_func(u'{} file(s), {} line(s), {:.3f}s'
+                  .format(len(self.stats), sum(map(lambda x: x.lines,
+                                                   self.stats)),
+                          sum(map(lambda x: x.seconds, self.stats))))
+        dump_func(u'Slowest files:')
+        self._dump_table(self.get_slowest(top), dump_func)
+        if self.use_tracemalloc:
+            dump_func(u'Heaviest files (retained, by tracemalloc):')
+        else:
+            dump_func(u'Heaviest files (estimated from sizes of blocks,'
+                      u' inlines and problems, not measured):')
+        self._dump_table(self.get_heaviest(top), dump_func)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Computes digests of all inputs of a project as a Merkle tree, so that
+build wrappers can skip (or limit) builds when nothing relevant changed.
+
+ project
+ |-- common ... config and catalog files
+ `-- chapters
+     |-- chap1.re ... the source file and images mapped to it
+     `-- ...
+
+Digests of files are remembered in a manifest with (size, mtime).
+Files whose (size, mtime) did not change are not read again.
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from collections import OrderedDict
+
+from logging import getLogger, NullHandler
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+MANIFEST_FILENAME = '.pyrev-manifest.json'
+MANIFEST_VERSION = 1
+
+# Files modified this close to the previous run (in seconds) are always
+# hashed again, since they may have changed within mtime resolution.
+RACY_SECONDS = 2
+
+READ_SIZE = 64 * 1024
+
+
+def hash_node(children):
+    '''
+    Returns a digest for a node from a list of (name, digest) of children.
+    '''
+    h = hashlib.sha1()
+    for (name, digest) in children:
+        h.update(u'{}\0{}\n'.format(name, digest).encode('utf-8'))
+    return h.hexdigest()
+
+
+class Fingerprinter(object):
+    def __init__(self, project, manifest_path=None, logger=None):
+        '''
+        manifest_path: where digests of the previous run are stored.
+          If None, MANIFEST_FILENAME in source_dir is used for local projects.
+        '''
+        self.project = project
+        self.storage = project.storage
+        self.logger = logger or local_logger
+        if manifest_path is None and self.storage.is_local:
+            manifest_path = os.path.join(project.source_dir,
+                                         MANIFEST_FILENAME)
+        self.manifest_path = manifest_path
+        self.previous = self._load_manifest()
+        # rel_path -> [size, mtime, digest]
+        self.files = {}
+        self.digest = None
+        self.common_digest = None
+        # filename -> digest
+        self.chapters = OrderedDict()
+        self.num_hashed = 0
+        self.start_time = None
+
+    def _load_manifest(self):
+        if not self.manifest_path or not os.path.isfile(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError) as e:
+            self.logger.debug(u'Ignoring broken manifest "{}": {}'
+                              .format(self.manifest_path, e))
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION:
+            return {}
+        return manifest
+
+    def _hash_file(self, path):
+        h = hashlib.sha1()
+        f = self.storage.open(path)
+        try:
+            while True:
+                data = f.read(READ_SIZE)
+                if not data:
+                    break
+                h.update(data)
+        finally:
+            f.close()
+        self.num_hashed += 1
+        return h.hexdigest()
+
+    def file_digest(self, rel_path):
+        '''
+        Returns a digest of a file relative to source_dir.
+        '''
+        entry = self.files.get(rel_path)
+        if entry:
+            return entry[2]
+        path = os.path.join(self.project.source_dir, rel_path)
+        st = self.storage.stat(path)
+        entry = self.previous.get('files', {}).get(rel_path)
+        if (entry and entry[0] == st.st_size and entry[1] == st.st_mtime
+            and st.st_mtime < self.previous['time'] - RACY_SECONDS):
+            digest = entry[2]
+        else:
+            digest = self._hash_file(path)
+        self.files[rel_path] = [st.st_size, st.st_mtime, digest]
+        return digest
+
+    def _chapter_digest(self, filename):
+        children = [(filename, self.file_digest(filename))]
+        for image in sorted(self.project.images.get(filename) or [],
+                            key=lambda x: x.rel_path):
+            children.append((image.rel_path,
+                             self.file_digest(image.rel_path)))
+        return hash_node(children)
+
+    def compute(self):
+        '''
+        Computes digests and returns the digest of the whole project.
+        '''
+        project = self.project
+        self.start_time = time.time()
+        common_files = [project.config_file] + project._catalog_files
+        self.common_digest = hash_node(map(lambda x: (x, self.file_digest(x)),
+                                           common_files))
+        self.chapters = OrderedDict()
+        for filename in project.source_filenames + project.draft_filenames:
+            self.chapters[filename] = self._chapter_digest(filename)
+        self.digest = hash_node([('common', self.common_digest),
+                                 ('chapters',
+                                  hash_node(self.chapters.items()))])
+        self.logger.debug(u'Hashed {} of {} file(s)'
+                          .format(self.num_hashed, len(self.files)))
+        return self.digest
+
+    def is_changed(self):
+        return self.digest != self.previous.get('digest')
+
+    def is_common_changed(self):
+        '''
+        Returns True if config or catalog files changed, which affects
+        all outputs.
+        '''
+        return self.common_digest != self.previous.get('common_digest')
+
+    def get_changed_chapters(self):
+        '''
+        Returns filenames of chapters whose digests differ from the previous
+        run (including ones not known then).
+        '''
+        previous_chapters = self.previous.get('chapters', {})
+        return filter(lambda x: previous_chapters.get(x) != self.chapters[x],
+                      self.chapters)
+
+    def to_dict(self):
+        return {'version': MANIFEST_VERSION,
+                'time': self.start_time,
+                'digest': self.digest,
+                'common_digest': self.common_digest,
+                'chapters': self.chapters,
+                'files': self.files}
+
+    def save(self):
+        '''
+        Saves the manifest atomically. Returns True when successful.
+        '''
+        if not self.manifest_path:
+            return False
+        manifest_dir = os.path.dirname(os.path.abspath(self.manifest_path))
+        try:
+            (fd, temp_path) = tempfile.mkstemp(dir=manifest_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.to_dict(), f, indent=1, sort_keys=True,
+                          separators=(',', ': '))
+            os.rename(temp_path, self.manifest_path)
+            return True
+        except (IOError, OSError) as e:
+            self.logger.error(u'Failed to save manifest "{}": {}'
+                              .format(self.manifest_path, e))
+            return False
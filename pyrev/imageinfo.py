@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Reads image metadata (size, resolution, color mode) from file headers.
+
+Only headers are read. Pixel data is never decoded, nor even read.
+'''
+
+import os
+import re
+import struct
+
+from cache import StampCache, get_cache_dir
+from storage import local_storage
+
+from logging import getLogger, NullHandler
+from logging import ERROR, WARNING
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+# Many EPUB readers refuse (or silently shrink) images larger than this.
+MAX_EPUB_PIXELS = 4000000
+# Resolutions out of this range are most likely wrong.
+MIN_DPI = 72
+MAX_DPI = 1200
+# TeX cannot handle dimensions larger than this ("Dimension too large").
+TEX_MAX_DIMEN_PT = 16383.99
+# 1 inch in TeX points
+TEX_PT_PER_INCH = 72.27
+
+# SVG root elements are expected within this size.
+SVG_HEAD_SIZE = 4096
+
+r_svg_tag = re.compile(r'<svg\b[^>]*>', re.DOTALL)
+r_svg_attr = re.compile(r'\b(?P<name>width|height|viewBox)\s*=\s*'
+                        r'["\'](?P<value>[^"\']*)["\']')
+r_svg_length = re.compile(r'^\s*(?P<num>[0-9.]+)\s*(?P<unit>px)?\s*$')
+
+
+class ImageInfo(object):
+    def __init__(self, format, width, height, dpi=None, color_mode=None):
+        '''
+        format: 'png', 'jpeg', 'gif' or 'svg'
+        width, height: in pixels. May be None (e.g. SVG without them)
+        dpi: horizontal resolution. None if not specified in the file.
+        color_mode: 'gray', 'rgb', 'palette', 'cmyk', etc.
+        '''
+        self.format = format
+        self.width = width
+        self.height = height
+        self.dpi = dpi
+        self.color_mode = color_mode
+
+    def to_dict(self):
+        return {'format': self.format,
+                'width': self.width,
+                'height': self.height,
+                'dpi': self.dpi,
+                'color_mode': self.color_mode}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['format'], d['width'], d['height'],
+                   d.get('dpi'), d.get('color_mode'))
+
+    def __str__(self):
+        return (u'{} {}x{} (dpi: {}, color: {})'
+                .format(self.format, self.width, self.height,
+                        self.dpi, self.color_mode))
+
+
+def _read_png(f):
+    # IHDR must come first. pHYs must come before the first IDAT.
+    f.seek(8)
+    info = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        (length, chunk_type) = struct.unpack('>I4s', header)
+        if chunk_type == 'IHDR':
+            (width, height, _, color_type) = struct.unpack('>IIBB',
+                                                           f.read(10))
+            color_mode = {0: 'gray', 2: 'rgb', 3: 'palette',
+                          4: 'gray', 6: 'rgb'}.get(color_type)
+            info = ImageInfo('png', width, height, color_mode=color_mode)
+            f.seek(length - 10 + 4, os.SEEK_CUR)
+        elif chunk_type == 'pHYs' and info:
+            (ppu_x, _, unit) = struct.unpack('>IIB', f.read(9))
+            if unit == 1 and ppu_x:
+                # pixels per meter
+                info.dpi = round(ppu_x * 0.0254, 2)
+            f.seek(length - 9 + 4, os.SEEK_CUR)
+        elif chunk_type in ('IDAT', 'IEND') or not info:
+            break
+        else:
+            f.seek(length + 4, os.SEEK_CUR)
+    return info
+
+
+# SOF markers except DHT (0xC4), JPG (0xC8) and DAC (0xCC)
+_jpeg_sof_markers = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+
+def _read_jpeg(f):
+    f.seek(2)
+    dpi = None
+    while True:
+        ch = f.read(1)
+        while ch and ch != '\xff':
+            ch = f.read(1)
+        while ch == '\xff':
+            ch = f.read(1)
+        if not ch:
+            return None
+        marker = ord(ch)
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without length
+            continue
+        if marker in (0xD9, 0xDA):
+            # EOI or SOS appeared before SOF.
+            return None
+        (seg_len,) = struct.unpack('>H', f.read(2))
+        if seg_len < 2:
+            return None
+        if marker == 0xE0:
+            data = f.read(seg_len - 2)
+            if data[:5] == 'JFIF\x00' and len(data) >= 12:
+                (units, density_x) = struct.unpack('>BH', data[7:10])
+                if units == 1 and density_x:
+                    dpi = float(density_x)
+                elif units == 2 and density_x:
+                    dpi = round(density_x * 2.54, 2)
+        elif marker in _jpeg_sof_markers:
+            (_, height, width, num_components) = struct.unpack(
+                '>BHHB', f.read(6))
+            # 4 components means CMYK (or YCCK, which is CMYK too)
+            color_mode = {1: 'gray', 3: 'rgb',
+                          4: 'cmyk'}.get(num_components)
+            return ImageInfo('jpeg', width, height, dpi, color_mode)
+        else:
+            f.seek(seg_len - 2, os.SEEK_CUR)
+
+
+def _read_gif(f):
+    f.seek(6)
+    (width, height) = struct.unpack('<HH', f.read(4))
+    return ImageInfo('gif', width, height, color_mode='palette')
+
+
+def _parse_svg_length(value):
+    m = r_svg_length.match(value)
+    if m:
+        return int(float(m.group('num')))
+    return None
+
+
+def _read_svg(f):
+    f.seek(0)
+    m = r_svg_tag.search(f.read(SVG_HEAD_SIZE))
+    if not m:
+        return None
+    attrs = dict((m2.group('name'), m2.group('value'))
+                 for m2 in r_svg_attr.finditer(m.group(0)))
+    width = _parse_svg_length(attrs.get('width', ''))
+    height = _parse_svg_length(attrs.get('height', ''))
+    if (width is None or height is None) and attrs.get('viewBox'):
+        parts = attrs['viewBox'].replace(',', ' ').split()
+        if len(parts) == 4:
+            try:
+                width = int(float(parts[2]))
+                height = int(float(parts[3]))
+            except ValueError:
+                pass
+    return ImageInfo('svg', width, height)
+
+
+def read_image_info(path, storage=None):
+    '''
+    Reads a header of an image file and returns ImageInfo.
+    Returns None when the format is unknown or the header looks broken.
+    '''
+    storage = storage or local_storage
+    with storage.open(path) as f:
+        head = f.read(16)
+        try:
+            if head.startswith('\x89PNG\r\n\x1a\n'):
+                return _read_png(f)
+            elif head.startswith('\xff\xd8'):
+                return _read_jpeg(f)
+            elif head[:6] in ('GIF87a', 'GIF89a'):
+                return _read_gif(f)
+            elif (path.lower().endswith('.svg')
+                  or head.lstrip().startswith('<')):
+                return _read_svg(f)
+        except struct.error:
+            # Truncated header
+            pass
+    return None
+
+
+def find_image_problems(info):
+    '''
+    Checks ImageInfo and returns a list of (level, desc) for problems
+    which may break EPUB or PDF (LaTeX) builds.
+    '''
+    problems = []
+    if info.width and info.height:
+        if info.width * info.height > MAX_EPUB_PIXELS:
+            problems.append((WARNING,
+                             u'Too large for EPUB ({}x{} > {} pixels)'
+                             .format(info.width, info.height,
+                                     MAX_EPUB_PIXELS)))
+        if info.dpi:
+            longer = max(info.width, info.height)
+            dimen = longer * TEX_PT_PER_INCH / info.dpi
+            if dimen > TEX_MAX_DIMEN_PT:
+                problems.append((ERROR,
+                                 u'Too large for LaTeX at {} dpi ({:.0f}pt)'
+                                 .format(info.dpi, dimen)))
+    if info.dpi and not (MIN_DPI <= info.dpi <= MAX_DPI):
+        problems.append((WARNING,
+                         u'Unusual resolution ({} dpi)'.format(info.dpi)))
+    if info.format == 'jpeg' and info.color_mode == 'cmyk':
+        problems.append((WARNING, u'CMYK JPEG'))
+    return problems
+
+
+def _read_image_info_dict(path, storage=None):
+    info = read_image_info(path, storage)
+    return info.to_dict() if info else None
+
+
+class ImageInspector(object):
+    '''
+    Reads ImageInfo for many files concurrently, with a persistent cache
+    keyed by (path, size, mtime).
+    '''
+
+    def __init__(self, cache=None, workers=4, logger=None, storage=None):
+        '''
+        cache: StampCache. If None, a cache file in get_cache_dir() is used
+          for local files, and an in-memory cache for other storages.
+        storage: where images are read from (the local filesystem if None).
+        '''
+        self.logger = logger or local_logger
+        self.storage = storage or local_storage
+        if cache is None:
+            if self.storage.is_local:
+                cache = StampCache(os.path.join(get_cache_dir(),
+                                                'imageinfo.json'),
+                                   logger=self.logger)
+            else:
+                cache = StampCache(logger=self.logger)
+        self.cache = cache
+        # Archives can't be read concurrently.
+        self.workers = workers if self.storage.is_local else 1
+
+    def inspect(self, paths):
+        '''
+        Returns a dict mapping each path to ImageInfo (or None if the
+        image is not recognizable).
+        '''
+        results = {}
+        stamps = {}
+        misses = []
+        for path in set(paths):
+            try:
+                st = self.storage.stat(path)
+                stamp = (st.st_size, st.st_mtime)
+            except OSError:
+                results[path] = None
+                continue
+            d = self.cache.get(path, stamp)
+            if d is not None:
+                results[path] = ImageInfo.from_dict(d)
+            else:
+                stamps[path] = stamp
+                misses.append(path)
+        self.logger.debug(u'Inspecting {} image(s) ({} cached)'
+                          .format(len(misses), len(results)))
+        if len(misses) > 1 and self.workers > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(self.workers, len(misses)))
+            try:
+                dicts = pool.map(
+                    lambda path: _read_image_info_dict(path, self.storage),
+                    misses)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            dicts = map(lambda path: _read_image_info_dict(path,
+                                                           self.storage),
+                        misses)
+        for (path, d) in zip(misses, dicts):
+            if d is not None:
+                self.cache.put(path, stamps[path], d)
+                results[path] = ImageInfo.from_dict(d)
+            else:
+                results[path] = None
+        self.cache.save()
+        return results
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Loads a project on a slow (network) filesystem by issuing stats and reads
+concurrently, instead of one by one as ReVIEWProject does.
+
+Calls which ReVIEWProject and Parser will make are started ahead in
+a ConcurrentStorage, in the order they will be needed, so that they
+are mostly done when asked for.
+'''
+
+import os
+
+from project import ReVIEWProject
+from storage import ConcurrentStorage, local_storage
+
+from logging import getLogger, NullHandler
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+IO_WORKERS = 8
+
+# Catalog files of older projects, read only when they exist.
+LEGACY_CATALOG_FILES = ['CHAPS', 'PREDEF', 'POSTDEF', 'PART']
+
+
+def _prefetch_source_dir(storage, source_dir, image_dir):
+    (filenames, dirnames) = storage.list_entries(source_dir)
+    paths = map(lambda x: os.path.join(source_dir, x), filenames + dirnames)
+    for method in ['exists', 'islink', 'isfile', 'isdir']:
+        storage.prefetch(method, paths)
+    storage.prefetch('read',
+                     map(lambda x: os.path.join(source_dir, x),
+                         filter(lambda x: (x.endswith(('.yml', '.yaml'))
+                                           or x in LEGACY_CATALOG_FILES),
+                                filenames)))
+    if image_dir in dirnames:
+        image_dir_path = os.path.join(source_dir, image_dir)
+        storage.prefetch('isdir', [image_dir_path])
+        storage.prefetch('list_entries', [image_dir_path])
+
+
+def _prefetch_sources(storage, project):
+    paths = map(lambda x: os.path.normpath(u'{}/{}'.format(
+        project.source_dir, x)), project.source_filenames)
+    storage.prefetch('stat', paths)
+    storage.prefetch('read', paths)
+    storage.prefetch('listdir', project.images.get_sub_dir_paths())
+
+
+def load_project(source_dir, io_workers=IO_WORKERS, logger=None,
+                 storage=None, **kwargs):
+    '''
+    Instantiates ReVIEWProject for source_dir, reading files with
+    "io_workers" threads. Other keyword arguments are passed to
+    ReVIEWProject.instantiate().
+
+    The project reads files through a ConcurrentStorage, which should be
+    closed with project.storage.close() after use.
+    Returns None when the project is not available.
+    '''
+    logger = logger or local_logger
+    storage = ConcurrentStorage(storage or local_storage, io_workers)
+    source_dir = os.path.normpath(storage.abspath(source_dir))
+    try:
+        _prefetch_source_dir(storage, source_dir,
+                             kwargs.get('image_dir') or 'images')
+    except OSError as e:
+        logger.error(u'Failed to list "{}": {}'.format(source_dir, e))
+        storage.close()
+        return None
+    project = ReVIEWProject.instantiate(source_dir, logger=logger,
+                                        storage=storage, **kwargs)
+    if not project:
+        storage.close()
+        return None
+    _prefetch_sources(storage, project)
+    return project
@@ -0,0 +1,609 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Language Server Protocol server (over stdio) for editors.
+
+Documents being edited are split into segments of lines, each of which
+starts where no block continues from the previous line. An edit only
+invalidates segments it touches, and segments after it are reused with
+shifted line numbers, so a keystroke costs parsing a segment or two
+instead of the whole chapter.
+
+Other chapters are read from disk and kept warm with watch.Watcher.
+Diagnostics are published after edits stop for DEBOUNCE_SECONDS.
+'''
+
+import json
+import os
+import re
+import select
+import time
+import urllib
+import urlparse
+
+from parser import Parser, ParseProblem, FileResult
+from watch import Watcher
+
+from logging import getLogger, NullHandler
+from logging import CRITICAL, ERROR, WARNING, INFO
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+DEBOUNCE_SECONDS = 0.2
+
+# A segment is cut at the first line after this many lines where no block
+# continues. Smaller segments make edits cheaper.
+SEGMENT_LINES = 64
+
+# LSP DiagnosticSeverity
+SEVERITY_ERROR = 1
+SEVERITY_WARNING = 2
+SEVERITY_INFORMATION = 3
+SEVERITY_HINT = 4
+
+# Inline names -> names of blocks they refer to.
+INLINE_TARGETS = {'list': ('list', 'listnum'),
+                  'img': ('image', 'indepimage'),
+                  'table': ('table',),
+                  'fn': ('footnote',)}
+
+r_inline = re.compile(r'@<(?P<name>\w+)>\{(?P<content>[^}]*)\}')
+r_astral = re.compile(u'[\U00010000-\U0010ffff]')
+# Lines end with "\r\n", "\r" or "\n" in LSP.
+r_line = re.compile(u'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+$')
+
+
+def path_to_uri(path):
+    return u'file://' + urllib.pathname2url(path.encode('utf-8'))
+
+
+def uri_to_path(uri):
+    parsed = urlparse.urlparse(uri)
+    return urllib.url2pathname(parsed.path.encode('utf-8')).decode('utf-8')
+
+
+def split_lines(text):
+    '''
+    Splits text into lines keeping line endings, like LSP does.
+    '''
+    return r_line.findall(text)
+
+
+def utf16_to_index(text, character):
+    '''
+    Converts a position in UTF-16 code units (used by LSP) to an index
+    of a unicode string.
+    '''
+    if not r_astral.search(text):
+        return character
+    units = 0
+    for (index, ch) in enumerate(text):
+        if units >= character:
+            return index
+        units += 2 if ord(ch) > 0xffff else 1
+    return len(text)
+
+
+def utf16_length(text):
+    return len(text) + len(r_astral.findall(text))
+
+
+class MessageReader(object):
+    '''
+    Reads JSON-RPC messages framed with "Content-Length" headers from
+    a file descriptor, with timeouts.
+    '''
+
+    def __init__(self, fd):
+        self.fd = fd
+        self._buffer = ''
+
+    def _pop_message(self):
+        header_end = self._buffer.find('\r\n\r\n')
+        if header_end < 0:
+            return None
+        length = None
+        for line in self._buffer[:header_end].split('\r\n'):
+            (name, _, value) = line.partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value.strip())
+        if length is None:
+            raise ValueError(u'Content-Length is missing')
+        body_start = header_end + 4
+        if len(self._buffer) < body_start + length:
+            return None
+        body = self._buffer[body_start:body_start + length]
+        self._buffer = self._buffer[body_start + length:]
+        return json.loads(body)
+
+    def read(self, timeout=None):
+        '''
+        Returns a message, or None after timeout (seconds).
+        Raises EOFError when the stream is closed.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            message = self._pop_message()
+            if message is not None:
+                return message
+            if deadline is not None:
+                remaining = max(0, deadline - time.time())
+                (readable, _, _) = select.select([self.fd], [], [],
+                                                 remaining)
+                if not readable:
+                    return None
+            data = os.read(self.fd, 64 * 1024)
+            if not data:
+                raise EOFError()
+            self._buffer += data
+
+
+def write_message(stream, message):
+    body = json.dumps(message)
+    stream.write('Content-Length: {}\r\n\r\n{}'.format(len(body), body))
+    stream.flush()
+
+
+class Segment(object):
+    '''
+    Parse results of consecutive lines in a TextDocument.
+    '''
+
+    def __init__(self, start, num_lines, entry, exit, idle):
+        # The first line (0-based) in the document.
+        self.start = start
+        # Where line numbers in results are based on, which differs from
+        # start after lines are inserted or removed before the segment.
+        self._results_start = start
+        self.num_lines = num_lines
+        # (has bookmarks, chap_index) before and after the segment.
+        self.entry = entry
+        self.exit = exit
+        # False if a block or "#@mapfile" continues after the segment.
+        self.idle = idle
+        # (level, line_num, desc, raw_content) like FileResult
+        self.problems = []
+        # Problems reported if the document ends with this segment.
+        self.end_problems = []
+        self.blocks = []
+        self.inlines = []
+        self.bookmarks = []
+        self.referenced_images = []
+        self.includes = []
+        self.aborted = False
+
+    def update_results(self):
+        '''
+        Shifts line numbers in results for lines inserted (or removed)
+        before this segment.
+        '''
+        delta = self.start - self._results_start
+        if not delta:
+            return
+        shift = lambda x: x + delta if x else x
+        self.problems = map(lambda x: (x[0], shift(x[1]), x[2], x[3]),
+                            self.problems)
+        self.end_problems = map(lambda x: (x[0], shift(x[1]), x[2], x[3]),
+                                self.end_problems)
+        for obj in self.blocks + self.inlines:
+            obj.line_num = shift(obj.line_num)
+        self.referenced_images = map(lambda x: (x[0], shift(x[1]), x[2]),
+                                     self.referenced_images)
+        self._results_start = self.start
+
+
+class TextDocument(object):
+    '''
+    A document being edited, held as a list of lines (unicode).
+    '''
+
+    def __init__(self, uri, text, version=None):
+        self.uri = uri
+        self.path = uri_to_path(uri)
+        self.source_name = os.path.basename(self.path)
+        self.version = version
+        self.lines = split_lines(text)
+        # Segments parsed last time, in order.
+        self.segments = []
+        # Number of lines parsed (not reused) in the last parse().
+        self.num_parsed_lines = 0
+
+    def get_text(self):
+        return u''.join(self.lines)
+
+    def apply_change(self, change):
+        '''
+        Applies a TextDocumentContentChangeEvent.
+        '''
+        if 'range' not in change:
+            self.lines = split_lines(change['text'])
+            self.segments = []
+            return
+        (start, end) = (change['range']['start'], change['range']['end'])
+        (start_line, end_line) = (start['line'], end['line'])
+        prefix = u''
+        if start_line < len(self.lines):
+            line = self.lines[start_line]
+            prefix = line[:utf16_to_index(line, start['character'])]
+        suffix = u''
+        if end_line < len(self.lines):
+            line = self.lines[end_line]
+            suffix = line[utf16_to_index(line, end['character']):]
+        new_lines = split_lines(prefix + change['text'] + suffix)
+        self.lines[start_line:end_line + 1] = new_lines
+        self._update_segments(start_line, end_line + 1,
+                              len(new_lines) - (end_line + 1 - start_line))
+
+    def _update_segments(self, start, end, delta):
+        '''
+        Drops segments overlapping lines [start, end) replaced, and moves
+        segments after them by delta lines.
+        Results are not shifted until they are reused.
+        '''
+        segments = []
+        for segment in self.segments:
+            if segment.start + segment.num_lines <= start:
+                segments.append(segment)
+            elif segment.start >= end:
+                segment.start += delta
+                segments.append(segment)
+        self.segments = segments
+
+    def _parse_segment(self, parser_args, start, bookmarks, chap_index,
+                       stops):
+        parser = Parser(**parser_args)
+        parser.begin_file(0, self.source_name, os.path.dirname(self.path))
+        parser.bookmarks = list(bookmarks)
+        parser.chap_index = chap_index
+        entry = (bool(bookmarks), chap_index)
+        pos = start
+        aborted = False
+        try:
+            while pos < len(self.lines):
+                if (pos > start and parser.is_idle()
+                    and (pos - start >= SEGMENT_LINES or pos in stops)):
+                    break
+                parser.parse_lines([self.lines[pos].encode('utf-8')],
+                                   pos + 1)
+                pos += 1
+        except ParseProblem as e:
+            parser.reporter.problems.append(e)
+            aborted = True
+        self.num_parsed_lines += pos - start
+        segment = Segment(start, pos - start, entry,
+                          (bool(parser.bookmarks), parser.chap_index),
+                          parser.is_idle())
+        to_tuple = lambda x: (x.level, x.line_num, x.desc, x.raw_content)
+        segment.problems = map(to_tuple, parser.reporter.problems)
+        if pos == len(self.lines) and not aborted:
+            parser.end_file(end_of_document=False)
+            segment.end_problems = map(
+                to_tuple, parser.reporter.problems[len(segment.problems):])
+        segment.blocks = parser.all_blocks
+        segment.inlines = parser._current_inlines
+        segment.bookmarks = parser.bookmarks[len(bookmarks):]
+        segment.referenced_images = parser.referenced_images
+        segment.includes = parser.included_paths
+        segment.aborted = aborted
+        return segment
+
+    def parse(self, project=None, abort_threshold=CRITICAL, logger=None):
+        '''
+        Parses the document, reusing segments not affected by edits.
+        Returns FileResult.
+        '''
+        parser_args = {'project': project,
+                       'ignore_threshold': INFO,
+                       'abort_threshold': abort_threshold,
+                       'logger': logger or local_logger}
+        cached = dict((segment.start, segment) for segment in self.segments)
+        self.num_parsed_lines = 0
+        segments = []
+        bookmarks = []
+        chap_index = 0
+        pos = 0
+        while pos < len(self.lines):
+            segment = cached.get(pos)
+            if (segment is not None
+                and segment.entry == (bool(bookmarks), chap_index)
+                and (segment.idle
+                     or pos + segment.num_lines == len(self.lines))):
+                segment.update_results()
+            else:
+                segment = self._parse_segment(parser_args, pos, bookmarks,
+                                              chap_index, cached)
+            segments.append(segment)
+            bookmarks.extend(segment.bookmarks)
+            chap_index = segment.exit[1]
+            pos += segment.num_lines
+            if segment.aborted:
+                break
+        self.segments = segments
+
+        result = FileResult(self.source_name)
+        for segment in segments:
+            result.problems.extend(segment.problems)
+            result.blocks.extend(segment.blocks)
+            result.inlines.extend(segment.inlines)
+            result.referenced_images.extend(segment.referenced_images)
+            result.includes.extend(segment.includes)
+        if segments:
+            result.problems.extend(segments[-1].end_problems)
+            result.aborted = segments[-1].aborted
+        result.bookmarks = bookmarks
+        return result
+
+
+def _get_severity(level):
+    if level >= ERROR:
+        return SEVERITY_ERROR
+    elif level >= WARNING:
+        return SEVERITY_WARNING
+    elif level >= INFO:
+        return SEVERITY_INFORMATION
+    return SEVERITY_HINT
+
+
+class LanguageServer(object):
+    def __init__(self, reader, writer, abort_threshold=CRITICAL,
+                 logger=None):
+        '''
+        reader: MessageReader
+        writer: file-like object where messages are written to.
+        '''
+        self.reader = reader
+        self.writer = writer
+        self.abort_threshold = abort_threshold
+        self.logger = logger or local_logger
+        # uri -> TextDocument
+        self.documents = {}
+        # source_dir -> Watcher (None if not a project)
+        self.watchers = {}
+        # (source_dir, filename, block name, id) -> line_num
+        self.definitions = {}
+        # When diagnostics should be published (None if up to date).
+        self.deadline = None
+        self.shutdown_requested = False
+        self.handlers = {
+            'initialize': self.initialize,
+            'shutdown': self.shutdown,
+            'textDocument/didOpen': self.did_open,
+            'textDocument/didChange': self.did_change,
+            'textDocument/didClose': self.did_close,
+            'textDocument/didSave': self.did_save,
+            'textDocument/definition': self.definition,
+            'workspace/didChangeWatchedFiles': self.did_change_files}
+
+    def send(self, message):
+        message['jsonrpc'] = '2.0'
+        write_message(self.writer, message)
+
+    def notify(self, method, params):
+        self.send({'method': method, 'params': params})
+
+    def _get_watcher(self, source_dir):
+        if source_dir not in self.watchers:
+            watcher = Watcher(source_dir, self.abort_threshold,
+                              logger=self.logger)
+            if not os.path.isdir(source_dir) or not watcher.load_project():
+                watcher = None
+            self.watchers[source_dir] = watcher
+        return self.watchers[source_dir]
+
+    def _schedule(self):
+        self.deadline = time.time() + DEBOUNCE_SECONDS
+
+    def initialize(self, params):
+        return {'capabilities': {'textDocumentSync': {'openClose': True,
+                                                      'change': 2,
+                                                      'save': True},
+                                 'definitionProvider': True},
+                'serverInfo': {'name': 'pyrev'}}
+
+    def shutdown(self, params):
+        self.shutdown_requested = True
+        return None
+
+    def did_open(self, params):
+        item = params['textDocument']
+        self.documents[item['uri']] = TextDocument(item['uri'], item['text'],
+                                                   item.get('version'))
+        self._schedule()
+
+    def did_change(self, params):
+        document = self.documents.get(params['textDocument']['uri'])
+        if not document:
+            return
+        document.version = params['textDocument'].get('version')
+        for change in params['contentChanges']:
+            document.apply_change(change)
+        self._schedule()
+
+    def did_close(self, params):
+        uri = params['textDocument']['uri']
+        if self.documents.pop(uri, None):
+            self.notify('textDocument/publishDiagnostics',
+                        {'uri': uri, 'diagnostics': []})
+        self._schedule()
+
+    def did_save(self, params):
+        self._schedule()
+
+    def did_change_files(self, params):
+        paths = map(lambda x: uri_to_path(x['uri']), params['changes'])
+        for watcher in filter(None, self.watchers.values()):
+            if any(map(watcher.is_project_file, paths)):
+                watcher.load_project()
+        self._schedule()
+
+    def lint(self):
+        '''
+        Parses documents (incrementally) and lints projects containing
+        them, then publishes diagnostics for the documents.
+        '''
+        self.deadline = None
+        by_dir = {}
+        for document in self.documents.itervalues():
+            by_dir.setdefault(os.path.dirname(document.path),
+                              []).append(document)
+        self.definitions = {}
+        for (source_dir, documents) in by_dir.iteritems():
+            watcher = self._get_watcher(source_dir)
+            project = watcher.project if watcher else None
+            overrides = {}
+            for document in documents:
+                overrides[document.source_name] = document.parse(
+                    project, self.abort_threshold, self.logger)
+            results = dict(overrides)
+            try:
+                if project:
+                    watcher.lint(overrides)
+                    problems = watcher.parser.reporter.problems
+                    results.update(watcher.results)
+                else:
+                    problems = []
+                    for (filename, result) in overrides.iteritems():
+                        parser = Parser(ignore_threshold=INFO,
+                                        abort_threshold=self.abort_threshold,
+                                        logger=self.logger)
+                        parser.merge_file_result(result)
+                        problems.extend(parser.reporter.problems)
+            except ParseProblem as e:
+                problems = [e]
+            # Documents not in the catalog are not linted with the project.
+            for document in documents:
+                if project and (document.source_name
+                                not in project.source_filenames):
+                    parser = Parser(project=project,
+                                    ignore_threshold=INFO,
+                                    abort_threshold=self.abort_threshold,
+                                    logger=self.logger)
+                    try:
+                        parser.merge_file_result(
+                            overrides[document.source_name])
+                    except ParseProblem as e:
+                        parser.reporter.problems.append(e)
+                    problems.extend(parser.reporter.problems)
+            self._index_definitions(source_dir, results)
+            for document in documents:
+                self._publish(document,
+                              filter(lambda x: (x.source_name
+                                                == document.source_name),
+                                     problems))
+
+    def _index_definitions(self, source_dir, results):
+        for (filename, result) in results.iteritems():
+            for block in result.blocks:
+                if block.params:
+                    key = (source_dir, filename, block.name, block.params[0])
+                    self.definitions.setdefault(key, block.line_num)
+
+    def _publish(self, document, problems):
+        diagnostics = []
+        for problem in problems:
+            line = max(0, (problem.line_num or 1) - 1)
+            text = (document.lines[line].rstrip(u'\r\n')
+                    if line < len(document.lines) else u'')
+            diagnostics.append(
+                {'range': {'start': {'line': line, 'character': 0},
+                           'end': {'line': line,
+                                   'character': utf16_length(text)}},
+                 'severity': _get_severity(problem.LEVEL),
+                 'source': 'pyrev',
+                 'message': problem.desc})
+        self.notify('textDocument/publishDiagnostics',
+                    {'uri': document.uri,
+                     'version': document.version,
+                     'diagnostics': diagnostics})
+
+    def definition(self, params):
+        document = self.documents.get(params['textDocument']['uri'])
+        if not document:
+            return None
+        if self.deadline is not None:
+            self.lint()
+        position = params['position']
+        if position['line'] >= len(document.lines):
+            return None
+        text = document.lines[position['line']]
+        index = utf16_to_index(text, position['character'])
+        for m in r_inline.finditer(text):
+            if not m.start() <= index < m.end():
+                continue
+            block_names = INLINE_TARGETS.get(m.group('name'))
+            if not block_names:
+                return None
+            (filename, _, block_id) = m.group('content').rpartition('|')
+            filename = (u'{}.re'.format(filename) if filename
+                        else document.source_name)
+            source_dir = os.path.dirname(document.path)
+            for block_name in block_names:
+                line_num = self.definitions.get((source_dir, filename,
+                                                 block_name, block_id))
+                if line_num:
+                    position = {'line': line_num - 1, 'character': 0}
+                    return {'uri': path_to_uri(os.path.join(source_dir,
+                                                            filename)),
+                            'range': {'start': position, 'end': position}}
+        return None
+
+    def handle(self, message):
+        method = message.get('method')
+        handler = self.handlers.get(method)
+        if 'id' not in message:
+            # Notification
+            if method == 'exit':
+                raise EOFError()
+            if handler:
+                handler(message.get('params') or {})
+            return
+        if not handler:
+            self.send({'id': message['id'],
+                       'error': {'code': -32601,
+                                 'message': u'Unknown method "{}"'
+                                 .format(method)}})
+            return
+        try:
+            result = handler(message.get('params') or {})
+            self.send({'id': message['id'], 'result': result})
+        except Exception as e:
+            self.logger.exception(u'Failed to handle "{}"'.format(method))
+            self.send({'id': message['id'],
+                       'error': {'code': -32603, 'message': unicode(e)}})
+
+    def run(self):
+        '''
+        Handles messages until "exit". Returns an exit status.
+        '''
+        while True:
+            timeout = None
+            if self.deadline is not None:
+                timeout = max(0, self.deadline - time.time())
+            try:
+                message = self.reader.read(timeout)
+            except EOFError:
+                break
+            if message is None:
+                self.lint()
+                continue
+            try:
+                self.handle(message)
+            except EOFError:
+                break
+        return 0 if self.shutdown_requested else 1
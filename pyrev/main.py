@@ -20,92 +20,803 @@ u'''\
 Py-Re:VIEW: A Re:VIEW tool written in Python.
 '''
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
-from logging import getLogger, StreamHandler
+from logging import getLogger, StreamHandler, NullHandler
 from logging import CRITICAL, ERROR, WARNING, INFO, DEBUG
 
-from parser import Parser, ParseProblem
-from project import ReVIEWProject
 from version import VERSION
 
+import tracing
+
+# parser, project (with PyYAML) and multiprocessing are imported
+# in functions using them, since pyrev is often invoked just for
+# a small file (e.g. from editors and pre-commit hooks) and startup time
+# matters there.
+
+import itertools
 import os
 import sys
+import time
 import traceback
 
-def lint(args, logger):
-    logger.debug('Start running "lint".')
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+# Exit status for each project linted.
+STATUS_OK = 0
+STATUS_PROBLEM = 1
+STATUS_FAILED = 2
+
+_level_names = {'CRITICAL': CRITICAL,
+                'ERROR': ERROR,
+                'WARNING': WARNING,
+                'INFO': INFO,
+                'DEBUG': DEBUG}
+
+
+def _get_level(level_name):
+    level = _level_names.get(level_name)
+    if level is None:
+        raise RuntimeError(u'Unknown level "{}"'.format(level_name))
+    return level
+
+
+def _lint_project(project, abort_threshold, logger, jobs=1,
+                  parse_cache=None, filenames=None, listener=None,
+                  instruments=None):
+    '''
+    Parses all source files in a project and returns the Parser
+    holding problems.
+
+    jobs: number of processes parsing files. Small projects are parsed
+      in this process regardless of this.
+    parse_cache: ParseCache (see parsecache.py) where results of unchanged
+      files are reused from. If None, all files are parsed.
+    filenames: source files parsed instead of all, which must be in
+      catalog order.
+    listener: called with each problem reported (see
+      ProblemReporter.add_listener()).
+    instruments: objects measuring the Parser, attached with their
+      attach(parser) (e.g. RuleProfiler). If given, all files are parsed
+      in this process, ignoring jobs and parse_cache, so that every file
+      is measured.
+    '''
+    from parser import Parser
+    project.parse_source_files()
+    if filenames is None:
+        filenames = project.source_filenames
+    parser = Parser(project=project,
+                    ignore_threshold=INFO,
+                    abort_threshold=abort_threshold,
+                    logger=logger)
+    if listener:
+        parser.reporter.add_listener(listener)
+    if instruments:
+        for instrument in instruments:
+            instrument.attach(parser)
+        (jobs, parse_cache) = (1, None)
+    if parse_cache:
+        import parsecache
+        parsecache.parse_files(parser, project, filenames, parse_cache,
+                               jobs, logger)
+        parser.check_images()
+        return parser
+    if jobs > 1:
+        import parallel
+        if parallel.should_parse_in_parallel(project, filenames, jobs):
+            parallel.parse_files(parser, project, filenames, jobs, logger)
+            parser.check_images()
+            return parser
+    for filename in filenames:
+        logger.debug('Parsing "{}"'.format(filename))
+        path = os.path.normpath(u'{}/{}'.format(project.source_dir,
+                                                filename))
+        parser.parse_file(path, 0, filename)
+    parser.check_images()
+    return parser
+
+
+def _lint_project_in_batch(params):
+    '''
+    Lints a single project for lint_projects().
+    This may run in a worker process, so accepts and returns plain tuples.
+
+    params: (source_dir, abort_threshold)
+    Returns (source_dir, status, lines, elapsed, trace events)
+    '''
+    from parser import ParseProblem
+    from project import ReVIEWProject
+    (source_dir, abort_threshold) = params
+    logger = local_logger
+    start = time.time()
+    lines = []
+    try:
+        project = ReVIEWProject.instantiate(source_dir, logger=logger)
+        if project:
+            parser = _lint_project(project, abort_threshold, logger)
+            parser._dump_problems(dump_func=lines.append)
+            if parser.reporter.problems:
+                status = STATUS_PROBLEM
+            else:
+                status = STATUS_OK
+        else:
+            lines.append(u'Failed to instanciate Re:VIEW Project.')
+            status = STATUS_FAILED
+    except ParseProblem as e:
+        lines.append(u'Aborted: {}'.format(unicode(e)))
+        status = STATUS_FAILED
+    except Exception:
+        lines.append(traceback.format_exc().decode('utf-8', 'replace'))
+        status = STATUS_FAILED
+    return (source_dir, status, lines, time.time() - start,
+            tracing.take_worker_events())
 
-    if args.unacceptable_level == 'CRITICAL':
-        unacceptable_level = CRITICAL
-    elif args.unacceptable_level == 'ERROR':
-        unacceptable_level = ERROR
-    elif args.unacceptable_level == 'WARNING':
-        unacceptable_level = WARNING
-    elif args.unacceptable_level == 'INFO':
-        unacceptable_level = INFO
-    elif args.unacceptable_level == 'DEBUG':
-        unacceptable_level = DEBUG
+
+def lint_projects(base_dir, abort_threshold, jobs, logger, dump_func=None):
+    '''
+    Finds all Re:VIEW projects under base_dir and lints them in a single
+    process (or a single pool of "jobs" worker processes).
+    Problems are reported grouped by project.
+
+    Returns the worst status among the projects.
+    '''
+    from project import ReVIEWProject
+    dump_func = dump_func or (lambda x: sys.stdout.write(u'{}\n'.format(x)))
+    start = time.time()
+    source_dirs = ReVIEWProject.find_source_dirs(base_dir)
+    logger.debug(u'{} project(s) found under "{}"'
+                 .format(len(source_dirs), base_dir))
+    if not source_dirs:
+        logger.error(u'No Re:VIEW project found under "{}"'.format(base_dir))
+        return STATUS_FAILED
+
+    params = map(lambda x: (x, abort_threshold), source_dirs)
+    pool = None
+    if jobs > 1 and len(source_dirs) > 1:
+        from multiprocessing import Pool
+        pool = Pool(min(jobs, len(source_dirs)), tracing.init_worker,
+                    (tracing.is_tracing(),))
+        results = pool.imap(_lint_project_in_batch, params)
     else:
-        raise RuntimeError(u'Unknown level "{}"'
-                           .format(args.unacceptable_level))
+        results = itertools.imap(_lint_project_in_batch, params)
 
-    file_path = os.path.abspath(args.filename)
+    status_names = {STATUS_OK: u'OK',
+                    STATUS_PROBLEM: u'PROBLEM',
+                    STATUS_FAILED: u'FAILED'}
+    counts = dict.fromkeys(status_names, 0)
+    try:
+        for (source_dir, status, lines, elapsed, events) in results:
+            tracing.add_events(events)
+            counts[status] += 1
+            rel_path = os.path.relpath(source_dir, base_dir)
+            dump_func(u'== {} ({:.3f}s): {} =='
+                      .format(rel_path, elapsed, status_names[status]))
+            for line in lines:
+                dump_func(line)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    dump_func(u'Linted {} project(s) in {:.3f}s: {} ok, {} with problems,'
+              u' {} failed'
+              .format(len(source_dirs), time.time() - start,
+                      counts[STATUS_OK], counts[STATUS_PROBLEM],
+                      counts[STATUS_FAILED]))
+    return max(status for status in counts if counts[status])
 
-    if not os.path.exists(file_path):
-        logger.error(u'"{}" does not exist'.format(args.filename))
-        return
 
-    elif os.path.isdir(file_path):
-        logger.debug(u'"{}" is a directory.'.format(file_path))
-        source_dir = ReVIEWProject.guess_source_dir(file_path)
-        logger.debug(u'source_dir: {}'.format(source_dir))
+def lint_profiles(source_dir, config_files, abort_threshold, logger,
+                  storage=None, dump_func=None):
+    '''
+    Lints a project for each config file (build profile), parsing each
+    source file only once. Problems are reported grouped by profile.
+
+    Returns the worst status among the profiles.
+    '''
+    from parser import ParseProblem
+    # Not needed unless --config is given.
+    from profiles import load_profiles, ProfileLinter
+    dump_func = dump_func or (lambda x: sys.stdout.write(u'{}\n'.format(x)))
+    try:
+        profiles = load_profiles(source_dir, config_files, logger=logger,
+                                 storage=storage)
+        if not profiles:
+            return STATUS_FAILED
+        ProfileLinter(profiles, abort_threshold, logger=logger).lint()
+    except ParseProblem as e:
+        dump_func(u'Aborted: {}'.format(unicode(e)))
+        return STATUS_FAILED
+    except Exception as e:
+        # e.g. a broken catalog file
+        logger.debug(traceback.format_exc())
+        logger.error(u'Failed to lint profiles: {}'.format(e))
+        return STATUS_FAILED
+    worst = STATUS_OK
+    for profile in profiles:
+        project = profile.project
+        status = STATUS_PROBLEM if profile.problems else STATUS_OK
+        worst = max(worst, status)
+        dump_func(u'== {} (catalog: {}, images: {}, {} file(s)): {} =='
+                  .format(profile.config_file, project.catalog_file,
+                          project.image_dir, len(project.source_filenames),
+                          u'PROBLEM' if status else u'OK'))
+        profile.parser._dump_problems(dump_func=dump_func)
+    return worst
+
+
+def _select_changed_files(project, repository, changed_paths, root, rev,
+                          graph, abort_threshold, parse_cache, logger):
+    '''
+    Returns source files of project whose results may change with
+    changed_paths (relative to repository's root), in catalog order.
+    graph (DependencyGraph) is brought up to date on the way.
+    '''
+    from parser import Parser
+    from parsecache import parse_file
+    from project import ReVIEWProject
+    from storage import MemoryStorage
+    from vcs import to_storage_path
+    # Path relative to source_dir -> path relative to the repository
+    repo_paths = dict(map(lambda x: (os.path.relpath(
+        to_storage_path(root, x), project.source_dir), x), changed_paths))
+    common_files = (set(ReVIEWProject.RELATED_FILES)
+                    | set(project._catalog_files)
+                    | set([project.config_file]))
+    if common_files.intersection(repo_paths):
+        logger.info(u'Config or catalog changed')
+        return list(project.source_filenames)
+
+    new_parser = lambda: Parser(project=project,
+                                ignore_threshold=INFO,
+                                abort_threshold=abort_threshold,
+                                logger=logger)
+    # Deps of changed files before the change, from the graph if it
+    # still knows them.
+    previous = {}
+    for filename in project.source_filenames:
+        if filename not in repo_paths:
+            continue
+        data = repository.cat_file('{}:{}'.format(rev or 'HEAD',
+                                                  repo_paths[filename]))
+        if data is None:
+            continue
+        deps = graph.files.get(filename)
+        if not graph.is_valid(project, data, deps):
+            path = os.path.join(project.source_dir, filename)
+            result = new_parser().parse_file_to_result(
+                path, filename, storage=MemoryStorage({path: data}))
+            deps = graph.get_deps(project, filename, result, data)
+        previous[filename] = deps
+    graph.refresh(project,
+                  lambda x: parse_file(new_parser(), project, x, parse_cache))
+
+    affected = set(graph.get_affected(repo_paths, previous))
+    # Images added for (or removed from) a chapter.
+    for filename in project.source_filenames:
+        for image in project.images.get(filename) or []:
+            if image.rel_path in repo_paths:
+                affected.add(filename)
+    changed = filter(lambda x: x in repo_paths, project.source_filenames)
+    logger.info(u'{} changed file(s), {} affected in total'
+                .format(len(changed), len(affected)))
+    return filter(lambda x: x in affected, project.source_filenames)
+
+
+def _get_listener(writer, baseline=None, source_names=None):
+    '''
+    Returns a listener for ProblemReporter passing problems to writer,
+    leaving out ones in baseline or not in source_names.
+    '''
+    def listener(problem):
+        if (source_names is not None
+            and problem.source_name not in source_names):
+            return
+        if baseline and not baseline.accept(problem):
+            return
+        writer.write(problem)
+    return listener
+
+
+def lint_changes(file_path, unacceptable_level, logger, since=None,
+                 staged=False, jobs=1, use_cache=False, dump_func=None,
+                 baseline=None, writer=None, instruments=None):
+    '''
+    Lints source files changed since a revision ("since", HEAD by default)
+    in a git repository, and files whose results may change with them
+    (see depgraph.py).
+    With staged, files in the index are linted instead of the working tree.
+
+    Files before the changed ones in catalog order are parsed too, since
+    checks across files depend on them, though their problems are not
+    reported.
+
+    writer: ProblemWriter (see output.py). If None, problems are printed
+      through dump_func.
+    '''
+    from output import TextWriter
+    from parser import ParseProblem
+    from project import ReVIEWProject
+    from depgraph import DependencyGraph, DEPS_FILENAME
+    from vcs import GitError, GitRepository, GitIndexStorage
+    dump_func = dump_func or (lambda x: sys.stdout.write(u'{}\n'.format(x)))
+    writer = writer or TextWriter(dump_func)
+    try:
+        repository = GitRepository(file_path, logger=logger)
+    except GitError as e:
+        logger.error(unicode(e))
+        return STATUS_FAILED
+    rel_path = os.path.relpath(os.path.realpath(file_path), repository.root)
+    if rel_path.startswith(os.pardir):
+        logger.error(u'"{}" is not in "{}"'.format(file_path, repository.root))
+        return STATUS_FAILED
+    storage = None
+    try:
+        if staged:
+            storage = GitIndexStorage(repository)
+            root = u'/'
+        else:
+            root = repository.root
+        changed_paths = repository.get_changed_paths(since, staged)
+        source_dir = ReVIEWProject.guess_source_dir(
+            os.path.normpath(os.path.join(root, rel_path)), storage=storage)
         if not source_dir:
             logger.error(u'Failed to detect source_dir')
-            return
-        project = ReVIEWProject.instantiate(source_dir, logger=logger)
+            return STATUS_FAILED
+        project = ReVIEWProject.instantiate(source_dir, logger=logger,
+                                            storage=storage)
         if not project:
             logger.error(u'Failed to instanciate Re:VIEW Project ({}).'
                          .format(source_dir))
-            return
-        project.parse_source_files()
+            return STATUS_FAILED
+        parse_cache = None
+        # Saved in the working tree even with staged, since entries are
+        # checked with digests of files anyway.
+        graph = DependencyGraph(project.source_dir, path=os.path.join(
+            repository.root, os.path.relpath(source_dir, root),
+            DEPS_FILENAME), logger=logger)
+        if use_cache:
+            from parsecache import ParseCache
+            parse_cache = ParseCache(logger=logger)
+            graph.load()
+        selected = _select_changed_files(project, repository, changed_paths,
+                                         root, since, graph,
+                                         unacceptable_level, parse_cache,
+                                         logger)
+        if use_cache:
+            graph.save()
+        filenames = []
+        if selected:
+            last = project.source_filenames.index(selected[-1])
+            filenames = project.source_filenames[:last + 1]
+        writer.begin()
         try:
-            parser = Parser(project=project,
-                            ignore_threshold=INFO,
-                            abort_threshold=unacceptable_level,
-                            logger=logger)
-            for filename in project.source_filenames:
-                logger.debug('Parsing "{}"'.format(filename))
-                path = os.path.normpath(u'{}/{}'.format(project.source_dir,
-                                                        filename))
-                parser.parse_file(path, 0, filename)
-                dump_func = lambda x: sys.stdout.write(u'{}\n'.format(x))
-            # parser._dump_blocks(dump_func=dump_func)
-            parser._dump_problems(dump_func=dump_func)
+            _lint_project(project, unacceptable_level, logger, jobs,
+                          parse_cache, filenames,
+                          _get_listener(writer, baseline, set(selected)),
+                          instruments)
         except ParseProblem:
-            logger.error(traceback.format_exc())
+            writer.end(aborted=True)
+            raise
+        if baseline:
+            baseline.finish(selected)
+        with tracing.span(u'output', problems=writer.count):
+            writer.end()
+        return STATUS_PROBLEM if writer.count else STATUS_OK
+    except GitError as e:
+        logger.error(unicode(e))
+        return STATUS_FAILED
+    except ParseProblem:
+        logger.error(traceback.format_exc())
+        return STATUS_FAILED
+    finally:
+        if storage:
+            storage.close()
+        else:
+            repository.close()
+
+
+def _lint_dir(base_dir, unacceptable_level, logger, storage=None,
+              config_files=None, jobs=1, io_workers=0, use_cache=False,
+              baseline=None, writer=None, instruments=None):
+    from output import TextWriter
+    from parser import ParseProblem
+    from project import ReVIEWProject
+    source_dir = ReVIEWProject.guess_source_dir(base_dir, storage=storage)
+    logger.debug(u'source_dir: {}'.format(source_dir))
+    if not source_dir:
+        logger.error(u'Failed to detect source_dir')
+        return
+    if config_files:
+        return lint_profiles(source_dir, config_files, unacceptable_level,
+                             logger, storage)
+    if io_workers > 0:
+        from loader import load_project
+        project = load_project(source_dir, io_workers, logger=logger,
+                               storage=storage)
+    else:
+        project = ReVIEWProject.instantiate(source_dir, logger=logger,
+                                            storage=storage)
+    if not project:
+        logger.error(u'Failed to instanciate Re:VIEW Project ({}).'
+                     .format(source_dir))
+        return
+    parse_cache = None
+    if use_cache:
+        from parsecache import ParseCache
+        parse_cache = ParseCache(logger=logger)
+    writer = writer or TextWriter(
+        lambda x: sys.stdout.write(u'{}\n'.format(x)))
+    writer.begin()
+    try:
+        _lint_project(project, unacceptable_level, logger, jobs,
+                      parse_cache, listener=_get_listener(writer, baseline),
+                      instruments=instruments)
+        if baseline:
+            baseline.finish()
+        with tracing.span(u'output', problems=writer.count):
+            writer.end()
+    except ParseProblem:
+        writer.end(aborted=True)
+        logger.error(traceback.format_exc())
+    finally:
+        if io_workers > 0:
+            project.storage.close()
+
+
+def _lint_file(file_path, unacceptable_level, logger, dump_func=None,
+               baseline=None, writer=None, instruments=None):
+    '''
+    Lints a single source file, without checks needing its project
+    (e.g. references to other chapters).
+    Raises ParseProblem when aborted.
+    '''
+    from output import TextWriter
+    from parser import Parser, ParseProblem
+    from project import ReVIEWProject
+    dump_func = dump_func or (lambda x: sys.stdout.write(u'{}\n'.format(x)))
+    writer = writer or TextWriter(dump_func)
+    source_dir = os.path.dirname(file_path)
+    project = ReVIEWProject(source_dir, logger=logger)
+    project.parse_source_files()
+
+    parser = Parser(project=project,
+                    ignore_threshold=INFO,
+                    abort_threshold=unacceptable_level,
+                    logger=logger)
+    parser.reporter.add_listener(_get_listener(writer, baseline))
+    for instrument in instruments or []:
+        instrument.attach(parser)
+    source_name = os.path.basename(file_path)
+    writer.begin()
+    try:
+        parser.parse_file(file_path, 0, source_name)
+    except ParseProblem:
+        writer.end(aborted=True)
+        raise
+    if baseline:
+        baseline.finish([source_name])
+    with tracing.span(u'output', problems=writer.count):
+        writer.end()
+
+
+def _lint_with_server(file_path, args, logger):
+    '''
+    Lets a lint server (see server.py) lint file_path if it is running.
+    Returns False if there's no server.
+    '''
+    from client import send_request
+    response = send_request({'path': file_path,
+                             'unacceptable_level': args.unacceptable_level},
+                            logger=logger)
+    if response is None:
+        return False
+    logger.debug(u'Linted by server (pid {})'.format(response.get('pid')))
+    if response.get('error'):
+        logger.error(response['error'])
+    # Encoded as get_writer() does, since stdout may be a pipe.
+    for line in response.get('lines') or []:
+        sys.stdout.write(line.encode('utf-8') + '\n')
+    return True
+
+
+def _can_use_server(file_path, args, baseline):
+    '''
+    Returns True if a lint server may lint file_path for args.
+    Requests carry only unacceptable_level, so any other option changing
+    how or what to lint makes pyrev lint by itself.
+    '''
+    return (not args.no_server
+            and not (args.since or args.staged)
+            and not baseline
+            and args.format == 'text'
+            and not (args.profile or args.profile_json or args.stats)
+            and not args.trace
+            and not args.output
+            and not args.recursive
+            and not args.config_files
+            and not args.no_cache
+            and args.jobs == 1
+            and not args.io_workers
+            and (os.path.isdir(file_path) or file_path.endswith('.re')))
+
+
+def _is_archive(file_path):
+    # Avoids importing storage (zipfile, tarfile) for .re files.
+    if file_path.endswith('.re'):
+        return False
+    from storage import ArchiveStorage
+    return ArchiveStorage.is_archive(file_path)
+
+
+def _load_baseline(args, logger):
+    '''
+    Returns a Baseline for --baseline, or None.
+    Raises RuntimeError if it can't be used.
+    '''
+    if not args.baseline:
+        if args.update_baseline:
+            raise RuntimeError(u'--update-baseline requires --baseline')
+        return None
+    if args.recursive or args.config_files:
+        raise RuntimeError(u'--baseline is not available with -r or -c')
+    from baseline import Baseline
+    baseline = Baseline(args.baseline, update=args.update_baseline,
+                        logger=logger)
+    try:
+        if not baseline.load() and not args.update_baseline:
+            raise RuntimeError(u'Baseline "{}" does not exist'
+                               .format(args.baseline))
+    except (IOError, ValueError) as e:
+        raise RuntimeError(u'Failed to load baseline "{}": {}'
+                           .format(args.baseline, e))
+    return baseline
+
+
+def _lint_path(file_path, args, unacceptable_level, logger, baseline,
+               writer, instruments):
+    if args.since or args.staged:
+        if not os.path.isdir(file_path):
+            logger.error(u'"{}" is not a directory'.format(args.filename))
+            return STATUS_FAILED
+        return lint_changes(file_path, unacceptable_level, logger,
+                            since=args.since, staged=args.staged,
+                            jobs=args.jobs, use_cache=not args.no_cache,
+                            baseline=baseline, writer=writer,
+                            instruments=instruments)
+
+    elif os.path.isdir(file_path):
+        logger.debug(u'"{}" is a directory.'.format(file_path))
+        return _lint_dir(file_path, unacceptable_level, logger,
+                         config_files=args.config_files, jobs=args.jobs,
+                         io_workers=args.io_workers,
+                         use_cache=not args.no_cache, baseline=baseline,
+                         writer=writer, instruments=instruments)
+    elif _is_archive(file_path):
+        from storage import ArchiveStorage
+        logger.debug(u'"{}" is an archive.'.format(file_path))
+        storage = ArchiveStorage(file_path)
+        try:
+            return _lint_dir(u'/', unacceptable_level, logger, storage,
+                             args.config_files,
+                             io_workers=args.io_workers,
+                             use_cache=not args.no_cache,
+                             baseline=baseline, writer=writer,
+                             instruments=instruments)
+        finally:
+            storage.close()
     else:
         logger.debug(u'"{}" is a file. Interpret a single script.'
                      .format(args.filename))
+        from parser import ParseProblem
         try:
-            source_dir = os.path.dirname(file_path)
-            project = ReVIEWProject(source_dir, logger=logger)
-            project.parse_source_files()
-
-            parser = Parser(project=project,
-                            ignore_threshold=INFO,
-                            abort_threshold=unacceptable_level,
-                            logger=logger)
-            source_name = os.path.basename(args.filename)
-            parser.parse_file(args.filename, 0, source_name)
-            dump_func = lambda x: sys.stdout.write(u'{}\n'.format(x))
-            parser._dump_problems(dump_func=dump_func)
+            _lint_file(file_path, unacceptable_level, logger,
+                       baseline=baseline, writer=writer,
+                       instruments=instruments)
         except ParseProblem:
             logger.error(traceback.format_exc())
 
 
+def lint(args, logger):
+    logger.debug('Start running "lint".')
+
+    unacceptable_level = _get_level(args.unacceptable_level)
+
+    file_path = os.path.abspath(args.filename)
+
+    if not os.path.exists(file_path):
+        logger.error(u'"{}" does not exist'.format(args.filename))
+        return
+
+    if ((args.recursive or args.config_files)
+        and (args.format != 'text' or args.output
+             or args.profile or args.profile_json or args.stats)):
+        logger.error(u'--format, --output, --profile and --stats are not'
+                     u' available with -r or -c')
+        return STATUS_FAILED
+
+    try:
+        baseline = _load_baseline(args, logger)
+    except RuntimeError as e:
+        logger.error(unicode(e))
+        return STATUS_FAILED
+
+    if (_can_use_server(file_path, args, baseline)
+        and _lint_with_server(file_path, args, logger)):
+        return
+
+    if not args.trace:
+        return _lint_locally(file_path, args, unacceptable_level, logger,
+                             baseline)
+    tracing.start()
+    try:
+        with tracing.span(u'lint', path=file_path):
+            return _lint_locally(file_path, args, unacceptable_level,
+                                 logger, baseline)
+    finally:
+        try:
+            tracing.stop().save(args.trace)
+        except IOError as e:
+            logger.error(u'Failed to save trace "{}": {}'
+                         .format(args.trace, e))
+
+
+def _lint_locally(file_path, args, unacceptable_level, logger, baseline):
+    '''
+    Lints file_path in this process (and its workers) for lint().
+    '''
+    if args.recursive:
+        if not os.path.isdir(file_path):
+            logger.error(u'"{}" is not a directory'.format(args.filename))
+            return STATUS_FAILED
+        return lint_projects(file_path, unacceptable_level, args.jobs, logger)
+
+    from output import get_writer
+    try:
+        stream = open(args.output, 'wb') if args.output else sys.stdout
+    except IOError as e:
+        logger.error(u'Failed to open "{}": {}'.format(args.output, e))
+        return STATUS_FAILED
+    instruments = []
+    if args.profile or args.profile_json:
+        from profiler import RuleProfiler
+        profiler = RuleProfiler()
+        instruments.append(profiler)
+    if args.stats:
+        from filestats import FileStats
+        file_stats = FileStats()
+        instruments.append(file_stats)
+    # Reports are kept out of the standard output, which may be jsonl or
+    # sarif.
+    dump_func = lambda x: sys.stderr.write(u'{}\n'.format(x))
+    try:
+        return _lint_path(file_path, args, unacceptable_level, logger,
+                          baseline, get_writer(args.format, stream),
+                          instruments)
+    finally:
+        if args.output:
+            stream.close()
+        if args.profile:
+            profiler.dump(dump_func)
+        if args.profile_json:
+            profiler.save(args.profile_json)
+        if args.stats:
+            file_stats.dump(dump_func, args.stats_top)
+
+
+def add_lint_arguments(parser):
+    '''
+    Adds arguments for lint() to an ArgumentParser.
+    Shared by pyrev and "pyrev-devel lint".
+    '''
+    parser.add_argument('filename',
+                        help=(u'A source file, a project directory, or'
+                              u' a zip/tar archive of a project.'))
+    parser.add_argument('-u', '--unacceptable_level',
+                        action='store',
+                        default='CRITICAL',
+                        help=(u'Error level that aborts the check.'))
+    parser.add_argument('-r', '--recursive',
+                        action='store_true',
+                        help=(u'Treat filename as a root directory and lint'
+                              u' all Re:VIEW projects under it.'))
+    parser.add_argument('-j', '--jobs',
+                        action='store',
+                        type=int,
+                        default=1,
+                        help=(u'Number of worker processes, parsing'
+                              u' projects (with -r) or files in a project.'))
+    parser.add_argument('--io-workers',
+                        action='store',
+                        type=int,
+                        default=0,
+                        metavar='N',
+                        help=(u'Number of threads reading files of a project'
+                              u' concurrently. Helps on slow network'
+                              u' filesystems. 0 reads files one by one.'))
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help=(u'Parse all files again instead of reusing'
+                              u' results of unchanged files cached in'
+                              u' previous runs.'))
+    parser.add_argument('--no-server',
+                        action='store_true',
+                        help=(u'Lint in this process even if a lint server'
+                              u' ("pyrev-devel serve") is running.'))
+    parser.add_argument('--since',
+                        action='store',
+                        metavar='REV',
+                        help=(u'Lint only source files changed since a git'
+                              u' revision (and files referring to them).'))
+    parser.add_argument('--staged',
+                        action='store_true',
+                        help=(u'Lint files staged in the git index instead'
+                              u' of the working tree. Only ones changed'
+                              u' from HEAD (or --since) are linted.'))
+    parser.add_argument('--baseline',
+                        action='store',
+                        metavar='FILE',
+                        help=(u'Report only problems not recorded in a'
+                              u' baseline file.'))
+    parser.add_argument('--update-baseline',
+                        action='store_true',
+                        help=(u'Record problems found into the baseline'
+                              u' file (creating it if missing) instead of'
+                              u' reporting them.'))
+    parser.add_argument('--format',
+                        action='store',
+                        choices=['text', 'jsonl', 'sarif'],
+                        default='text',
+                        help=(u'Output format of problems. "jsonl" writes'
+                              u' a JSON object per problem, and "sarif"'
+                              u' a SARIF 2.1.0 log.'))
+    parser.add_argument('-o', '--output',
+                        action='store',
+                        metavar='FILE',
+                        help=(u'Write problems to a file instead of the'
+                              u' standard output.'))
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help=(u'Print time spent in each lint rule and'
+                              u' parser phase to the standard error.'
+                              u' Files are parsed in this process without'
+                              u' the cache.'))
+    parser.add_argument('--profile-json',
+                        action='store',
+                        metavar='FILE',
+                        help=(u'Save what --profile prints as JSON.'))
+    parser.add_argument('--stats',
+                        action='store_true',
+                        help=(u'Print lines, bytes, parse time and memory'
+                              u' retained for each source file, listing the'
+                              u' slowest and heaviest ones. Memory is'
+                              u' measured with tracemalloc if available.'
+                              u' Otherwise it is a rough estimate from'
+                              u' sizes of blocks, inlines and problems of'
+                              u' each file, labeled "Est.Mem".'))
+    parser.add_argument('--stats-top',
+                        action='store',
+                        type=int,
+                        default=10,
+                        metavar='N',
+                        help=(u'Number of files listed by --stats.'))
+    parser.add_argument('--trace',
+                        action='store',
+                        metavar='FILE',
+                        help=(u'Save a timeline of the run (project loading,'
+                              u' parsing of each file, checks and output)'
+                              u' as Chrome trace events, viewable in'
+                              u' chrome://tracing or Perfetto.'))
+    parser.add_argument('-c', '--config',
+                        action='append',
+                        dest='config_files',
+                        metavar='CONFIG_FILE',
+                        help=(u'Config file of a build profile, relative to'
+                              u' the source directory. Repeat this to lint'
+                              u' multiple profiles at once.'))
+
+
 def main():
     parser = ArgumentParser(description=(__doc__),
                             formatter_class=ArgumentDefaultsHelpFormatter)
-    parser.add_argument('filename')
     parser.add_argument('--log',
                         default='INFO',
                         help=('Set log level. e.g. DEBUG, INFO, WARN'))
@@ -116,10 +827,7 @@ def main():
                         action='version',
                         version=u"%(prog)s {}".format(VERSION),
                         help=u'Show version and exit.')
-    parser.add_argument('-u', '--unacceptable_level',
-                        action='store',
-                        default='CRITICAL',
-                        help=(u'Error level that aborts the check.'))
+    add_lint_arguments(parser)
     args = parser.parse_args()
     if args.debug:
         args.log = 'DEBUG'
@@ -130,8 +838,10 @@ def main():
     handler.setLevel(args.log.upper())
     logger.addHandler(handler)
 
-    lint(args, logger)
+    return lint(args, logger)
 
 
 if __name__ == '__main__':
-    main()
+    ret = main()
+    if ret:
+        sys.exit(ret)
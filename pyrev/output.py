@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Writers of problems in formats for humans and tools:
+
+ text ... what pyrev has always printed (see Parser._dump_problems())
+ jsonl ... a JSON object per line
+ sarif ... SARIF 2.1.0, read by code scanning services
+
+Problems are written one by one as they are reported (see
+ProblemReporter.add_listener()), so a large report is never held in
+memory as formatted text.
+'''
+
+import json
+import re
+import urllib
+
+from parser import format_problem
+from version import VERSION
+
+from logging import getLevelName, ERROR, WARNING
+
+FORMATS = ['text', 'jsonl', 'sarif']
+
+SARIF_VERSION = '2.1.0'
+SARIF_SCHEMA = ('https://raw.githubusercontent.com/oasis-tcs/sarif-spec/'
+                'master/Schemata/sarif-schema-2.1.0.json')
+
+# Problems don't have columns, though some descriptions mention them.
+# e.g. 'Junk at C3 ("x")' (0-based)
+r_column = re.compile(r'\bC(\d+)\b')
+
+
+def get_column(problem):
+    '''
+    Returns 1-based column of a problem, or None if unknown.
+    '''
+    m = r_column.search(problem.desc)
+    return int(m.group(1)) + 1 if m else None
+
+
+def get_snippet(problem):
+    content = problem.raw_content
+    if not content:
+        return None
+    if type(content) is list:
+        content = u'\n'.join(map(lambda x: x.rstrip(), content))
+    if type(content) is str:
+        content = content.decode('utf-8', 'replace')
+    return content.rstrip()
+
+
+def to_record(problem):
+    '''
+    Returns a dict representing a problem.
+    '''
+    return {'rule': problem.rule,
+            'severity': getLevelName(problem.LEVEL),
+            'file': problem.source_name,
+            'line': problem.line_num,
+            'column': get_column(problem),
+            'message': problem.desc,
+            'snippet': get_snippet(problem)}
+
+
+class ProblemWriter(object):
+    def __init__(self, stream):
+        self.stream = stream
+        # Problems written so far.
+        self.count = 0
+
+    def begin(self):
+        pass
+
+    def write(self, problem):
+        self.count += 1
+
+    def end(self, aborted=False):
+        self.stream.flush()
+
+
+class TextWriter(ProblemWriter):
+    '''
+    Writes lines through dump_func(line) instead of a stream, so that
+    callers may collect them (e.g. the lint server).
+    '''
+
+    def __init__(self, dump_func):
+        self.dump_func = dump_func
+        self.count = 0
+
+    def write(self, problem):
+        if not self.count:
+            self.dump_func(u'Problems:')
+        super(TextWriter, self).write(problem)
+        self.dump_func(format_problem(problem))
+
+    def end(self, aborted=False):
+        if not self.count and not aborted:
+            self.dump_func(u'No problem')
+
+
+class JsonLinesWriter(ProblemWriter):
+    def write(self, problem):
+        super(JsonLinesWriter, self).write(problem)
+        self.stream.write(json.dumps(to_record(problem), sort_keys=True)
+                          + '\n')
+        # For tools reading lines as they come.
+        self.stream.flush()
+
+
+class SarifWriter(ProblemWriter):
+    '''
+    Writes a SARIF log with a single run. Results are written first and
+    "tool" (with rules seen) last, since the order of members in a JSON
+    object doesn't matter.
+    '''
+
+    LEVELS = [(ERROR, 'error'), (WARNING, 'warning')]
+
+    def __init__(self, stream):
+        super(SarifWriter, self).__init__(stream)
+        self._rules = set()
+
+    def begin(self):
+        self.stream.write('{{"$schema": {}, "version": {}, "runs": [{{'
+                          '"results": ['.format(json.dumps(SARIF_SCHEMA),
+                                                json.dumps(SARIF_VERSION)))
+
+    def _get_level(self, problem):
+        for (level, name) in self.LEVELS:
+            if problem.LEVEL >= level:
+                return name
+        return 'note'
+
+    def _to_result(self, problem):
+        rule = problem.rule
+        self._rules.add(rule)
+        location = {'artifactLocation': {
+            'uri': urllib.quote((problem.source_name or u'')
+                                .encode('utf-8')),
+            'uriBaseId': 'SRCROOT'}}
+        if problem.line_num is not None:
+            region = {'startLine': problem.line_num}
+            column = get_column(problem)
+            if column:
+                region['startColumn'] = column
+            snippet = get_snippet(problem)
+            if snippet:
+                region['snippet'] = {'text': snippet}
+            location['region'] = region
+        return {'ruleId': rule,
+                'level': self._get_level(problem),
+                'message': {'text': problem.desc},
+                'locations': [{'physicalLocation': location}]}
+
+    def write(self, problem):
+        if self.count:
+            self.stream.write(',')
+        super(SarifWriter, self).write(problem)
+        self.stream.write('\n' + json.dumps(self._to_result(problem),
+                                            sort_keys=True))
+
+    def end(self, aborted=False):
+        driver = {'name': 'pyrev',
+                  'version': VERSION,
+                  'informationUri': 'https://github.com/dmiyakawa/pyrev',
+                  'rules': map(lambda x: {'id': x}, sorted(self._rules))}
+        self.stream.write('\n], "tool": {}, "invocations": {}}}]}}\n'
+                          .format(json.dumps({'driver': driver},
+                                             sort_keys=True),
+                                  json.dumps([{'executionSuccessful':
+                                               not aborted}])))
+        super(SarifWriter, self).end(aborted)
+
+
+def get_writer(format_name, stream):
+    '''
+    Returns a ProblemWriter for format_name writing to stream (binary).
+    '''
+    if format_name == 'text':
+        return TextWriter(lambda x: stream.write(x.encode('utf-8') + '\n'))
+    elif format_name == 'jsonl':
+        return JsonLinesWriter(stream)
+    elif format_name == 'sarif':
+        return SarifWriter(stream)
+    raise RuntimeError(u'Unknown format "{}"'.format(format_name))
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Parses source files of a single project in worker processes.
+
+Files are handed to workers largest first, so that a large chapter does
+not start last and keep the others waiting. Results are merged into
+a Parser in catalog order as soon as possible, which makes problems
+exactly same as parsing the files one by one.
+'''
+
+import os
+
+from multiprocessing import Pool
+
+from parser import Parser
+from project import ReVIEWProject
+
+import tracing
+
+from logging import getLogger, NullHandler
+from logging import INFO
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+# Projects smaller than this (in total) are parsed in a single process,
+# since starting workers costs more.
+PARALLEL_MIN_BYTES = 256 * 1024
+
+# Set in each worker process by _init_worker().
+_worker_project = None
+_worker_abort_threshold = None
+
+
+def _init_worker(source_dir, config_file, catalog_file, image_dir,
+                 abort_threshold, tracing_enabled=False):
+    global _worker_project, _worker_abort_threshold
+    tracing.init_worker(tracing_enabled)
+    _worker_project = ReVIEWProject.instantiate(source_dir,
+                                                config_file=config_file,
+                                                catalog_file=catalog_file,
+                                                image_dir=image_dir,
+                                                logger=local_logger)
+    _worker_abort_threshold = abort_threshold
+
+
+def _parse_in_worker(params):
+    (index, filename) = params
+    if not _worker_project:
+        raise RuntimeError(u'Failed to instantiate project in a worker')
+    parser = Parser(project=_worker_project,
+                    ignore_threshold=INFO,
+                    abort_threshold=_worker_abort_threshold,
+                    logger=local_logger)
+    path = os.path.normpath(u'{}/{}'.format(_worker_project.source_dir,
+                                            filename))
+    result = parser.parse_file_to_result(path, filename)
+    return (index, result, tracing.take_worker_events())
+
+
+def _get_sizes(project, filenames):
+    sizes = []
+    for filename in filenames:
+        try:
+            sizes.append(project.storage.stat(
+                os.path.join(project.source_dir, filename)).st_size)
+        except OSError:
+            sizes.append(0)
+    return sizes
+
+
+def should_parse_in_parallel(project, filenames, jobs):
+    '''
+    Returns True if parsing filenames with "jobs" processes is worth it.
+    '''
+    return (jobs > 1
+            and len(filenames) > 1
+            and project.storage.is_local
+            and sum(_get_sizes(project, filenames)) >= PARALLEL_MIN_BYTES)
+
+
+def iter_file_results(project, filenames, jobs, abort_threshold,
+                      logger=None):
+    '''
+    Parses filenames in a pool of "jobs" processes and yields
+    (index in filenames, FileResult) as each file is done.
+    '''
+    logger = logger or local_logger
+    sizes = _get_sizes(project, filenames)
+    # Largest first. sorted() is stable, so ties stay in catalog order.
+    order = sorted(range(len(filenames)), key=lambda i: -sizes[i])
+    pool = Pool(min(jobs, len(filenames)), _init_worker,
+                (project.source_dir, project.config_file,
+                 project.catalog_file, project.image_dir,
+                 abort_threshold, tracing.is_tracing()))
+    logger.debug(u'Parsing {} file(s) with {} worker(s)'
+                 .format(len(filenames), min(jobs, len(filenames))))
+    try:
+        for (index, result, events) in pool.imap_unordered(
+                _parse_in_worker, map(lambda i: (i, filenames[i]), order)):
+            tracing.add_events(events)
+            yield (index, result)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def merge_file_result(parser, project, filename, result):
+    '''
+    Merges FileResult for filename into parser, or parses the file again
+    when the result can't be merged.
+    '''
+    if not parser.merge_file_result(result):
+        path = os.path.normpath(u'{}/{}'.format(project.source_dir,
+                                                filename))
+        parser.parse_file(path, 0, filename)
+
+
+def parse_files(parser, project, filenames, jobs, logger=None):
+    '''
+    Parses filenames in a pool of "jobs" processes and merges results into
+    parser in order of filenames.
+    '''
+    results = {}
+    next_index = 0
+    for (index, result) in iter_file_results(project, filenames, jobs,
+                                             parser.abort_threshold, logger):
+        results[index] = result
+        while next_index in results:
+            merge_file_result(parser, project, filenames[next_index],
+                              results.pop(next_index))
+            next_index += 1
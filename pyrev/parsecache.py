@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Keeps results of parsing each source file (FileResult) on disk, so that
+unchanged files are not parsed again in later runs.
+
+A result is keyed by a digest of everything it depends on:
+
+ - the content of the source file and files included by "#@mapfile"
+ - images of the chapter, which decide image problems
+ - pyrev version and thresholds of the parser
+
+Checks across files (references to other chapters' blocks, etc.) are
+not in FileResult and always run when results are merged.
+'''
+
+import cPickle as pickle
+import hashlib
+import os
+import tempfile
+import zlib
+
+from cache import get_cache_dir
+from parser import Parser
+from preproc import parse_directive
+from version import VERSION
+
+import parallel
+import tracing
+
+from logging import getLogger, NullHandler
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+# Changed when FileResult (or what it depends on) changes incompatibly.
+CACHE_FORMAT = 2
+
+# Results are evicted (oldest first) beyond this total size.
+PARSE_CACHE_BYTES = 64 * 1024 * 1024
+
+CACHE_SUFFIX = '.pickle.z'
+
+
+def get_parse_cache_dir():
+    return os.path.join(get_cache_dir(), 'parse')
+
+
+class ParseCache(object):
+    '''
+    Stores each FileResult in a file named by its key.
+    Files used recently are touched, so that eviction drops ones
+    not used for the longest time.
+    '''
+
+    def __init__(self, cache_dir=None, max_bytes=None, logger=None):
+        self.cache_dir = cache_dir or get_parse_cache_dir()
+        self.max_bytes = max_bytes or PARSE_CACHE_BYTES
+        self.logger = logger or local_logger
+        self.hits = 0
+        self.misses = 0
+        self._modified = False
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def _hash_includes(self, h, storage, include_dir, lines):
+        for line in lines:
+            directive = parse_directive(line)
+            if not directive:
+                continue
+            path = os.path.normpath(os.path.join(include_dir,
+                                                 directive[0]))
+            try:
+                data = storage.read(path)
+            except (IOError, OSError):
+                data = None
+            h.update(u'include\0{}\0{}\n'.format(
+                path, hashlib.sha1(data).hexdigest() if data is not None
+                else u'missing').encode('utf-8'))
+
+    def get_key(self, parser, project, filename):
+        '''
+        Returns a key for the result of parsing filename with parser's
+        settings, or None if the file can't be read.
+        '''
+        path = os.path.normpath(u'{}/{}'.format(project.source_dir,
+                                                filename))
+        try:
+            data = project.storage.read(path)
+        except (IOError, OSError):
+            return None
+        h = hashlib.sha1()
+        h.update(u'{}\0{}\0{}\0{}\0{}\n'.format(
+            CACHE_FORMAT, VERSION, parser.ignore_threshold,
+            parser.abort_threshold, filename).encode('utf-8'))
+        h.update(data)
+        for image in project.images.get(filename) or []:
+            h.update(u'\nimage\0{}'.format(image.rel_path).encode('utf-8'))
+        if '#@map' in data:
+            self._hash_includes(h, project.storage, os.path.dirname(path),
+                                data.splitlines())
+        return h.hexdigest()
+
+    def get(self, key):
+        '''
+        Returns FileResult for key, or None if not cached.
+        '''
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.loads(zlib.decompress(f.read()))
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        except Exception as e:
+            # Broken or written by an incompatible version.
+            self.logger.debug(u'Ignoring broken cache "{}": {}'
+                              .format(path, e))
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        '''
+        Stores FileResult. Failures are just logged since a cache is
+        not mandatory.
+        '''
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            (fd, temp_path) = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(zlib.compress(
+                    pickle.dumps(result, pickle.HIGHEST_PROTOCOL)))
+            os.rename(temp_path, self._get_path(key))
+            self._modified = True
+        except Exception as e:
+            self.logger.debug(u'Failed to save cache for "{}": {}'
+                              .format(result.source_name, e))
+
+    def evict(self):
+        '''
+        Removes least recently used results while the total size exceeds
+        max_bytes.
+        '''
+        if not self._modified:
+            return
+        self._modified = False
+        entries = []
+        total = 0
+        try:
+            for filename in os.listdir(self.cache_dir):
+                if not filename.endswith(CACHE_SUFFIX):
+                    continue
+                path = os.path.join(self.cache_dir, filename)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+            for (_, size, path) in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+        except OSError as e:
+            self.logger.debug(u'Failed to evict cache: {}'.format(e))
+
+
+def _parse_to_result(parser, project, filename):
+    fresh = Parser(project=project,
+                   ignore_threshold=parser.ignore_threshold,
+                   abort_threshold=parser.abort_threshold,
+                   logger=parser.logger)
+    path = os.path.normpath(u'{}/{}'.format(project.source_dir, filename))
+    return fresh.parse_file_to_result(path, filename)
+
+
+def parse_file(parser, project, filename, cache=None):
+    '''
+    Returns FileResult for filename, from cache if available.
+    '''
+    key = cache.get_key(parser, project, filename) if cache else None
+    result = cache.get(key) if key else None
+    if result is None:
+        result = _parse_to_result(parser, project, filename)
+        if key:
+            cache.put(key, result)
+    return result
+
+
+def parse_files(parser, project, filenames, cache, jobs=1, logger=None):
+    '''
+    Merges results of filenames into parser in order, parsing only files
+    not in cache ("jobs" processes are used for them if worth it).
+    '''
+    logger = logger or local_logger
+    results = {}
+    misses = []
+    with tracing.span(u'parse_cache', files=len(filenames)) as s:
+        keys = map(lambda x: cache.get_key(parser, project, x), filenames)
+        for (index, key) in enumerate(keys):
+            result = cache.get(key) if key else None
+            if result is None:
+                misses.append(index)
+            else:
+                results[index] = result
+        s.set(hits=len(results), misses=len(misses))
+    logger.debug(u'Parse cache: {} hit(s), {} miss(es)'
+                 .format(len(results), len(misses)))
+
+    missed_filenames = map(lambda i: filenames[i], misses)
+    if jobs > 1 and parallel.should_parse_in_parallel(
+            project, missed_filenames, jobs):
+        items = map(lambda (i, result): (misses[i], result),
+                    parallel.iter_file_results(project, missed_filenames,
+                                               jobs, parser.abort_threshold,
+                                               logger))
+    else:
+        items = map(lambda i: (i, _parse_to_result(parser, project,
+                                                   filenames[i])),
+                    misses)
+    for (index, result) in items:
+        if keys[index]:
+            cache.put(keys[index], result)
+        results[index] = result
+    cache.evict()
+
+    for (index, filename) in enumerate(filenames):
+        parallel.merge_file_result(parser, project, filename, results[index])
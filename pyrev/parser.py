@@ -23,6 +23,12 @@ import string
 from logging import getLogger, NullHandler
 from logging import CRITICAL, ERROR, WARNING, INFO, DEBUG
 
+from imageinfo import ImageInspector, find_image_problems
+from preproc import IncludeResolver, IncludeError
+from preproc import parse_directive, r_map_end
+from storage import local_storage
+from tracing import span
+
 local_logger = getLogger(__name__)
 local_logger.addHandler(NullHandler())
 
@@ -33,6 +39,42 @@ r_end_block = re.compile(r'^//}(?P<junk>.*)$')
 r_begin_block = re.compile(r'^(?P<prefix>//)(?P<content>.+)$')
 r_manual_warn = re.compile(r'^#@(?P<type>.+)\((?P<message>.+)\)$')
 
+# Reported for lines before the first bookmark in a project.
+NO_BOOKMARK_DESC = u'No bookmark found yet'
+
+# Used for deriving rule ids from descriptions of problems.
+# Quoted values are dropped unless they look like markup ("#@end").
+r_rule_quoted = re.compile(r'"(?![#@/])[^"]*"|\'[^\']*\'|\([^)]*\)')
+r_rule_position = re.compile(r'\b[CL]\d+\b|(?<![\w-])\d+(?![\w-])')
+r_rule_end = re.compile(r'[:.](?:\s|$)')
+r_rule_word = re.compile(r'[a-z0-9]+')
+
+
+def format_problem(problem):
+    '''
+    Returns a line describing a problem. e.g. " [E] ch1.re L3: ..."
+    '''
+    problem_name = type(problem).__name__[5]
+    if problem.source_name:
+        return (u' [{}] {} L{}: {}'
+                .format(problem_name, problem.source_name,
+                        problem.line_num, problem.desc))
+    return u' [{}] L{}: {}'.format(problem_name, problem.line_num,
+                                   problem.desc)
+
+
+def get_rule_id(desc):
+    '''
+    Returns a stable id for the kind of a problem from its description,
+    dropping values specific to each problem.
+    e.g. 'Inline for id "l1" found but no block for it.'
+         -> 'inline-for-id-found-but-no-block-for-it'
+    '''
+    text = r_rule_quoted.sub(u' ', desc)
+    text = r_rule_end.split(text, 1)[0]
+    text = r_rule_position.sub(u' ', text)
+    return u'-'.join(r_rule_word.findall(text.lower())) or u'unknown'
+
 
 class ParseProblem(Exception):
     def __init__(self, source_name, line_num, desc, raw_content):
@@ -47,6 +89,9 @@ class ParseProblem(Exception):
         self.desc = desc
         self.raw_content = raw_content
 
+    @property
+    def rule(self):
+        return get_rule_id(self.desc)
 
     def __str__(self):
         if self.line_num:
@@ -128,6 +173,14 @@ class ProblemReporter(object):
         self.ignore_threshold = ignore_threshold
         self.abort_threshold = abort_threshold
         self.logger = logger
+        self._listeners = []
+
+    def add_listener(self, listener):
+        '''
+        listener(problem) is called for each problem remembered, e.g. for
+        writing it out without waiting for the end of parsing.
+        '''
+        self._listeners.append(listener)
 
     def report(self, error_level, source_name, line_num, desc, raw_content,
                logger=None):
@@ -151,10 +204,14 @@ class ProblemReporter(object):
         else:
             problem = ParseDebug(source_name, line_num, desc, raw_content)
 
+        # Kept for reporting it again (see Parser.merge_file_result()).
+        problem.level = error_level
         if error_level >= self.abort_threshold:
             raise problem
         else:
             self.problems.append(problem)
+            for listener in self._listeners:
+                listener(problem)
             return problem
 
     def error(self, source_name, line_num, desc, raw_content, logger=None):
@@ -563,6 +620,10 @@ class BlockStateMachine(object):
                 # but in this block we don't care
                 ret = self._parse_block_start(line_num, uni_line, content,
                                               prefix_len, logger)
+                if self.state not in [BSM_NONE, BSM_IN_BLOCK]:
+                    # e.g. "//list[id", which is already reported.
+                    self.reset()
+                    return None
                 # BSN_NONE ... //footnote[][]
                 # BSN_IN_BLOCK ... //list[][]{
                 assert self.state in [BSM_NONE, BSM_IN_BLOCK], self.state
@@ -784,10 +845,16 @@ class BlockStateMachine(object):
             self.reset()
             return new_block
 
+        if self.state in [BSM_IN_PARAM, BSM_IN_PARAM_BS]:
+            # e.g. "//list[id"
+            self._error(line_num, u'Block param is not closed', uni_line)
+            return None
+
         if self._tmp_lst:
-            self._error(line_num, uni_line, 
-                        'Unprocessed data is remaining ("{}")'
-                        .format(''.join(self._tmp_lst)))
+            self._error(line_num,
+                        u'Unprocessed data is remaining ("{}")'
+                        .format(''.join(self._tmp_lst)),
+                        uni_line)
 
         if self.state == BSM_END_PARAM:
             # e.g. "//footnote[fnname][footnotecontent]"
@@ -805,6 +872,47 @@ class BlockStateMachine(object):
         return None
 
 
+class FileResult(object):
+    '''
+    Compact and picklable result of parsing a single file, which is merged
+    into another Parser with Parser.merge_file_result().
+    '''
+
+    def __init__(self, source_name):
+        self.source_name = source_name
+        # (level, line_num, desc, raw_content)
+        self.problems = []
+        self.blocks = []
+        # Inlines whose endfile checks are not done yet.
+        self.inlines = []
+        self.bookmarks = []
+        self.referenced_images = []
+        # Paths of files included by "#@mapfile" (or "#@maprange").
+        self.includes = []
+        # True when parsing stopped at the last problem (abort_threshold).
+        self.aborted = False
+
+
+def find_image(images, source_name, image_id):
+    '''
+    Finds a ProjectImage for "//image[image_id]" in source_name
+    from ProjectImageIndex.
+    Returns a tuple (image, prefixed). prefixed is True when the image
+    is found only after removing a redundant "(chapter id)-" prefix.
+    image is None when not found.
+    '''
+    image = images.find(source_name, image_id)
+    if image:
+        return (image, False)
+    (source_id, _) = os.path.splitext(source_name)
+    prefix = u'{}-'.format(source_id)
+    if image_id.startswith(prefix):
+        image = images.find(source_name, image_id[len(prefix):])
+        if image:
+            return (image, True)
+    return (None, False)
+
+
 class Parser(object):
     '''
     Episode 4: A New Hope
@@ -859,7 +967,8 @@ class Parser(object):
                  project=None,
                  ignore_threshold=INFO,
                  abort_threshold=CRITICAL,
-                 logger=local_logger):
+                 logger=local_logger,
+                 include_resolver=None):
         '''
         project: a base project for this parser. Can be None, in which case
           no base project is available and some lint checks will not
@@ -870,8 +979,12 @@ class Parser(object):
           reported.
         abort_threshold: Specifies a lint-level which is minimum lint to be
           aborted.
+        include_resolver: IncludeResolver for "#@mapfile" and "#@maprange".
+          If None, the project's one (or a new one without a project)
+          is used.
         '''
         self.project = project
+        self._include_resolver = include_resolver
         self.logger = logger
         self.ignore_threshold = ignore_threshold
         self.abort_threshold = abort_threshold
@@ -880,11 +993,10 @@ class Parser(object):
             if type(block_names) == str:
                 block_names = (block_names,)
             inline_id = inline.raw_content 
-            for block in self.all_blocks:
-                if (block.name in block_names
-                    and len(block.params) > 0
-                    and block.params[0] == inline_id):
-                    return 
+            block_ids = self._get_block_ids()
+            for block_name in block_names:
+                if (block_name, inline_id) in block_ids:
+                    return
             self._error(inline.line_num,
                         u'Inline for id "{}" found but no block for it.'
                         .format(inline_id),
@@ -900,33 +1012,30 @@ class Parser(object):
             if not self.project:
                 return
             assert block.name == u'image', block.name
-            (source_id, _) = os.path.splitext(self.source_name)
             image_id = block.params[0]
-            imgs = self.project.images.get(self.source_name)
-            if not imgs:
+            (image, prefixed) = find_image(self.project.images,
+                                           self.source_name, image_id)
+            if image:
+                self._remember_image(block, image)
+            if prefixed:
+                (source_id, _) = os.path.splitext(self.source_name)
+                self._warning(block.line_num,
+                              u'"{}" includes prefix ("{}-")'
+                              .format(image_id, source_id),
+                              block.uni_lines)
+            elif not image:
                 self._error(block.line_num,
                             u'Image file for image "{}" does not exist'
                             .format(image_id),
                             block.uni_lines)
-                return
-            image_exist = reduce(lambda x, y: x or image_id == y.id,
-                                 imgs, False)
-            if not image_exist:
-                image_id_wrong = reduce(lambda x, y: x or
-                                        image_id == '{}-{}'.format(source_id,
-                                                                   y.id),
-                                        imgs, False)
-                if image_id_wrong:
-                    self._warning(block.line_num,
-                                  u'"{}" includes prefix ("{}-")'
-                                  .format(image_id, source_id),
-                                  block.uni_lines)
-                else:
-                    self._error(block.line_num,
-                                u'Image file for image "{}" does not exist'
-                                .format(image_id),
-                                block.uni_lines)
 
+        def __remember_indep_image(block):
+            if not self.project or not block.params:
+                return
+            image = self.project.images.find(self.source_name,
+                                             block.params[0])
+            if image:
+                self._remember_image(block, image)
 
         def __check_block_default(block, num_params):
             if len(block.params) != num_params:
@@ -1001,7 +1110,8 @@ class Parser(object):
                                'footnote': (None, cbd_2, None),
                                'noindent': (None, cbd_0, None),
                                'cmd': (None, cbd_0, None),
-                               'indepimage': (None, cbd_2, None),
+                               'indepimage': (__remember_indep_image,
+                                              cbd_2, None),
                                'graph': (None, cpnr_23, None),
                                'quote': (None, cbd_0, None),
                                'bibpaper': (None, cbd_2, None),
@@ -1021,6 +1131,9 @@ class Parser(object):
 
         # Contains all Block objects in flat form.
         self.all_blocks = []
+        # (name, first param) of all_blocks[:self._num_indexed_blocks]
+        self._block_ids = set()
+        self._num_indexed_blocks = 0
 
         # Contains Inline objects for the file that is currently parsed.
         # Those objects should be eventually stored in all_inlines and removed
@@ -1030,6 +1143,12 @@ class Parser(object):
         # Contains all Inline objects in flat form.
         self.all_inlines = []
 
+        # Images referenced by "//image" or "//indepimage".
+        # (source_name, line_num, ProjectImage)
+        self.referenced_images = []
+        # Paths of files included by "#@mapfile" (or "#@maprange").
+        self.included_paths = []
+
         # Contains all pointers ("@<fn>{name}", "@<list>{name}")
         # (name, line, pos)
         self.footnote_pointers = []
@@ -1045,52 +1164,226 @@ class Parser(object):
         # chap_index must not be None
         self.chap_to_bookmark = {}
 
+        # Directory where paths in "#@mapfile" are relative to.
+        self.include_dir = None
+        # Line number of "#@mapfile" (or "#@maprange") until "#@end".
+        self._map_line_num = None
+
     def parse_project(self):
         pass
 
-    def parse_file(self, path, base_level, source_name, logger=None):
+    def parse_file(self, path, base_level, source_name, logger=None,
+                   storage=None, end_of_document=True):
+        '''
+        storage: where path is read from. If None, the project's storage
+          (or the local filesystem without a project) is used.
+        end_of_document: if False, checks at the end of the file (which
+          depend on previous files) are left to the caller.
+        '''
         logger = logger or self.logger
-
-        f = None
-        try:
-            f = file(path)
-            self._parse_file_inter(f, base_level, source_name, logger)
-        finally:
-            if f: f.close()
-
-    def _parse_file_inter(self, f, base_level, source_name, logger=None):
+        storage = storage or self._get_storage()
+
+        with span(u'parse', file=source_name) as s:
+            f = None
+            try:
+                f = storage.open(path)
+                lines = f.readlines()
+            finally:
+                if f: f.close()
+            s.set(lines=len(lines))
+            include_dir = os.path.dirname(path)
+            self._prefetch_includes(lines, include_dir, storage)
+            self._parse_file_inter(lines, base_level, source_name, logger,
+                                   include_dir, end_of_document)
+
+    def _parse_file_inter(self, f, base_level, source_name, logger=None,
+                          include_dir=None, end_of_document=True):
         '''
         content: file, or file-like object
+        include_dir: where paths in "#@mapfile" are relative to.
+          The current directory is used if None.
+        '''
+        self.begin_file(base_level, source_name, include_dir)
+        self.parse_lines(f)
+        self.end_file(end_of_document)
+
+    def begin_file(self, base_level, source_name, include_dir=None):
+        '''
+        Starts parsing a file, whose lines are given with parse_lines().
         '''
-        logger = logger or self.logger
         self.source_name = source_name
         self.base_level = base_level
+        self.include_dir = include_dir or os.curdir
+        self._map_line_num = None
         self.bsm = BlockStateMachine(parser=self,
                                      reporter=self.reporter,
                                      source_name=self.source_name,
                                      logger=self.logger)
         self.chap_index = 0
-        for line_num, line in enumerate(f, 1):
+
+    def parse_lines(self, lines, first_line_num=1):
+        '''
+        Parses lines (str) of the file, starting at first_line_num.
+        '''
+        for line_num, line in enumerate(lines, first_line_num):
+            if self._handle_map_directive(line_num, line):
+                continue
             self._parse_line(line_num, line)
+
+    def is_idle(self):
+        '''
+        Returns True if no block or "#@mapfile" continues to the next line,
+        where parsing only depends on bookmarks and chap_index so far.
+        '''
+        return (self._map_line_num is None
+                and self.bsm.state == BlockStateMachine.BSM_NONE)
+
+    def end_file(self, end_of_document=True):
+        if self._map_line_num is not None:
+            self._error(self._map_line_num, u'"#@end" is missing', None)
         if self.bsm.state != BlockStateMachine.BSM_NONE:
             self._error(None,
                         u'Block "{}" is not ended'.format(self.bsm.name),
                         None)
 
+        if end_of_document:
+            self._end_of_document()
+
+    def parse_file_to_result(self, path, source_name, storage=None):
+        '''
+        Parses a single file with this fresh Parser and returns FileResult.
+        Used for parsing files in worker processes.
+        '''
+        result = FileResult(source_name)
+        try:
+            self.parse_file(path, 0, source_name, storage=storage,
+                            end_of_document=False)
+        except ParseProblem as e:
+            self.reporter.problems.append(e)
+            result.aborted = True
+        result.problems = map(lambda x: (x.level, x.line_num, x.desc,
+                                         x.raw_content),
+                              self.reporter.problems)
+        result.blocks = self.all_blocks
+        result.inlines = self._current_inlines
+        result.bookmarks = self.bookmarks
+        result.referenced_images = self.referenced_images
+        result.includes = self.included_paths
+        return result
+
+    def merge_file_result(self, result):
+        '''
+        Merges FileResult as if the file was parsed by this Parser after
+        files parsed (or merged) so far, then runs checks at the end of
+        the file with all blocks so far.
+
+        Returns False without merging anything if the result can't be
+        same as parsing the file here, in which case the caller must
+        parse it with parse_file() instead.
+        '''
+        had_bookmarks = bool(self.bookmarks)
+        if (result.aborted and had_bookmarks
+            and result.problems[-1][2] == NO_BOOKMARK_DESC):
+            # Parsing stopped at a problem which is not reported here.
+            return False
+        self.source_name = result.source_name
+        for (level, line_num, desc, raw_content) in result.problems:
+            # Not reported when previous files have bookmarks.
+            if had_bookmarks and desc == NO_BOOKMARK_DESC:
+                continue
+            self.reporter.report(level, result.source_name, line_num, desc,
+                                 raw_content)
+        for bookmark in result.bookmarks:
+            self._append_bookmark(bookmark)
+        self.all_blocks.extend(result.blocks)
+        self.referenced_images.extend(result.referenced_images)
+        self.included_paths.extend(result.includes)
+        self._current_inlines = list(result.inlines)
         self._end_of_document()
+        return True
 
 
     def _end_of_document(self):
-        for inline in self._current_inlines:
-            self._inline_endfile_check(inline)
-            self.all_inlines.append(inline)
-        self._current_inlines = []
+        with span(u'cross_file_checks', file=self.source_name,
+                  inlines=len(self._current_inlines),
+                  blocks=len(self.all_blocks)):
+            for inline in self._current_inlines:
+                self._inline_endfile_check(inline)
+                self.all_inlines.append(inline)
+            self._current_inlines = []
 
-        for block in self.all_blocks:
-            self._block_endfile_check(block)
+            for block in self.all_blocks:
+                self._block_endfile_check(block)
         
 
 
+    def _get_block_ids(self):
+        '''
+        Returns a set of (name, id) for blocks found so far.
+        The set is updated incrementally, since all_blocks only grows.
+        '''
+        for block in self.all_blocks[self._num_indexed_blocks:]:
+            if block.params:
+                self._block_ids.add((block.name, block.params[0]))
+        self._num_indexed_blocks = len(self.all_blocks)
+        return self._block_ids
+
+    def _get_include_resolver(self, storage=None):
+        if self._include_resolver is None:
+            if self.project:
+                self._include_resolver = self.project.get_include_resolver()
+            else:
+                self._include_resolver = IncludeResolver(
+                    storage or self._get_storage(), logger=self.logger)
+        return self._include_resolver
+
+    def _prefetch_includes(self, lines, include_dir, storage=None):
+        '''
+        Reads all files included from lines concurrently.
+        '''
+        directives = filter(None, map(parse_directive,
+                                      filter(lambda x: x.startswith('#@map'),
+                                             lines)))
+        if directives:
+            resolver = self._get_include_resolver(storage)
+            resolver.prefetch(map(lambda x: resolver.resolve_path(include_dir,
+                                                                  x[0]),
+                                  directives))
+
+    def _handle_map_directive(self, line_num, line):
+        '''
+        Handles "#@mapfile" and "#@maprange" until "#@end".
+        Included lines are parsed in place of the directive, while lines
+        until "#@end" (stale content) are skipped.
+        Returns True if the line is consumed.
+        '''
+        if self._map_line_num is not None:
+            if r_map_end.match(line):
+                self._map_line_num = None
+            return True
+        if not line.startswith('#@map'):
+            return False
+        directive = parse_directive(line)
+        if not directive:
+            return False
+        (path, tag) = directive
+        self._map_line_num = line_num
+        resolver = self._get_include_resolver()
+        uni_line = unicode(line, 'utf-8', 'replace')
+        include_path = resolver.resolve_path(self.include_dir, path)
+        self.included_paths.append(include_path)
+        try:
+            included = resolver.get_lines(include_path, tag)
+            for included_line in included:
+                self._parse_line(line_num, included_line)
+        except IncludeError as e:
+            self._error(line_num, u'Failed to include "{}": {}'
+                        .format(path, e), uni_line)
+        except UnicodeDecodeError:
+            self._error(line_num, u'"{}" is not encoded in UTF-8'
+                        .format(path), uni_line)
+        return True
+
     def _parse_line(self, line_num, line, logger=None):
         logger = logger or self.logger
 
@@ -1171,8 +1464,7 @@ class Parser(object):
                                   uni_line)
         
                 if not self.bookmarks:
-                    self._info(line_num, u'No bookmark found yet',
-                               uni_line)
+                    self._info(line_num, NO_BOOKMARK_DESC, uni_line)
 
                 ret = self.bsm.parse_line(line_num, uni_line)
                 if type(ret) is Block:
@@ -1183,21 +1475,24 @@ class Parser(object):
                     return
 
                 # Outside block.
-                ism = InlineStateMachine(line_num,
-                                         uni_line,
-                                         parser=self,
-                                         reporter=self.reporter,
-                                         source_name=self.source_name,
-                                         logger=logger)
-                for pos, ch in enumerate(rstripped):
-                    ret = ism.parse_ch(ch, pos)
-                    if ret is None:
-                        pass
-                    elif type(ret) is Inline:
-                        self._remember_inline(ret)
-                    else:
-                        pass
-                ism.end()
+                self._parse_inlines(line_num, uni_line, rstripped, logger)
+
+    def _parse_inlines(self, line_num, uni_line, rstripped, logger):
+        ism = InlineStateMachine(line_num,
+                                 uni_line,
+                                 parser=self,
+                                 reporter=self.reporter,
+                                 source_name=self.source_name,
+                                 logger=logger)
+        for pos, ch in enumerate(rstripped):
+            ret = ism.parse_ch(ch, pos)
+            if ret is None:
+                pass
+            elif type(ret) is Inline:
+                self._remember_inline(ret)
+            else:
+                pass
+        ism.end()
 
     def _append_bookmark(self, bookmark, logger=None):
         self.bookmarks.append(bookmark)
@@ -1294,6 +1589,45 @@ class Parser(object):
         self._current_inlines.append(inline)
         # self.all_inlines.append(inline)
 
+    def _get_storage(self):
+        if self.project:
+            return self.project.storage
+        return local_storage
+
+    def _remember_image(self, block, image):
+        self.referenced_images.append((self.source_name, block.line_num,
+                                       image))
+
+    def check_images(self, inspector=None):
+        '''
+        Reads headers of images referenced so far and reports images
+        which may break builds (too large, CMYK JPEG, odd resolution, etc.)
+
+        inspector: ImageInspector. If None, a default one (with a persistent
+          cache) is used.
+        '''
+        if not self.project or not self.referenced_images:
+            return
+        inspector = inspector or ImageInspector(logger=self.logger,
+                                                storage=self._get_storage())
+        get_path = lambda image: os.path.join(self.project.source_dir,
+                                              image.rel_path)
+        with span(u'check_images', images=len(self.referenced_images)):
+            infos = inspector.inspect(map(lambda x: get_path(x[2]),
+                                          self.referenced_images))
+        for (source_name, line_num, image) in self.referenced_images:
+            info = infos.get(get_path(image))
+            if not info:
+                self.reporter.info(source_name, line_num,
+                                   u'Unknown image format ("{}")'
+                                   .format(image.rel_path),
+                                   None)
+                continue
+            for (level, desc) in find_image_problems(info):
+                self.reporter.report(level, source_name, line_num,
+                                     u'{} ("{}")'.format(desc, image.rel_path),
+                                     None)
+
 
     def _dump_problems(self, dump_func=None):
         dump_func = dump_func or (lambda x: self.logger.debug(x))
@@ -1302,30 +1636,8 @@ class Parser(object):
             return
         if self.reporter.problems:
             dump_func(u'Problems:')
-            problems = self.reporter.problems
-            for problem in problems:
-                problem_name = type(problem).__name__[5]
-                if problem.raw_content:
-                    if type(problem.raw_content) in [str, unicode]:
-                        content = u'"{}"'.format(problem.raw_content.rstrip())
-                    elif type(problem.raw_content) == list:
-                        lst = []
-                        for rc_part in problem.raw_content:
-                            lst.append(rc_part.rstrip())
-                        content = u'\n' + u'\n'.join(lst)
-                else:
-                    content = u''
-                if problem.source_name:
-                    dump_func(u' [{}] {} L{}: {}'
-                              .format(problem_name,
-                                      problem.source_name,
-                                      problem.line_num,
-                                      problem.desc))
-                else:
-                    dump_func(u' [{}] L{}: {}'
-                              .format(problem_name,
-                                      problem.line_num,
-                                      problem.desc))
+            for problem in self.reporter.problems:
+                dump_func(format_problem(problem))
         else:
             dump_func(u'No problem')
 
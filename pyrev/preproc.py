@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Resolves preprocessor directives of review-preproc, which include
+content of external files.
+
+ //list[hello][Hello]{
+ #@mapfile(scripts/hello.rb)
+ (content of scripts/hello.rb, replaced by review-preproc)
+ #@end
+ //}
+
+"#@maprange(path,tag)" includes lines between "#@range_begin(tag)" and
+"#@range_end(tag)" in the file instead.
+'''
+
+import os
+import re
+
+from cache import LRUCache
+from storage import local_storage
+
+from logging import getLogger, NullHandler
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+r_map_directive = re.compile(r'^#@(?P<type>mapfile|maprange)'
+                             r'\((?P<args>[^)]*)\)\s*$')
+r_map_end = re.compile(r'^#@end\s*$')
+r_range_marker = re.compile(r'#@range_(?P<kind>begin|end)'
+                            r'\((?P<tag>[^)]*)\)')
+
+# Included files are kept up to this total size.
+INCLUDE_CACHE_BYTES = 4 * 1024 * 1024
+
+
+class IncludeError(Exception):
+    pass
+
+
+def parse_directive(line):
+    '''
+    Returns (path, tag) for a "#@mapfile" or "#@maprange" line.
+    tag is None for "#@mapfile". Returns None for other lines.
+    '''
+    m = r_map_directive.match(line.rstrip())
+    if not m:
+        return None
+    args = map(lambda x: x.strip(), m.group('args').split(','))
+    if m.group('type') == 'mapfile':
+        return (args[0], None)
+    if len(args) < 2:
+        return (args[0], u'')
+    return (args[0], args[1])
+
+
+def extract_range(lines, tag):
+    '''
+    Returns lines between "#@range_begin(tag)" and "#@range_end(tag)".
+    Other range markers inside the range are dropped.
+    '''
+    ranged = None
+    for line in lines:
+        m = r_range_marker.search(line)
+        if m:
+            if m.group('tag') == tag:
+                if m.group('kind') == 'begin':
+                    ranged = []
+                elif ranged is not None:
+                    return ranged
+            continue
+        if ranged is not None:
+            ranged.append(line)
+    raise IncludeError(u'Range "{}" is not found'.format(tag))
+
+
+class IncludeResolver(object):
+    '''
+    Reads files included by preprocessor directives.
+
+    Content is cached with (path, size, mtime), since the same file is
+    often included from many chapters.
+    '''
+
+    def __init__(self, storage=None, max_cost=None, workers=4, logger=None):
+        self.storage = storage or local_storage
+        self.logger = logger or local_logger
+        self.workers = workers if self.storage.is_local else 1
+        # (path, size, mtime) -> list of lines
+        self._cache = LRUCache(max_cost or INCLUDE_CACHE_BYTES)
+
+    def _get_key(self, path):
+        st = self.storage.stat(path)
+        return (path, st.st_size, st.st_mtime)
+
+    def _read(self, path):
+        '''
+        Returns (key, lines) for path, or (None, error) on failure.
+        '''
+        try:
+            key = self._get_key(path)
+            return (key, self.storage.read(path).splitlines(True))
+        except (IOError, OSError) as e:
+            return (None, e)
+
+    def prefetch(self, paths):
+        '''
+        Reads files not cached yet concurrently.
+        '''
+        misses = []
+        for path in set(paths):
+            try:
+                if self._get_key(path) not in self._cache:
+                    misses.append(path)
+            except OSError:
+                pass
+        if len(misses) > 1 and self.workers > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(self.workers, len(misses)))
+            try:
+                results = pool.map(self._read, misses)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(self._read, misses)
+        for (key, lines) in results:
+            if key:
+                self._cache.put(key, lines, key[1])
+
+    def get_lines(self, path, tag=None):
+        '''
+        Returns a list of lines (str) to be included.
+        Raises IncludeError when they are not available.
+        '''
+        try:
+            key = self._get_key(path)
+        except OSError:
+            raise IncludeError(u'"{}" does not exist'.format(path))
+        lines = self._cache.get(key)
+        if lines is None:
+            (key, lines) = self._read(path)
+            if not key:
+                raise IncludeError(u'Failed to read "{}": {}'
+                                   .format(path, lines))
+            self._cache.put(key, lines, key[1])
+        if tag is None:
+            return lines
+        return extract_range(lines, tag)
+
+    def resolve_path(self, base_dir, path):
+        return os.path.normpath(os.path.join(base_dir, path))
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Measures time spent in each lint rule and parser phase.
+
+Rules are checkers in Parser.allowed_inlines and Parser.allowed_blocks,
+named after what they check and when:
+
+ inline:list:endfile ... "@<list>{}" checked at the end of a file
+ block:image:firstline ... "//image" checked at its first line
+
+Phases are methods of Parser (e.g. "phase:parse_line"), which include
+time spent in rules and phases called from them.
+
+Checkers and methods of a Parser are replaced with wrappers only when
+attached, so parsers without a profiler pay nothing.
+'''
+
+import json
+import time
+
+from version import VERSION
+
+INLINE_STAGES = ('postparse', 'endfile')
+BLOCK_STAGES = ('firstline', 'lastline', 'endfile')
+
+# Methods of Parser measured as phases.
+PHASES = ['parse_file', '_prefetch_includes', '_handle_map_directive',
+          '_parse_line', '_handle_chap', '_parse_inlines', 'end_file',
+          '_end_of_document', 'check_images']
+
+# Indexes of each stat
+_CALLS = 0
+_TOTAL = 1
+_MAX = 2
+_PROBLEMS = 3
+
+
+class RuleProfiler(object):
+    def __init__(self, timer=time.time):
+        self.timer = timer
+        # key -> [calls, total seconds, max seconds, problems]
+        self.stats = {}
+
+    def wrap(self, key, func, reporter):
+        '''
+        Returns func counting calls, time and problems reported through
+        reporter (ProblemReporter) under key.
+        '''
+        stat = self.stats.setdefault(key, [0, 0.0, 0.0, 0])
+        timer = self.timer
+
+        def wrapper(*args, **kwargs):
+            num_problems = len(reporter.problems)
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = timer() - start
+                stat[_CALLS] += 1
+                stat[_TOTAL] += elapsed
+                if elapsed > stat[_MAX]:
+                    stat[_MAX] = elapsed
+                stat[_PROBLEMS] += len(reporter.problems) - num_problems
+        return wrapper
+
+    def _wrap_checkers(self, kind, checkers_map, stages, reporter):
+        for (name, checkers) in checkers_map.items():
+            wrapped = []
+            for (stage, checker) in zip(stages, checkers):
+                if checker:
+                    checker = self.wrap(u'{}:{}:{}'.format(kind, name, stage),
+                                        checker, reporter)
+                wrapped.append(checker)
+            checkers_map[name] = tuple(wrapped)
+
+    def attach(self, parser):
+        '''
+        Starts measuring rules and phases of a Parser.
+        '''
+        reporter = parser.reporter
+        self._wrap_checkers(u'inline', parser.allowed_inlines,
+                            INLINE_STAGES, reporter)
+        self._wrap_checkers(u'block', parser.allowed_blocks,
+                            BLOCK_STAGES, reporter)
+        for name in PHASES:
+            setattr(parser, name,
+                    self.wrap(u'phase:{}'.format(name.lstrip('_')),
+                              getattr(parser, name), reporter))
+        # BlockStateMachine is created for each file.
+        begin_file = parser.begin_file
+
+        def wrapped_begin_file(*args, **kwargs):
+            begin_file(*args, **kwargs)
+            parser.bsm.parse_line = self.wrap(u'phase:block_state_machine',
+                                              parser.bsm.parse_line,
+                                              reporter)
+        parser.begin_file = wrapped_begin_file
+
+    def get_rows(self):
+        '''
+        Returns a list of (key, calls, total, mean, max, problems)
+        for rules and phases called at least once, slowest first.
+        '''
+        rows = []
+        for (key, stat) in self.stats.iteritems():
+            if not stat[_CALLS]:
+                continue
+            rows.append((key, stat[_CALLS], stat[_TOTAL],
+                         stat[_TOTAL] / stat[_CALLS], stat[_MAX],
+                         stat[_PROBLEMS]))
+        return sorted(rows, key=lambda x: (-x[2], x[0]))
+
+    def dump(self, dump_func):
+        dump_func(u'{:<40} {:>8} {:>10} {:>9} {:>9} {:>8}'
+                  .format(u'Rule', u'Calls', u'Total(ms)', u'Mean(ms)',
+                          u'Max(ms)', u'Problems'))
+        for (key, calls, total, mean, max_, problems) in self.get_rows():
+            dump_func(u'{:<40} {:>8} {:>10.1f} {:>9.3f} {:>9.3f} {:>8}'
+                      .format(key, calls, total * 1000, mean * 1000,
+                              max_ * 1000, problems))
+
+    def to_dict(self):
+        return {'version': VERSION,
+                'rules': dict(map(lambda x: (x[0], {'calls': x[1],
+                                                    'total': x[2],
+                                                    'mean': x[3],
+                                                    'max': x[4],
+                                                    'problems': x[5]}),
+                                  self.get_rows()))}
+
+    def save(self, path):
+        '''
+        Saves stats as JSON (seconds), sorted so that runs can be diffed.
+        '''
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1, sort_keys=True,
+                      separators=(',', ': '))
+            f.write('\n')
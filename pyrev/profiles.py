@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Lints a project built with multiple config files (build profiles),
+e.g. config-print.yml and config-ebook.yml with different catalogs
+and image directories.
+
+Each source file is parsed only once, without any project. Results
+are merged into a Parser for each profile in its catalog order, so that
+references across files (e.g. "@<list>" to a list in a previous chapter)
+are checked as in a plain lint. Checks depending on a profile (catalog
+membership, images, parts) are done for each profile.
+'''
+
+import os
+
+from imageinfo import ImageInspector
+from parser import Parser, find_image
+from project import ReVIEWProject
+
+from logging import getLogger, NullHandler
+from logging import CRITICAL, INFO
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+# Inlines pointing to a chapter id (a filename without ".re").
+CHAPTER_INLINES = set(['chap', 'chapref', 'title'])
+
+
+class BuildProfile(object):
+    '''
+    A project seen through a single config file.
+    '''
+
+    def __init__(self, config_file, project):
+        self.config_file = config_file
+        self.project = project
+        # Bookmarks with levels shifted for parts in this profile.
+        self.bookmarks = []
+        # Holds problems for this profile in its reporter, with results of
+        # its files merged in catalog order.
+        self.parser = None
+
+    @property
+    def problems(self):
+        return self.parser.reporter.problems if self.parser else []
+
+
+def load_profiles(source_dir, config_files, logger=None, storage=None):
+    '''
+    Returns a list of BuildProfile for config files in source_dir.
+    Returns None if any of them is not usable.
+    '''
+    logger = logger or local_logger
+    profiles = []
+    for config_file in config_files:
+        project = ReVIEWProject.instantiate(source_dir,
+                                            config_file=config_file,
+                                            logger=logger,
+                                            storage=storage)
+        if not project:
+            logger.error(u'Failed to load profile "{}"'.format(config_file))
+            return None
+        profiles.append(BuildProfile(config_file, project))
+    return profiles
+
+
+class ProfileLinter(object):
+    def __init__(self, profiles, abort_threshold=CRITICAL, inspector=None,
+                 logger=None):
+        '''
+        inspector: ImageInspector shared among profiles. If None,
+          a default one is used.
+        '''
+        self.profiles = profiles
+        self.abort_threshold = abort_threshold
+        self.logger = logger or local_logger
+        self.inspector = inspector
+        # filename -> FileResult of the file parsed without any project.
+        self.results = {}
+        # Files included by "#@mapfile" are cached across all profiles.
+        self.include_resolver = (profiles[0].project.get_include_resolver()
+                                 if profiles else None)
+
+    def _parse_file(self, project, filename):
+        logger = self.logger
+        logger.debug(u'Parsing "{}"'.format(filename))
+        parser = Parser(project=None,
+                        ignore_threshold=INFO,
+                        abort_threshold=self.abort_threshold,
+                        logger=logger,
+                        include_resolver=self.include_resolver)
+        path = os.path.normpath(u'{}/{}'.format(project.source_dir,
+                                                filename))
+        self.results[filename] = parser.parse_file_to_result(
+            path, filename, storage=project.storage)
+
+    def parse_all(self):
+        '''
+        Parses all source files used by any profile, each only once.
+        '''
+        for profile in self.profiles:
+            for filename in profile.project.source_filenames:
+                if filename not in self.results:
+                    self._parse_file(profile.project, filename)
+
+    def _check_images(self, profile, filename, blocks):
+        project = profile.project
+        reporter = profile.parser.reporter
+        for block in blocks:
+            if (block.name not in (u'image', u'indepimage')
+                or not block.params):
+                continue
+            (image, prefixed) = find_image(project.images, filename,
+                                           block.params[0])
+            if image:
+                profile.parser.referenced_images.append(
+                    (filename, block.line_num, image))
+            if prefixed and block.name == u'image':
+                (source_id, _) = os.path.splitext(filename)
+                reporter.warning(filename, block.line_num,
+                                 u'"{}" includes prefix ("{}-")'
+                                 .format(block.params[0], source_id),
+                                 block.uni_lines)
+            elif not image and block.name == u'image':
+                reporter.error(filename, block.line_num,
+                               u'Image file for image "{}" does not exist'
+                               u' in "{}"'
+                               .format(block.params[0], project.image_dir),
+                               block.uni_lines)
+
+    def _check_chapter_refs(self, profile, filename, inlines):
+        project = profile.project
+        for inline in inlines:
+            if inline.name not in CHAPTER_INLINES:
+                continue
+            chap_file = u'{}.re'.format(inline.raw_content)
+            if chap_file not in project.source_filenames:
+                profile.parser.reporter.error(
+                    filename, inline.line_num,
+                    u'Chapter "{}" is not in "{}"'
+                    .format(inline.raw_content, project.catalog_file),
+                    inline.raw_content)
+
+    def _build_bookmarks(self, profile):
+        project = profile.project
+        for filename in project.predef_filenames:
+            self._append_bookmarks(profile, filename, 0)
+        if project.parts:
+            for (part_title, part_chaps) in project.parts:
+                profile.bookmarks.append({Parser.BM_LEVEL: 1,
+                                          Parser.BM_TITLE: part_title.strip(),
+                                          Parser.BM_SOURCE_FILE_NAME: None,
+                                          Parser.BM_SOURCE_CHAP_INDEX: None})
+                for chap in part_chaps:
+                    self._append_bookmarks(profile, chap, 1)
+        else:
+            for chap in project.chaps or []:
+                self._append_bookmarks(profile, chap, 0)
+        for filename in project.postdef_filenames:
+            self._append_bookmarks(profile, filename, 0)
+
+    def _append_bookmarks(self, profile, filename, base_level):
+        result = self.results.get(filename)
+        if not result:
+            return
+        for bookmark in result.bookmarks:
+            bookmark = dict(bookmark)
+            bookmark[Parser.BM_LEVEL] += base_level
+            profile.bookmarks.append(bookmark)
+
+    def _check_parts(self, profile):
+        '''
+        Reports parts appearing more than once in the catalog, and parts
+        without any chapter, found in bookmarks of the profile.
+        '''
+        catalog_file = profile.project.catalog_file
+        reporter = profile.parser.reporter
+        # [title, number of bookmarks in the part]
+        parts = []
+        for bookmark in profile.bookmarks:
+            if bookmark[Parser.BM_SOURCE_FILE_NAME] is None:
+                parts.append([bookmark[Parser.BM_TITLE], 0])
+            elif parts and bookmark[Parser.BM_LEVEL] > 1:
+                parts[-1][1] += 1
+            else:
+                # e.g. POSTDEF after the last part.
+                parts.append([None, 0])
+        titles = set()
+        for (title, num_bookmarks) in parts:
+            if title is None:
+                continue
+            if title in titles:
+                reporter.warning(catalog_file, None,
+                                 u'Part "{}" appears more than once'
+                                 .format(title), title)
+            titles.add(title)
+            if not num_bookmarks:
+                reporter.warning(catalog_file, None,
+                                 u'Part "{}" has no chapter'.format(title),
+                                 title)
+
+    def check_profile(self, profile):
+        project = profile.project
+        profile.parser = Parser(project=project,
+                                ignore_threshold=INFO,
+                                abort_threshold=self.abort_threshold,
+                                logger=self.logger)
+        profile.bookmarks = []
+        parser = profile.parser
+        for filename in project.source_filenames:
+            num_blocks = len(parser.all_blocks)
+            num_inlines = len(parser.all_inlines)
+            if parser.merge_file_result(self.results[filename]):
+                self._check_images(profile, filename,
+                                   parser.all_blocks[num_blocks:])
+            else:
+                # Parsed again with the project, checking images too.
+                path = os.path.normpath(u'{}/{}'.format(project.source_dir,
+                                                        filename))
+                parser.parse_file(path, 0, filename)
+            self._check_chapter_refs(profile, filename,
+                                     parser.all_inlines[num_inlines:])
+        self._build_bookmarks(profile)
+        self._check_parts(profile)
+        inspector = self.inspector or ImageInspector(logger=self.logger,
+                                                     storage=project.storage)
+        profile.parser.check_images(inspector)
+
+    def lint(self):
+        '''
+        Parses all files and checks every profile.
+        Returns the list of BuildProfile, each with problems.
+        '''
+        self.parse_all()
+        for profile in self.profiles:
+            self.check_profile(profile)
+        return self.profiles
@@ -29,7 +29,12 @@ sorry.
 import os
 import re
 import shutil
-import yaml
+
+from collections import deque
+
+from cache import LRUCache
+from storage import local_storage
+from tracing import span
 
 r_chap = re.compile(r'^(?P<level>=+)(?P<column>[column]?)'
                     r'(?P<sp>\s*)(?P<title>.+)$')
@@ -41,29 +46,31 @@ from logging import getLogger, NullHandler
 local_logger = getLogger(__name__)
 local_logger.addHandler(NullHandler())
 
-def _verify_filename(source_dir, filename, logger=None):
+def _verify_filename(source_dir, filename, logger=None, storage=None):
     '''
     Checks if a given file is appropriate to use in drivers.
     Returns an absolute path for the filename. None otherwise.
     '''
     logger = logger or local_logger
-    abs_path = os.path.abspath(os.path.join(source_dir, filename))
+    storage = storage or local_storage
+    abs_path = storage.abspath(os.path.join(source_dir, filename))
     if source_dir not in abs_path:
         logger.info(u'"{}" does not point to file in dir "{}".'
                     .format(filename, source_dir))
         return None
-    if not os.path.exists(abs_path):
+    if not storage.exists(abs_path):
         logger.info(u'"{}" does not exist in "{}".'
                     .format(filename, source_dir))
         return None
-    if os.path.islink(abs_path):
+    if storage.islink(abs_path):
         logger.info(u'"{}" is a symlink.'.format(filename))
         return None
     logger.debug('"{}" is verified as safe'.format(abs_path))
     return abs_path
 
 
-def _verify_re_filename(source_dir, filename, logger=local_logger):
+def _verify_re_filename(source_dir, filename, logger=local_logger,
+                        storage=None):
     '''
     In addition to _is_appropriate_file(), checks if the file name
     looks like a Re:VIEW file (i.e. if the extension is ".re").
@@ -72,15 +79,26 @@ def _verify_re_filename(source_dir, filename, logger=local_logger):
     if not m:
         logger.debug(u'{} does not look like .re file'.format(filename))
         return None
-    return _verify_filename(source_dir, filename)
+    return _verify_filename(source_dir, filename, storage=storage)
+
 
+def _is_appropriate_file(source_dir, filename, storage=None):
+    return _verify_filename(source_dir, filename,
+                            storage=storage) is not None
 
-def _is_appropriate_file(source_dir, filename):
-    return _verify_filename(source_dir, filename) is not None
 
+def _is_appropriate_re_file(source_dir, filename, storage=None):
+    return _verify_re_filename(source_dir, filename,
+                               storage=storage) is not None
 
-def _is_appropriate_re_file(source_dir, filename):
-    return _verify_re_filename(source_dir, filename) is not None
+
+def _load_yaml(f):
+    '''
+    Loads a YAML document with a safe loader, C-accelerated if available.
+    PyYAML is imported here since importing it takes a while.
+    '''
+    import yaml
+    return yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
 
 
 def _split_path_into_dirs(path):
@@ -146,6 +164,156 @@ class ProjectImage(object):
                                          self.parent_filename)
 
 
+class ProjectImageIndex(object):
+    '''
+    Maps source (.re) filenames to ProjectImage objects relevant to them.
+
+    The index is built from a single listing of image_dir.
+    Images directly under image_dir (images/chap1-image1.png) are bucketed
+    by their parent id using hash lookups, while each sub directory
+    (images/chap1/) is listed only when images for the chapter are first
+    requested.
+
+    This behaves like a read-only dict {'chap1.re': [ProjectImage, ...]}.
+    '''
+
+    def __init__(self, image_dir, image_dir_path, parent_filenames,
+                 logger=None, storage=None):
+        self.image_dir = image_dir
+        self.image_dir_path = image_dir_path
+        self.logger = logger or local_logger
+        self.storage = storage or local_storage
+        # 'chap1' -> 'chap1.re'
+        self._parents = {}
+        for parent_filename in parent_filenames:
+            (parent_id, _) = os.path.splitext(parent_filename)
+            self._parents[parent_id] = parent_filename
+        # 'chap1.re' -> ['chap1-image1.png', ...]
+        self._flat_filenames = {}
+        # 'chap1.re' -> 'chap1' (sub directory in image_dir)
+        self._sub_dirs = {}
+        # 'chap1.re' -> [ProjectImage, ...] (filled lazily)
+        self._images = {}
+        # 'chap1.re' -> {'image1': ProjectImage, ...} (filled lazily)
+        self._image_ids = {}
+        # image files (or directories) those are not mapped
+        self.unmappable_images = []
+        if image_dir_path and self.storage.isdir(image_dir_path):
+            self._scan()
+
+    def _find_parent(self, head):
+        '''
+        Returns a parent filename for an image filename without extension
+        (e.g. 'chap1-image1' -> 'chap1.re'). None if not found.
+        The longest parent id wins ('chap1-a-b' prefers 'chap1-a.re' to
+        'chap1.re').
+        '''
+        pos = head.rfind('-')
+        while pos > 0:
+            parent_filename = self._parents.get(head[:pos])
+            # Empty image id (e.g. 'chap1-.png') is not allowed.
+            if parent_filename and pos + 1 < len(head):
+                return parent_filename
+            pos = head.rfind('-', 0, pos)
+        return None
+
+    def _scan(self):
+        (filenames, dirnames) = self.storage.list_entries(
+            self.image_dir_path)
+        for dirname in sorted(dirnames):
+            parent_filename = self._parents.get(dirname)
+            if parent_filename:
+                self._sub_dirs[parent_filename] = dirname
+            else:
+                self.unmappable_images.append(dirname)
+        for filename in sorted(filenames):
+            (head, _) = os.path.splitext(filename)
+            parent_filename = self._find_parent(head)
+            if parent_filename:
+                lst = self._flat_filenames.setdefault(parent_filename, [])
+                lst.append(filename)
+            else:
+                self.unmappable_images.append(filename)
+
+    def _load(self, parent_filename):
+        images = []
+        for filename in self._flat_filenames.get(parent_filename, []):
+            rel_path = '{}/{}'.format(self.image_dir, filename)
+            images.append(ProjectImage(rel_path=rel_path,
+                                       parent_filename=parent_filename,
+                                       image_dir=self.image_dir))
+        sub_dir = self._sub_dirs.get(parent_filename)
+        if sub_dir:
+            sub_dir_path = os.path.join(self.image_dir_path, sub_dir)
+            self.logger.debug(u'Scanning "{}"'.format(sub_dir_path))
+            with span(u'list_images', file=parent_filename,
+                      dir=sub_dir) as s:
+                filenames = sorted(self.storage.listdir(sub_dir_path))
+                s.set(images=len(filenames))
+            for filename in filenames:
+                rel_path = '{}/{}/{}'.format(self.image_dir, sub_dir, filename)
+                images.append(ProjectImage(rel_path=rel_path,
+                                           parent_filename=parent_filename,
+                                           image_dir=self.image_dir))
+        self._images[parent_filename] = images
+        self._image_ids[parent_filename] = dict((image.id, image)
+                                                for image in images)
+        return images
+
+    def get_sub_dir_paths(self):
+        '''
+        Returns paths of sub directories (images/chap1) which will be listed
+        when images for their chapters are requested.
+        '''
+        return map(lambda x: os.path.join(self.image_dir_path, x),
+                   self._sub_dirs.values())
+
+    def get_images(self, parent_filename):
+        '''
+        Returns a list of ProjectImage for a given source filename.
+        '''
+        images = self._images.get(parent_filename)
+        if images is None:
+            images = self._load(parent_filename)
+        return images
+
+    def find(self, parent_filename, image_id):
+        '''
+        Returns a ProjectImage with image_id (e.g. 'image1') for a source
+        filename (e.g. 'chap1.re'). None if not found.
+        '''
+        if parent_filename not in self._image_ids:
+            self._load(parent_filename)
+        return self._image_ids[parent_filename].get(image_id)
+
+    def has_image(self, parent_filename, image_id):
+        return self.find(parent_filename, image_id) is not None
+
+    def keys(self):
+        return filter(self.get_images, sorted(self._parents.values()))
+
+    def get(self, parent_filename, default=None):
+        return self.get_images(parent_filename) or default
+
+    def has_key(self, parent_filename):
+        return bool(self.get_images(parent_filename))
+
+    def __contains__(self, parent_filename):
+        return self.has_key(parent_filename)
+
+    def __getitem__(self, parent_filename):
+        images = self.get_images(parent_filename)
+        if not images:
+            raise KeyError(parent_filename)
+        return images
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+
 class ReVIEWProject(object):
     '''
     Represents a whole Re:VIEW project in a single directory,
@@ -155,6 +323,12 @@ class ReVIEWProject(object):
                          'catalog.yml', 'catalog.yaml',
                          'CHAPS', 'PREDEF', 'POSTDEF', 'PART'])
 
+    # Directories never traversed while looking for a source_dir.
+    # Hidden directories (e.g. ".git") are skipped too.
+    PRUNED_DIRS = set(['node_modules', '__pycache__'])
+    # Output directories like "book-pdf", "book-epub".
+    PRUNED_DIR_SUFFIXES = ('-pdf', '-epub', '-log')
+
     # Bookmark keys
     # Bookmark has information about each part, chapter, section, etc.
     # Note: this structure derives from pdftk's dump_data_utf8 subcommand.
@@ -189,21 +363,45 @@ class ReVIEWProject(object):
     # True if column. False (or None) otherwise.
     BM_IS_COLUMN = 'is_column'
 
+    # Default upper limit for documents kept by get_document(),
+    # approximated by total size of their source files.
+    DOCUMENT_CACHE_BYTES = 8 * 1024 * 1024
+
     @staticmethod
     def instantiate(source_dir, **kwargs):
         driver = ReVIEWProject(source_dir,
-                               logger=kwargs.get('logger'))
-        if driver.init(**kwargs):
-            return driver
-        else:
-            return None
+                               logger=kwargs.get('logger'),
+                               document_cache_bytes=kwargs.get(
+                                   'document_cache_bytes'),
+                               storage=kwargs.get('storage'))
+        with span(u'instantiate_project', source_dir=source_dir) as s:
+            if driver.init(**kwargs):
+                s.set(source_files=len(driver.source_filenames))
+                return driver
+            else:
+                return None
 
-    def __init__(self, source_dir, logger=None):
+    def __init__(self, source_dir, logger=None, document_cache_bytes=None,
+                 storage=None):
         # Where the whole source files are.
         self.source_dir = os.path.normpath(source_dir)
         self.logger = logger or local_logger
+        # Where files are read from. See storage.py
+        self.storage = storage or local_storage
+        # Parsed ReVIEWDocument objects, keyed by filenames.
+        self._documents = LRUCache(document_cache_bytes
+                                   or self.DOCUMENT_CACHE_BYTES)
+        # Shared among chapters. See get_include_resolver().
+        self._include_resolver = None
         self._reset()
 
+    def _is_appropriate_file(self, filename):
+        return _is_appropriate_file(self.source_dir, filename, self.storage)
+
+    def _is_appropriate_re_file(self, filename):
+        return _is_appropriate_re_file(self.source_dir, filename,
+                                       self.storage)
+
     def _reset(self):
         self.config_file = None
         self.catalog_file = None
@@ -243,7 +441,7 @@ class ReVIEWProject(object):
         # Contains a mapping from filenames to images relevant to the files.
         # This will include all mapping including draft filenames.
         # {'chap1.re': [ProjectImage, ...]}
-        self.images = {}
+        self.images = ProjectImageIndex(None, None, [])
 
         # image files those are not mapped
         self.unmappable_images = []
@@ -279,6 +477,9 @@ class ReVIEWProject(object):
 
         config_file: a filename of a review config file.
         catalog_file: a filename of a review catalog file.
+          If None, "catalogfile" in the config file is used if available.
+        image_dir: (keyword) a directory for images relative to source_dir.
+          If None, "imagedir" in the config file or "images" is used.
         '''
         logger = kwargs.get('logger') or self.logger
         logger.debug(u'ReVIEWProject.init()')
@@ -300,6 +501,7 @@ class ReVIEWProject(object):
         assert self.bookname is not None
         assert self.config_file is not None
 
+        catalog_file = catalog_file or self.yaml_data.get(u'catalogfile')
         if catalog_file:
             logger.debug(u'catalog_file is specified ("{}"). Try parsing it.'
                          .format(catalog_file))
@@ -322,15 +524,17 @@ class ReVIEWProject(object):
 
         self._recognize_draft_files()
 
-        self.image_dir = kwargs.get('image_dir', 'images')
+        self.image_dir = (kwargs.get('image_dir')
+                          or self.yaml_data.get(u'imagedir')
+                          or 'images')
         self.image_dir_path = os.path.normpath('{}/{}'.format(self.source_dir,
                                                               self.image_dir))
-        self.images = {}
-        if os.path.isdir(self.image_dir_path):
+        if self.storage.isdir(self.image_dir_path):
             self._recognize_image_files()
         else:
             self.logger.info(u'"{}"({}) is not a directory'
                              .format(self.image_dir, self.image_dir_path))
+            self.images = ProjectImageIndex(None, None, [])
 
         # TODO: Check more..
 
@@ -364,7 +568,7 @@ class ReVIEWProject(object):
         logger = logger or self.logger
         candidate_path = os.path.normpath(os.path.join(self.source_dir,
                                                        candidate))
-        if not os.path.isfile(candidate_path):
+        if not self.storage.isfile(candidate_path):
             logger.error(u'Did not find config_file "{}".'.format(candidate))
             return False
         if self.source_dir not in candidate_path:
@@ -372,7 +576,8 @@ class ReVIEWProject(object):
             return False
 
         try:
-            yaml_data = yaml.safe_load(open(candidate_path))
+            with span(u'parse_config', file=candidate):
+                yaml_data = _load_yaml(self.storage.open(candidate_path))
             if yaml_data.has_key(u'bookname'):
                 self.bookname = yaml_data[u'bookname']
                 self.yaml_data = yaml_data
@@ -399,10 +604,12 @@ class ReVIEWProject(object):
         '''
         logger = logger or self.logger
         catalog_yml_path = _verify_filename(self.source_dir, catalog_file,
-                                            logger=logger)
+                                            logger=logger,
+                                            storage=self.storage)
         if not catalog_yml_path: return False
         logger.debug(u'catalog_yml path: "{}"'.format(catalog_yml_path))
-        yaml_data = yaml.load(open(catalog_yml_path))
+        with span(u'parse_catalog', file=catalog_file):
+            yaml_data = _load_yaml(self.storage.open(catalog_yml_path))
 
         if (not yaml_data.has_key('CHAPS')
             or type(yaml_data['CHAPS']) is not list
@@ -420,7 +627,7 @@ class ReVIEWProject(object):
         try:
             if yaml_data.get('PREDEF'):
                 for filename in map(lambda x: x.strip(), yaml_data['PREDEF']):
-                    if not _is_appropriate_file(self.source_dir, filename):
+                    if not self._is_appropriate_file(filename):
                         logger.info((u'Ignoring "{}" because the file looks'
                                      u' inappropriate'
                                      u' (not available, invalid, etc')
@@ -458,7 +665,7 @@ class ReVIEWProject(object):
                 # Check if all the chap file names are sane.
                 if not reduce(lambda x, y: x and
                               ((type(y) is str or (type(y) is unicode))
-                               and _is_appropriate_re_file(self.source_dir, y)),
+                               and self._is_appropriate_re_file(y)),
                                part_chaps, True):
                     logger.info(u'Malformed chaps exist in PART: {}'
                                 .format(part_chaps))
@@ -472,7 +679,7 @@ class ReVIEWProject(object):
             parts = None
             try:
                 for filename in map(lambda x: x.strip(), yaml_data['CHAPS']):
-                    if not _is_appropriate_re_file(self.source_dir, filename):
+                    if not self._is_appropriate_re_file(filename):
                         logger.debug(u'Ignoring {}'.format(filename))
                         continue
                     chaps.append(filename)
@@ -484,7 +691,7 @@ class ReVIEWProject(object):
         try:
             if yaml_data.get('POSTDEF'):
                 for filename in map(lambda x: x.strip(), yaml_data['POSTDEF']):
-                    if not _is_appropriate_file(self.source_dir, filename):
+                    if not self._is_appropriate_file(filename):
                         logger.debug(u'Ignoring {}'.format(filename))
                         continue
                     postdef_filenames.append(filename)
@@ -525,7 +732,8 @@ class ReVIEWProject(object):
         logger = logger or self.logger
         # First check if at least "CHAPS" file exists or not.
         # If not, abort this procedure immediately.
-        chaps_path = _verify_filename(self.source_dir, 'CHAPS', logger)
+        chaps_path = _verify_filename(self.source_dir, 'CHAPS', logger,
+                                      self.storage)
         if not chaps_path:
             self.logger.error('No valid CHAPS file is available.')
             return False
@@ -542,14 +750,14 @@ class ReVIEWProject(object):
         # After checking CHAPS existence, we handle PREDEF before actually
         # looking at CHAPS content, to let the system treat .re files in
         # PREDEF before ones in CHAPS.
-        if _is_appropriate_file(self.source_dir, 'PREDEF'):
+        if self._is_appropriate_file('PREDEF'):
             catalog_files.append('PREDEF')
             predef_path = os.path.join(self.source_dir, 'PREDEF')
-            for line in file(predef_path):
+            for line in self.storage.open(predef_path):
                 filename = line.rstrip()
                 if not filename:
                     continue
-                if not _is_appropriate_file(self.source_dir, filename):
+                if not self._is_appropriate_file(filename):
                     logger.debug(u'Ignore {}'.format(filename))
                     continue
                 predef_filenames.append(filename)
@@ -557,10 +765,11 @@ class ReVIEWProject(object):
 
         # Now handle CHAPS and PART.
         part_titles = None
-        part_path = _verify_filename(self.source_dir, 'PART')
+        part_path = _verify_filename(self.source_dir, 'PART',
+                                     storage=self.storage)
         if part_path:
             logger.debug('Valid PART file exists ({})'.format(part_path))
-            part_titles = self._detect_parts(file(part_path))
+            part_titles = self._detect_parts(self.storage.open(part_path))
             logger.debug('part_titles: {}'.format(part_titles))
 
         if part_titles:
@@ -572,7 +781,7 @@ class ReVIEWProject(object):
             current_part = 0
             chaps = None
             part_chaps = []
-            for line in file(chaps_path):
+            for line in self.storage.open(chaps_path):
                 filename = line.rstrip()
                 # If empty line appears in CHAPS.
                 if not filename:
@@ -586,7 +795,7 @@ class ReVIEWProject(object):
                         # remaining chapters will be part of the last part.
                         pass
                 else:
-                    if not _is_appropriate_re_file(self.source_dir, filename):
+                    if not self._is_appropriate_re_file(filename):
                         logger.debug(u'Ignore {}'.format(filename))
                         continue
                     # Insert the chapter into internal structures.
@@ -597,24 +806,24 @@ class ReVIEWProject(object):
             logger.debug('No valid part information found.')
             parts = None
             chaps = []
-            for line in file(chaps_path):
+            for line in self.storage.open(chaps_path):
                 filename = line.rstrip()
                 if not filename:
                     continue
-                if not _is_appropriate_re_file(self.source_dir, filename):
+                if not self._is_appropriate_re_file(filename):
                     logger.debug(u'Ignore {}'.format(filename))
                     continue
                 chaps.append(filename)
                 source_filenames.append(filename)
 
-        if _is_appropriate_file(self.source_dir, 'POSTDEF'):
+        if self._is_appropriate_file('POSTDEF'):
             catalog_files.append('POSTDEF')
             postdef_path = os.path.join(self.source_dir, 'POSTDEF')
-            for line in file(postdef_path):
+            for line in self.storage.open(postdef_path):
                 filename = line.rstrip()
                 if not filename:
                     continue
-                if not _is_appropriate_file(self.source_dir, filename):
+                if not self._is_appropriate_file(filename):
                     logger.debug(u'Ignore {}'.format(filename))
                     continue
                 postdef_filenames.append(filename)
@@ -638,7 +847,7 @@ class ReVIEWProject(object):
     def _recognize_draft_files(self):
         logger = self.logger
         for re_file in filter(lambda x: x.endswith('.re'),
-                              os.listdir(self.source_dir)):
+                              self.storage.listdir(self.source_dir)):
             if re_file not in self.source_filenames:
                 self.draft_filenames.append(re_file)
         return True
@@ -682,7 +891,7 @@ class ReVIEWProject(object):
         This may raises Exceptions when the file looks broken and cannot
         recover the failure.
         '''
-        f = file(os.path.normpath(
+        f = self.storage.open(os.path.normpath(
                 u'{}/{}'.format(self.source_dir, filename)))
         chap_index = 0
         for line in f:
@@ -737,8 +946,49 @@ class ReVIEWProject(object):
     def has_source(self, re_file):
         return re_file in self.all_filenames()
 
+    def get_base_level(self, re_file):
+        '''
+        Returns a level which bookmarks in the file should be based on.
+        1 when the file is a chapter inside a part. 0 otherwise.
+        '''
+        if self.parts:
+            for (_, part_chaps) in self.parts:
+                if re_file in part_chaps:
+                    return 1
+        return 0
+
+    def get_document(self, re_file):
+        '''
+        Returns a ReVIEWDocument for a source file, which will be parsed
+        when its content is first accessed.
+        Returns None if the file is not part of this project.
+
+        Documents are cached (see DOCUMENT_CACHE_BYTES) and will be parsed
+        again when the file is modified.
+        '''
+        if not self.has_source(re_file):
+            return None
+        document = self._documents.get(re_file)
+        if document and not document.is_stale():
+            return document
+        from document import ReVIEWDocument
+        document = ReVIEWDocument(self, re_file, logger=self.logger)
+        self._documents.put(re_file, document, document.size)
+        return document
+
+    def get_include_resolver(self):
+        '''
+        Returns an IncludeResolver reading files for "#@mapfile" (etc.)
+        through this project's storage.
+        '''
+        if self._include_resolver is None:
+            from preproc import IncludeResolver
+            self._include_resolver = IncludeResolver(self.storage,
+                                                     logger=self.logger)
+        return self._include_resolver
+
     def get_images_for_source(self, re_file):
-        return self.images.get(re_file, [])
+        return self.images.get_images(re_file)
 
     def all_filenames(self):
         '''
@@ -748,72 +998,17 @@ class ReVIEWProject(object):
         return self.source_filenames + self.draft_filenames
 
     def _recognize_image_files(self):
-        if not os.path.isdir(self.image_dir_path):
+        if not self.storage.isdir(self.image_dir_path):
             self.logger.debug(u'No image_dir ("{}")'
                               .format(self.image_dir_path))
             return
-        parent_filenames = sorted(self.all_filenames())
-        image_filenames = sorted(os.listdir(self.image_dir_path))
-        i_parents = 0
-        i_images = 0
-        # Compare two lists from both tops.
-        while (i_parents < len(parent_filenames)
-               and i_images < len(image_filenames)):
-            # e.g. 'chap1.re'
-            parent_filename  = parent_filenames[i_parents]
-            (parent_id, _) = os.path.splitext(parent_filename)
-            # e.g. 'chap1-test1.png', 'chap1/test1.png'
-            image_filename = image_filenames[i_images]
-            rel_path = '{}/{}'.format(self.image_dir, image_filename)
-            abs_path = os.path.normpath('{}/{}'.format(self.image_dir_path,
-                                                       image_filename))
-            (head, tail) = os.path.splitext(image_filename)
-            if os.path.isdir(abs_path):
-                # e.g. rel_path ... 'images/chap1/test1.png'
-                if parent_id == image_filename:
-                    for image_filename2 in os.listdir(abs_path):
-                        rel_path2 = '{}/{}'.format(rel_path, image_filename2)
-                        pi = ProjectImage(rel_path=rel_path2,
-                                          parent_filename=parent_filename,
-                                          image_dir=self.image_dir)
-                        lst = self.images.setdefault(parent_filename, [])
-                        lst.append(pi)
-                    i_images += 1
-                    i_parents += 1
-                elif parent_id < image_filename:
-                    self.images.setdefault(parent_filename, [])
-                    i_parents += 1
-                else:
-                    self.unmappable_images.append(image_filename)
-                    i_images += 1
-            else:
-                if head.startswith('{}-'.format(parent_id)):
-                    # If the image file starts with the id, it should belong
-                    # to the parent.
-                    # Create a new object and append it to a list.
-                    #
-                    # Increment index for the image list only, because
-                    # next image file may have same parent.
-                    # e.g.
-                    # parents: ['chap1.re', 'chap2.re']
-                    # images:  ['images/chap1-test1.png',
-                    #           'images/chap1-test2.png']
-                    pi = ProjectImage(rel_path=rel_path,
-                                      parent_filename=parent_filename,
-                                      image_dir=self.image_dir)
-                    lst = self.images.setdefault(parent_filename, [])
-                    lst.append(pi)
-                    i_images += 1
-                elif parent_id < head:
-                    # e.g.
-                    # parents: ['chap1.re', 'chap2.re']
-                    # images:  ['images/chap2-test1.png',
-                    #           'images/chap3-test2.png']
-                    self.images.setdefault(parent_filename, [])
-                    i_parents += 1
-                else:
-                    self.unmappable_images.append(image_filename)
-                    i_images += 1
+        with span(u'recognize_images', image_dir=self.image_dir):
+            self.images = ProjectImageIndex(self.image_dir,
+                                            self.image_dir_path,
+                                            self.all_filenames(),
+                                            logger=self.logger,
+                                            storage=self.storage)
+        self.unmappable_images = self.images.unmappable_images
 
     def _get_debug_info(self):
         lst = []
@@ -869,34 +1064,64 @@ class ReVIEWProject(object):
                                   .format(key, bookmark[self.BM_TITLE]))
 
     @classmethod
-    def _look_for_base(cls, base_dir, depth, func):
-        files = os.listdir(base_dir)
-        if func(files):
-            return base_dir
-        if depth == 0:
-            return None
-        elif depth > 0:
-            depth = depth -1
-        for filename in files:
-            next_path = os.path.join(base_dir, filename)
-            if os.path.isdir(next_path):
-                ret = cls._look_for_base(next_path, depth, func)
-                if ret:
-                    return ret
-        return None
+    def _is_pruned_dir(cls, dirname):
+        return (dirname.startswith('.')
+                or dirname in cls.PRUNED_DIRS
+                or dirname.endswith(cls.PRUNED_DIR_SUFFIXES))
 
     @classmethod
-    def _look_for_related_files(cls, base_dir, depth):
-        func = lambda files: bool(set(files) & cls.RELATED_FILES)
-        return cls._look_for_base(base_dir, depth, func)
+    def _walk_dirs(cls, base_dir, depth, storage=None):
+        '''
+        Walks directories under base_dir in breadth-first order, yielding
+        (dir_path, filenames, dirnames, level) for each directory.
+
+        Directories in PRUNED_DIRS (and ones looking like outputs) are
+        never visited. Each directory is visited at most once even when
+        symlinks form a loop.
+        A caller may remove names from dirnames to stop descending into them.
+        '''
+        storage = storage or local_storage
+        visited = set()
+        queue = deque([(base_dir, 0)])
+        while queue:
+            (dir_path, level) = queue.popleft()
+            try:
+                key = storage.dir_key(dir_path)
+                (filenames, dirnames) = storage.list_entries(dir_path)
+            except OSError:
+                continue
+            if key in visited:
+                continue
+            visited.add(key)
+            dirnames = sorted(filter(lambda x: not cls._is_pruned_dir(x),
+                                     dirnames))
+            yield (dir_path, filenames, dirnames, level)
+            if depth >= 0 and level >= depth:
+                continue
+            for dirname in dirnames:
+                queue.append((os.path.join(dir_path, dirname), level + 1))
 
     @classmethod
-    def _look_for_re_files(cls, base_dir, depth):
-        func = lambda files: bool(filter(lambda f: f.endswith('.re'), files))
-        return cls._look_for_base(base_dir, depth, func)
+    def find_source_dirs(cls, base_dir, depth=-1, storage=None):
+        '''
+        Returns a list of all Re:VIEW source directories (directories
+        containing RELATED_FILES) under "base_dir", in breadth-first order.
+        Directories under a source directory are not traversed.
+
+        depth is same as guess_source_dir().
+        '''
+        with span(u'find_source_dirs', base_dir=base_dir) as s:
+            source_dirs = []
+            for (dir_path, filenames, dirnames, _) in cls._walk_dirs(
+                    base_dir, depth, storage):
+                if set(filenames) & cls.RELATED_FILES:
+                    source_dirs.append(dir_path)
+                    del dirnames[:]
+            s.set(projects=len(source_dirs))
+            return source_dirs
 
     @classmethod
-    def guess_source_dir(cls, base_dir, depth=-1):
+    def guess_source_dir(cls, base_dir, depth=-1, storage=None):
         '''
         Tries to find Re:VIEW's source directory (source_dir) under "base_dir".
         Returns the path when successful.
@@ -927,8 +1152,24 @@ class ReVIEWProject(object):
         .. this function should receive a path to the project and
         return "(path-to-the-project)/article/".
         When depth is set to 0, this will fail to find the directory instead.
+
+        Directories are scanned breadth-first and the shallowest match wins.
+        On the same level, a directory with RELATED_FILES is preferred to
+        one only with .re files.
         '''
-        return (cls._look_for_related_files(base_dir, depth)
-                or cls._look_for_re_files(base_dir, depth))
+        with span(u'guess_source_dir', base_dir=base_dir):
+            re_dir = None
+            re_level = None
+            for (dir_path, filenames, _, level) in cls._walk_dirs(
+                    base_dir, depth, storage):
+                if re_dir and level > re_level:
+                    break
+                if set(filenames) & cls.RELATED_FILES:
+                    return dir_path
+                if (not re_dir
+                    and filter(lambda f: f.endswith('.re'), filenames)):
+                    re_dir = dir_path
+                    re_level = level
+            return re_dir
 
 
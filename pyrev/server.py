@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Lints projects or files on requests over a Unix domain socket, so that
+pyrev invoked from hooks and editors doesn't pay for starting Python and
+importing modules each time.
+
+Modules are imported (and a small document is parsed) before worker
+processes are forked, so workers share them copy-on-write. Each worker
+accepts connections from the same listening socket and keeps recently
+linted projects (see watch.Watcher), which are reloaded when stats of
+their directories, config or catalog files change. Source files are
+parsed again only when their stats change.
+
+A connection carries a single request and a single response, both JSON:
+
+ {"path": "/abs/path", "unacceptable_level": "CRITICAL", "version": ".."}
+ {"lines": ["Problems:", ...], "error": null, "version": "..", "pid": 1}
+
+"lines" are what pyrev would print. See client.py for the other side.
+'''
+
+import collections
+import errno
+import json
+import os
+import signal
+import socket
+import time
+
+from cache import file_stamp
+from client import get_socket_path
+from main import _get_level, _lint_file
+from parser import ParseProblem
+from project import ReVIEWProject
+from snippet import SnippetLinter
+from version import VERSION
+from watch import Watcher
+
+from logging import getLogger, NullHandler
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+DEFAULT_WORKERS = 2
+
+# Projects kept by each worker. The least recently linted one is dropped
+# beyond this.
+MAX_PROJECTS = 8
+
+# A worker gives up a client not sending its request within this.
+REQUEST_TIMEOUT = 5.0
+
+RESPAWN_SECONDS = 1.0
+
+# Upper limit of a request, which is just a path and options.
+MAX_REQUEST_BYTES = 64 * 1024
+
+
+class LintServer(object):
+    def __init__(self, socket_path=None, workers=DEFAULT_WORKERS,
+                 max_projects=MAX_PROJECTS, parse_cache=None, logger=None):
+        self.socket_path = socket_path or get_socket_path()
+        self.workers = workers
+        self.max_projects = max_projects
+        # ParseCache shared by workers, which helps the first lint of
+        # a project in each worker.
+        self.parse_cache = parse_cache
+        self.logger = logger or local_logger
+        # (source_dir, abort_threshold) -> (stamp, Watcher)
+        self._watchers = collections.OrderedDict()
+        self._sock = None
+        self._pids = set()
+        self._running = False
+
+    def _get_project_stamp(self, watcher):
+        '''
+        Returns stats deciding if watcher's project must be reloaded.
+        Directories' mtime changes when files are added or removed.
+        '''
+        project = watcher.project
+        paths = [project.source_dir]
+        if os.path.isdir(project.image_dir_path):
+            paths.append(project.image_dir_path)
+            paths.extend(sorted(project.images.get_sub_dir_paths()))
+        filenames = set(ReVIEWProject.RELATED_FILES)
+        filenames.update(project._catalog_files)
+        if project.config_file:
+            filenames.add(project.config_file)
+        paths.extend(map(lambda x: os.path.join(project.source_dir, x),
+                         sorted(filenames)))
+        stamp = []
+        for path in paths:
+            try:
+                stamp.append((path, file_stamp(path)))
+            except OSError:
+                stamp.append((path, None))
+        return tuple(stamp)
+
+    def _get_watcher(self, source_dir, abort_threshold):
+        key = (source_dir, abort_threshold)
+        entry = self._watchers.pop(key, None)
+        if entry and entry[0] == self._get_project_stamp(entry[1]):
+            watcher = entry[1]
+        else:
+            if entry:
+                self.logger.debug(u'Reloading "{}"'.format(source_dir))
+            watcher = Watcher(source_dir, abort_threshold,
+                              logger=self.logger,
+                              parse_cache=self.parse_cache)
+            if not watcher.load_project():
+                return None
+        self._watchers[key] = (self._get_project_stamp(watcher), watcher)
+        while len(self._watchers) > self.max_projects:
+            self._watchers.popitem(last=False)
+        return watcher
+
+    def _lint_dir(self, base_dir, abort_threshold, lines):
+        source_dir = ReVIEWProject.guess_source_dir(base_dir)
+        if not source_dir:
+            return u'Failed to detect source_dir'
+        watcher = self._get_watcher(os.path.normpath(source_dir),
+                                    abort_threshold)
+        if not watcher:
+            return (u'Failed to instanciate Re:VIEW Project ({}).'
+                    .format(source_dir))
+        try:
+            watcher.lint()
+        except ParseProblem as e:
+            return u'Aborted: {}'.format(unicode(e))
+        finally:
+            if self.parse_cache:
+                self.parse_cache.evict()
+        watcher.parser._dump_problems(dump_func=lines.append)
+        return None
+
+    def handle(self, request):
+        '''
+        Returns a response (dict) for a request (dict).
+        '''
+        response = {'version': VERSION, 'pid': os.getpid(),
+                    'lines': [], 'error': None}
+        if type(request) is not dict or not request.get('path'):
+            response['error'] = u'"path" is missing'
+            return response
+        if request.get('version') != VERSION:
+            response['error'] = (u'Version mismatch (server: {})'
+                                 .format(VERSION))
+            return response
+        path = os.path.abspath(request['path'])
+        try:
+            abort_threshold = _get_level(request.get('unacceptable_level')
+                                         or 'CRITICAL')
+        except RuntimeError as e:
+            response['error'] = unicode(e)
+            return response
+        start = time.time()
+        if os.path.isdir(path):
+            response['error'] = self._lint_dir(path, abort_threshold,
+                                               response['lines'])
+        elif os.path.isfile(path):
+            try:
+                _lint_file(path, abort_threshold, self.logger,
+                           dump_func=response['lines'].append)
+            except ParseProblem as e:
+                response['error'] = u'Aborted: {}'.format(unicode(e))
+        else:
+            response['error'] = u'"{}" does not exist'.format(path)
+        self.logger.debug(u'Linted "{}" in {:.3f}s'
+                          .format(path, time.time() - start))
+        return response
+
+    def _handle_connection(self, conn):
+        conn.settimeout(REQUEST_TIMEOUT)
+        f = conn.makefile('rb')
+        try:
+            line = f.readline(MAX_REQUEST_BYTES)
+        finally:
+            f.close()
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {'version': VERSION, 'pid': os.getpid(),
+                        'lines': [], 'error': u'Invalid JSON: {}'.format(e)}
+        else:
+            response = self.handle(request)
+        conn.settimeout(None)
+        conn.sendall(json.dumps(response) + '\n')
+
+    def bind(self):
+        '''
+        Starts listening on socket_path, removing a stale socket left by
+        a server no longer running.
+        Raises socket.error if another server is running.
+        '''
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise socket.error(errno.EADDRINUSE,
+                                   u'Server already running on "{}"'
+                                   .format(self.socket_path))
+            except socket.error as e:
+                if e.errno == errno.EADDRINUSE:
+                    raise
+                os.remove(self.socket_path)
+            finally:
+                probe.close()
+        socket_dir = os.path.dirname(self.socket_path)
+        if socket_dir and not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the owner may request.
+        old_umask = os.umask(0o077)
+        try:
+            self._sock.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        self._sock.listen(64)
+
+    def _run_worker(self):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        while True:
+            try:
+                (conn, _) = self._sock.accept()
+            except socket.error as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            try:
+                self._handle_connection(conn)
+            except Exception as e:
+                self.logger.error(u'Failed to handle a request: {}'
+                                  .format(e))
+            finally:
+                conn.close()
+
+    def _spawn_worker(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                self._run_worker()
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+        self._pids.add(pid)
+
+    def _stop(self, signum, frame):
+        self._running = False
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def serve_forever(self):
+        '''
+        Forks workers and restarts ones exiting unexpectedly, until
+        SIGTERM or SIGINT.
+        '''
+        # Anything done lazily on the first parse is done here, so that
+        # workers share it.
+        SnippetLinter(logger=self.logger).lint(
+            u'= Warm up\n//list[l][c]{\n//}\n@<list>{l}\n')
+        self.bind()
+        self.logger.info(u'Listening on "{}" with {} worker(s)'
+                         .format(self.socket_path, self.workers))
+        self._running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        try:
+            for _ in xrange(self.workers):
+                self._spawn_worker()
+            while self._pids:
+                try:
+                    (pid, _) = os.wait()
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                self._pids.discard(pid)
+                if self._running:
+                    self.logger.warning(u'Worker {} exited. Restarting'
+                                        .format(pid))
+                    # Avoids spinning when workers can't start at all.
+                    time.sleep(RESPAWN_SECONDS)
+                    self._spawn_worker()
+        finally:
+            self._sock.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        return 0
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Lints many small snippets of Re:VIEW text in a single process.
+
+Requests and responses are newline-delimited JSON:
+
+ {"id": 1, "source_name": "a.re", "text": "= Title\\n..."}
+ {"id": 1, "source_name": "a.re", "aborted": false,
+  "problems": [{"level": "ERROR", "line": 2, "message": "..."}]}
+
+Snippets are not in a project, so checks needing one (e.g. existence of
+images) are skipped. "#@mapfile" is not resolved, since snippets must
+not read files.
+'''
+
+import json
+
+from parser import Parser, ParseProblem
+from preproc import IncludeResolver
+from storage import MemoryStorage
+
+from logging import getLogger, NullHandler, getLevelName
+from logging import CRITICAL, INFO
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+DEFAULT_SOURCE_NAME = u'snippet.re'
+
+
+class SnippetLinter(object):
+    def __init__(self, abort_threshold=CRITICAL, logger=None):
+        self.abort_threshold = abort_threshold
+        self.logger = logger or local_logger
+        # Shared by all snippets. Nothing can be included.
+        self.include_resolver = IncludeResolver(MemoryStorage({}),
+                                                logger=self.logger)
+
+    def lint(self, text, source_name=None):
+        '''
+        Returns a tuple (problems, aborted) for text (unicode or str).
+        '''
+        source_name = source_name or DEFAULT_SOURCE_NAME
+        if type(text) is unicode:
+            text = text.encode('utf-8')
+        parser = Parser(ignore_threshold=INFO,
+                        abort_threshold=self.abort_threshold,
+                        logger=self.logger,
+                        include_resolver=self.include_resolver)
+        aborted = False
+        try:
+            parser._parse_file_inter(text.splitlines(True), 0, source_name)
+        except ParseProblem as e:
+            parser.reporter.problems.append(e)
+            aborted = True
+        return (parser.reporter.problems, aborted)
+
+    def handle(self, request):
+        '''
+        Returns a response (dict) for a request (dict).
+        '''
+        if type(request) is not dict:
+            return {'id': None, 'error': u'Request must be an object'}
+        source_name = request.get('source_name') or DEFAULT_SOURCE_NAME
+        response = {'id': request.get('id'),
+                    'source_name': source_name}
+        text = request.get('text')
+        if type(text) not in [str, unicode]:
+            response['error'] = u'"text" is missing'
+            return response
+        (problems, aborted) = self.lint(text, source_name)
+        response['aborted'] = aborted
+        response['problems'] = map(lambda x: {'level':
+                                              getLevelName(x.LEVEL),
+                                              'line': x.line_num,
+                                              'message': x.desc},
+                                   problems)
+        return response
+
+    def serve(self, input_stream, output_stream):
+        '''
+        Handles requests from input_stream until EOF, writing a response
+        line for each request line. Returns the number of requests.
+        '''
+        count = 0
+        # readline() instead of iteration, which reads ahead and delays
+        # responses for interactive clients.
+        for line in iter(input_stream.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                response = self.handle(json.loads(line))
+            except ValueError as e:
+                response = {'id': None,
+                            'error': u'Invalid JSON: {}'.format(e)}
+            output_stream.write(json.dumps(response) + '\n')
+            output_stream.flush()
+            count += 1
+        return count
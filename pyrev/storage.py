@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Storage backends which ReVIEWProject and Parser read files through.
+
+LocalStorage ... the local filesystem (default)
+MemoryStorage ... an in-memory tree, useful for tests and servers
+ArchiveStorage ... a zip or tar archive, read in place without extraction
+ConcurrentStorage ... wraps another storage and issues calls concurrently
+
+Paths given to MemoryStorage and ArchiveStorage are POSIX-style paths
+relative to a virtual root "/" (e.g. "/book/config.yml").
+'''
+
+import os
+import posixpath
+import tarfile
+import threading
+import time
+import zipfile
+
+from io import BytesIO
+
+import tracing
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+
+class LocalStorage(object):
+    '''
+    Reads files from the local filesystem.
+    '''
+    is_local = True
+
+    def abspath(self, path):
+        return os.path.abspath(path)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def isfile(self, path):
+        return os.path.isfile(path)
+
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def islink(self, path):
+        return os.path.islink(path)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def list_entries(self, path):
+        '''
+        Returns a tuple (filenames, dirnames) for entries in a directory.
+        scandir() is used when available, which avoids stat() per entry.
+        Symlinks to directories are treated as directories.
+        '''
+        filenames = []
+        dirnames = []
+        if _scandir:
+            for entry in _scandir(path):
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    dirnames.append(entry.name)
+                else:
+                    filenames.append(entry.name)
+        else:
+            for name in os.listdir(path):
+                if os.path.isdir(os.path.join(path, name)):
+                    dirnames.append(name)
+                else:
+                    filenames.append(name)
+        return (filenames, dirnames)
+
+    def dir_key(self, path):
+        '''
+        Returns a key identifying a directory, even via symlinks.
+        '''
+        st = os.stat(path)
+        return (st.st_dev, st.st_ino)
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def open(self, path):
+        '''
+        Returns a file object opened in binary mode.
+        '''
+        return open(path, 'rb')
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class VirtualStat(object):
+    def __init__(self, size, mtime):
+        self.st_size = size
+        self.st_mtime = mtime
+
+
+class _VirtualStorage(object):
+    '''
+    Base class for storages without real paths.
+    Subclasses must register files with _add_file() and implement
+    _read_file().
+    '''
+    is_local = False
+
+    def __init__(self):
+        # path -> (size, mtime)
+        self._files = {}
+        # path -> (set of filenames, set of dirnames)
+        self._dirs = {'/': (set(), set())}
+
+    def _normpath(self, path):
+        return posixpath.normpath(posixpath.join('/', path))
+
+    def _add_dir(self, path):
+        if path in self._dirs:
+            return
+        self._dirs[path] = (set(), set())
+        (parent, name) = posixpath.split(path)
+        self._add_dir(parent)
+        self._dirs[parent][1].add(name)
+
+    def _add_file(self, path, size, mtime):
+        path = self._normpath(path)
+        (parent, name) = posixpath.split(path)
+        self._add_dir(parent)
+        self._dirs[parent][0].add(name)
+        self._files[path] = (size, mtime)
+        return path
+
+    def _read_file(self, path):
+        raise NotImplementedError()
+
+    def abspath(self, path):
+        return self._normpath(path)
+
+    def exists(self, path):
+        path = self._normpath(path)
+        return path in self._files or path in self._dirs
+
+    def isfile(self, path):
+        return self._normpath(path) in self._files
+
+    def isdir(self, path):
+        return self._normpath(path) in self._dirs
+
+    def islink(self, path):
+        return False
+
+    def listdir(self, path):
+        (filenames, dirnames) = self.list_entries(path)
+        return filenames + dirnames
+
+    def list_entries(self, path):
+        entry = self._dirs.get(self._normpath(path))
+        if entry is None:
+            raise OSError(2, 'No such directory', path)
+        return (sorted(entry[0]), sorted(entry[1]))
+
+    def dir_key(self, path):
+        path = self._normpath(path)
+        if path not in self._dirs:
+            raise OSError(2, 'No such directory', path)
+        return path
+
+    def stat(self, path):
+        path = self._normpath(path)
+        if path in self._files:
+            return VirtualStat(*self._files[path])
+        elif path in self._dirs:
+            return VirtualStat(0, 0)
+        raise OSError(2, 'No such file or directory', path)
+
+    def read(self, path):
+        path = self._normpath(path)
+        if path not in self._files:
+            raise IOError(2, 'No such file', path)
+        return self._read_file(path)
+
+    def open(self, path):
+        return BytesIO(self.read(path))
+
+
+class MemoryStorage(_VirtualStorage):
+    '''
+    Keeps a whole tree in memory.
+
+    files: a dict mapping paths to their content (str)
+    '''
+
+    def __init__(self, files=None):
+        super(MemoryStorage, self).__init__()
+        self._contents = {}
+        for (path, content) in (files or {}).iteritems():
+            self.write(path, content)
+
+    def write(self, path, content, mtime=None):
+        if type(content) is unicode:
+            content = content.encode('utf-8')
+        mtime = mtime if mtime is not None else time.time()
+        path = self._add_file(path, len(content), mtime)
+        self._contents[path] = content
+
+    def _read_file(self, path):
+        return self._contents[path]
+
+
+class ArchiveStorage(_VirtualStorage):
+    '''
+    Reads a zip or tar (optionally compressed) archive in place.
+    Members are indexed once when the archive is opened.
+    '''
+
+    def __init__(self, archive_path):
+        super(ArchiveStorage, self).__init__()
+        self.archive_path = archive_path
+        # path -> ZipInfo or TarInfo
+        self._members = {}
+        # ZipFile and TarFile share a file object among members, so
+        # members are read one at a time (e.g. by ConcurrentStorage).
+        self._lock = threading.Lock()
+        if zipfile.is_zipfile(archive_path):
+            self._zip = zipfile.ZipFile(archive_path)
+            self._tar = None
+            for info in self._zip.infolist():
+                if info.filename.endswith('/'):
+                    self._add_dir(self._normpath(info.filename))
+                    continue
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                path = self._add_file(info.filename, info.file_size, mtime)
+                self._members[path] = info
+        else:
+            self._zip = None
+            self._tar = tarfile.open(archive_path)
+            for info in self._tar.getmembers():
+                if info.isdir():
+                    self._add_dir(self._normpath(info.name))
+                elif info.isfile():
+                    path = self._add_file(info.name, info.size, info.mtime)
+                    self._members[path] = info
+
+    @staticmethod
+    def is_archive(path):
+        return (os.path.isfile(path)
+                and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path)))
+
+    def _read_file(self, path):
+        member = self._members[path]
+        with self._lock:
+            if self._zip:
+                return self._zip.read(member)
+            else:
+                return self._tar.extractfile(member).read()
+
+    def close(self):
+        if self._zip:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+
+class ConcurrentStorage(object):
+    '''
+    Wraps another storage and issues its calls for many paths concurrently
+    with a bounded thread pool, which helps on filesystems with high
+    latency per call (NFS, SMB, etc.)
+
+    Call prefetch() with paths which will be needed. Later calls for them
+    wait for (or just use) the results. Other calls go to the wrapped
+    storage directly.
+    Prefetched results are kept until clear() is called, so this is meant
+    for loading a project at once, not for watching changes.
+    '''
+
+    def __init__(self, storage, workers=8):
+        self.storage = storage
+        self.is_local = storage.is_local
+        self.workers = workers
+        self._pool = None
+        # (method name, normalized path) -> AsyncResult
+        self._results = {}
+
+    def _get_pool(self):
+        if self._pool is None:
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(self.workers)
+        return self._pool
+
+    def prefetch(self, method, paths):
+        '''
+        Starts calling a method (e.g. 'read', 'stat') for paths
+        in background threads.
+        '''
+        func = getattr(self.storage, method)
+        if tracing.is_tracing():
+            func = tracing.traced(u'io.{}'.format(method), func)
+        for path in paths:
+            key = (method, os.path.normpath(path))
+            if key not in self._results:
+                self._results[key] = self._get_pool().apply_async(func,
+                                                                  (path,))
+
+    def _call(self, method, path):
+        result = self._results.get((method, os.path.normpath(path)))
+        if result is None:
+            return getattr(self.storage, method)(path)
+        # Exceptions in the thread (e.g. OSError) are raised here.
+        return result.get()
+
+    def abspath(self, path):
+        return self.storage.abspath(path)
+
+    def exists(self, path):
+        return self._call('exists', path)
+
+    def isfile(self, path):
+        return self._call('isfile', path)
+
+    def isdir(self, path):
+        return self._call('isdir', path)
+
+    def islink(self, path):
+        return self._call('islink', path)
+
+    def listdir(self, path):
+        return self._call('listdir', path)
+
+    def list_entries(self, path):
+        return self._call('list_entries', path)
+
+    def dir_key(self, path):
+        return self._call('dir_key', path)
+
+    def stat(self, path):
+        return self._call('stat', path)
+
+    def read(self, path):
+        return self._call('read', path)
+
+    def open(self, path):
+        if ('read', os.path.normpath(path)) in self._results:
+            return BytesIO(self.read(path))
+        return self.storage.open(path)
+
+    def clear(self):
+        self._results.clear()
+
+    def close(self):
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self.clear()
+
+
+# Used when no storage is specified.
+local_storage = LocalStorage()
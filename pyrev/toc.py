@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Builds a table of contents (bookmarks) without running the full Parser.
+
+Each file is scanned with a single multiline pattern which recognizes
+headings and block boundaries. Headings inside blocks are skipped.
+'''
+
+import json
+import os
+import re
+import time
+
+from project import ReVIEWProject
+
+from logging import getLogger, NullHandler
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+BM_TITLE = ReVIEWProject.BM_TITLE
+BM_LEVEL = ReVIEWProject.BM_LEVEL
+BM_SOURCE_FILE_NAME = ReVIEWProject.BM_SOURCE_FILE_NAME
+BM_SOURCE_CHAP_INDEX = ReVIEWProject.BM_SOURCE_CHAP_INDEX
+BM_IS_COLUMN = ReVIEWProject.BM_IS_COLUMN
+# Line number of the heading. None for parts.
+BM_LINE_NUM = 'line_num'
+
+r_toc = re.compile(r'^(?:'
+                   r'(?P<level>={1,5})(?!=)'
+                   r'(?P<option>\[[^\]\n]*\])?'
+                   r'(?P<label>\{[^}\n]*\})?'
+                   r'[ \t]*(?P<title>[^\n]*?)'
+                   r'|(?P<begin>//[^\n]*\{)'
+                   r'|(?P<end>//\}[^\n]*)'
+                   r')[ \t\r]*$',
+                   re.MULTILINE)
+
+
+class TocProblem(object):
+    def __init__(self, source_name, line_num, desc):
+        self.source_name = source_name
+        self.line_num = line_num
+        self.desc = desc
+
+    def __str__(self):
+        return u'{} L{}: {}'.format(self.source_name, self.line_num,
+                                    self.desc)
+
+
+def scan_toc(content, source_name, base_level=0, problems=None):
+    '''
+    Scans a decoded (unicode) content of a single source file and returns
+    a list of bookmarks (dicts with BM_XXX keys) in it.
+
+    problems: a list where TocProblem objects are appended to,
+      when heading levels jump (e.g. "=" followed by "===").
+    '''
+    bookmarks = []
+    in_block = False
+    chap_index = 0
+    prev_level = base_level
+    line_num = 1
+    last_pos = 0
+    for m in r_toc.finditer(content):
+        line_num += content.count(u'\n', last_pos, m.start())
+        last_pos = m.start()
+        if m.group('end') is not None:
+            in_block = False
+            continue
+        if in_block:
+            continue
+        if m.group('begin') is not None:
+            in_block = True
+            continue
+        level = base_level + len(m.group('level'))
+        is_column = m.group('option') == u'[column]'
+        if level > prev_level + 1 and problems is not None:
+            problems.append(TocProblem(source_name, line_num,
+                                       u'Heading level jumps from {} to {}'
+                                       .format(prev_level, level)))
+        if level == base_level + 1:
+            source_chap_index = chap_index
+            chap_index += 1
+        else:
+            source_chap_index = None
+        bookmarks.append({BM_LEVEL: level,
+                          BM_TITLE: m.group('title').strip(),
+                          BM_SOURCE_FILE_NAME: source_name,
+                          BM_SOURCE_CHAP_INDEX: source_chap_index,
+                          BM_IS_COLUMN: is_column,
+                          BM_LINE_NUM: line_num})
+        prev_level = level
+    return bookmarks
+
+
+class TocBuilder(object):
+    '''
+    Builds bookmarks for a whole ReVIEWProject, with part levels.
+    '''
+
+    def __init__(self, project, logger=None):
+        self.project = project
+        self.logger = logger or local_logger
+        self.bookmarks = []
+        self.problems = []
+        self.num_files = 0
+        self.num_lines = 0
+        self.num_bytes = 0
+        self.elapsed = 0.0
+
+    def _scan_file(self, filename, base_level):
+        path = os.path.join(self.project.source_dir, filename)
+        raw = self.project.storage.read(path)
+        content = raw.decode('utf-8-sig')
+        self.num_files += 1
+        self.num_bytes += len(raw)
+        self.num_lines += content.count(u'\n')
+        self.bookmarks.extend(scan_toc(content, filename, base_level,
+                                       self.problems))
+
+    def build(self):
+        '''
+        Scans all source files in the same order as
+        ReVIEWProject.parse_source_files() and returns the bookmarks.
+        '''
+        project = self.project
+        start = time.time()
+        for filename in project.predef_filenames:
+            self._scan_file(filename, 0)
+        if project.parts:
+            for (part_title, part_chaps) in project.parts:
+                self.bookmarks.append({BM_LEVEL: 1,
+                                       BM_TITLE: part_title.strip(),
+                                       BM_SOURCE_FILE_NAME: None,
+                                       BM_SOURCE_CHAP_INDEX: None,
+                                       BM_IS_COLUMN: False,
+                                       BM_LINE_NUM: None})
+                for chap in part_chaps:
+                    self._scan_file(chap, 1)
+        else:
+            for chap in project.chaps or []:
+                self._scan_file(chap, 0)
+        for filename in project.postdef_filenames:
+            self._scan_file(filename, 0)
+        self.elapsed = time.time() - start
+        return self.bookmarks
+
+    def get_throughput(self):
+        elapsed = self.elapsed or 1e-9
+        return (u'Scanned {} file(s) ({} lines, {} bytes) in {:.3f}s'
+                u' ({:.0f} lines/s, {:.2f} MB/s)'
+                .format(self.num_files, self.num_lines, self.num_bytes,
+                        self.elapsed, self.num_lines / elapsed,
+                        self.num_bytes / elapsed / (1024 * 1024)))
+
+
+def format_pdftk(bookmarks, include_columns=False):
+    '''
+    Yields lines in pdftk's dump_data_utf8 format (BookmarkBegin, ...).
+    Page numbers are not known to pyrev, so all of them are 1.
+    '''
+    for bookmark in bookmarks:
+        if bookmark[BM_IS_COLUMN] and not include_columns:
+            continue
+        yield u'BookmarkBegin'
+        yield u'BookmarkTitle: {}'.format(bookmark[BM_TITLE])
+        yield u'BookmarkLevel: {}'.format(bookmark[BM_LEVEL])
+        yield u'BookmarkPageNumber: 1'
+
+
+def format_json(bookmarks):
+    return json.dumps(bookmarks, ensure_ascii=False, indent=2,
+                      separators=(',', ': '), sort_keys=True)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Records where a lint run spends time as Chrome trace events, which
+chrome://tracing and Perfetto (https://ui.perfetto.dev) show as
+a timeline.
+
+ with tracing.span(u'parse', file=source_name) as s:
+     ...
+     s.set(problems=num_problems)
+
+span() returns a shared object doing nothing until start() is called,
+so spans left in the code cost little more than a function call.
+
+Each process records its own events. Worker processes start a tracer of
+their own (init_worker()) and send their events back to the parent
+with results (take_worker_events(), add_events()), so that each worker
+appears in its own track. Threads have their own tracks too.
+'''
+
+import json
+import os
+import threading
+import time
+
+# Set by start(). None while not tracing.
+_tracer = None
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+    def set(self, **kwargs):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add(self.name, self.start, time.time() - self.start,
+                        self.args)
+        return False
+
+    def set(self, **kwargs):
+        '''
+        Adds args known only after the span started (e.g. counts).
+        '''
+        self.args.update(kwargs)
+
+
+class Tracer(object):
+    def __init__(self, worker=False):
+        # True in worker processes, whose events go to the parent.
+        self.worker = worker
+        self.events = []
+        # pid -> process name, (pid, tid) -> thread name
+        self._process_names = {}
+        self._thread_names = {}
+
+    def add(self, name, start, duration, args):
+        '''
+        Adds a complete event. start and duration are in seconds.
+        '''
+        pid = os.getpid()
+        thread = threading.current_thread()
+        tid = thread.ident
+        if pid not in self._process_names:
+            # Not imported until tracing, as parser imports this module.
+            import multiprocessing
+            self._process_names[pid] = multiprocessing.current_process().name
+        if (pid, tid) not in self._thread_names:
+            self._thread_names[(pid, tid)] = thread.name
+        # Appending to a list is atomic, so threads may share this.
+        self.events.append({'name': name,
+                            'cat': 'pyrev',
+                            'ph': 'X',
+                            'ts': start * 1000000,
+                            'dur': duration * 1000000,
+                            'pid': pid,
+                            'tid': tid,
+                            'args': args})
+
+    def _get_metadata(self):
+        events = []
+        for (pid, name) in self._process_names.iteritems():
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                           'args': {'name': name}})
+        for ((pid, tid), name) in self._thread_names.iteritems():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                           'tid': tid, 'args': {'name': name}})
+        return events
+
+    def take_events(self):
+        '''
+        Returns events recorded so far with their metadata, and forgets
+        them.
+        '''
+        events = self._get_metadata() + self.events
+        self.events = []
+        self._process_names = {}
+        self._thread_names = {}
+        return events
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self._get_metadata() + self.events,
+                       'displayTimeUnit': 'ms'}, f)
+
+
+def start():
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop():
+    '''
+    Stops tracing and returns the Tracer, or None if not tracing.
+    '''
+    global _tracer
+    tracer = _tracer
+    _tracer = None
+    return tracer
+
+
+def is_tracing():
+    return _tracer is not None
+
+
+def span(name, **kwargs):
+    '''
+    Returns a context manager recording a span named name, with kwargs
+    as its args.
+    '''
+    if _tracer is None:
+        return NULL_SPAN
+    return Span(_tracer, name, kwargs)
+
+
+def traced(name, func):
+    '''
+    Returns func recording a span for each call, whose first argument
+    (e.g. a path) is recorded as "target".
+    '''
+    def wrapper(*args, **kwargs):
+        with span(name, target=args[0] if args else None):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def init_worker(tracing):
+    '''
+    Called in each worker process. A tracer inherited by fork() is
+    replaced, since the parent records its events by itself.
+    '''
+    global _tracer
+    _tracer = Tracer(worker=True) if tracing else None
+
+
+def take_worker_events():
+    '''
+    Returns events recorded in this worker process since the last call,
+    to be passed to add_events() in the parent. Empty unless this is
+    a worker process with tracing.
+    '''
+    if _tracer is None or not _tracer.worker:
+        return []
+    return _tracer.take_events()
+
+
+def add_events(events):
+    '''
+    Adds events from a worker process.
+    '''
+    if _tracer is None:
+        return
+    for event in events:
+        if event['ph'] == 'M':
+            if event['name'] == 'process_name':
+                _tracer._process_names[event['pid']] = event['args']['name']
+            else:
+                _tracer._thread_names[(event['pid'], event['tid'])] = (
+                    event['args']['name'])
+        else:
+            _tracer.events.append(event)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Finds source files changed in a local git repository, so that only they
+(and files referring to them) are linted.
+
+GitIndexStorage reads files staged in the index (what "git commit" would
+record) without checking them out. Contents are streamed through a single
+"git cat-file --batch" process.
+'''
+
+import os
+import posixpath
+import subprocess
+
+from storage import _VirtualStorage
+
+from logging import getLogger, NullHandler
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+# File modes in the index which are not regular files.
+# (symlinks and submodules)
+_SKIPPED_MODES = set(['120000', '160000'])
+
+
+class GitError(Exception):
+    pass
+
+
+class GitRepository(object):
+    '''
+    Runs git commands for a repository containing path.
+    '''
+
+    def __init__(self, path, logger=None):
+        self.logger = logger or local_logger
+        cwd = path if os.path.isdir(path) else os.path.dirname(path)
+        self.root = os.path.normpath(
+            self._run(['rev-parse', '--show-toplevel'], cwd).strip())
+        self._cat_file = None
+
+    def _run(self, args, cwd=None):
+        try:
+            proc = subprocess.Popen(['git'] + args, cwd=cwd or self.root,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+        except OSError as e:
+            raise GitError(u'Failed to run git: {}'.format(e))
+        (out, err) = proc.communicate()
+        if proc.returncode != 0:
+            raise GitError(u'"git {}" failed: {}'
+                           .format(u' '.join(args),
+                                   err.decode('utf-8', 'replace').strip()))
+        return out
+
+    def has_rev(self, rev):
+        try:
+            self._run(['rev-parse', '--verify', '--quiet',
+                       '{}^{{commit}}'.format(rev)])
+            return True
+        except GitError:
+            return False
+
+    def get_changed_paths(self, rev=None, staged=False):
+        '''
+        Returns paths (relative to root) changed since rev.
+        With staged, the index is compared instead of the working tree.
+        Files not tracked yet are included unless staged.
+        Without rev, HEAD is used (or everything in the index if there's
+        no commit yet).
+        '''
+        rev = rev or 'HEAD'
+        if not self.has_rev(rev):
+            if rev != 'HEAD':
+                raise GitError(u'Unknown revision "{}"'.format(rev))
+            return map(lambda x: x[2], self.list_index())
+        args = ['diff', '--name-only', '-z', '--no-renames']
+        if staged:
+            args.append('--cached')
+        paths = self._run(args + [rev, '--']).split('\0')
+        if not staged:
+            paths.extend(self._run(['ls-files', '-z', '--others',
+                                    '--exclude-standard']).split('\0'))
+        return sorted(set(filter(None, paths)))
+
+    def list_index(self):
+        '''
+        Returns (mode, object name, path) for files in the index.
+        Unmerged files are skipped.
+        '''
+        entries = []
+        for line in self._run(['ls-files', '-s', '-z']).split('\0'):
+            if not line:
+                continue
+            (info, path) = line.split('\t', 1)
+            (mode, name, stage) = info.split(' ')
+            if stage == '0':
+                entries.append((mode, name, path))
+        return entries
+
+    def cat_file(self, name):
+        '''
+        Returns content of an object (e.g. a blob name, "HEAD:path"),
+        or None if it doesn't exist.
+        '''
+        if '\n' in name:
+            return None
+        if self._cat_file is None:
+            try:
+                self._cat_file = subprocess.Popen(
+                    ['git', 'cat-file', '--batch'], cwd=self.root,
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            except OSError as e:
+                raise GitError(u'Failed to run git: {}'.format(e))
+        proc = self._cat_file
+        proc.stdin.write(name + '\n')
+        proc.stdin.flush()
+        header = proc.stdout.readline()
+        if not header:
+            raise GitError(u'"git cat-file" exited unexpectedly')
+        fields = header.split()
+        if len(fields) != 3:
+            # "<name> missing" or "<name> ambiguous"
+            return None
+        content = proc.stdout.read(int(fields[2]))
+        # Trailing LF
+        proc.stdout.read(1)
+        return content
+
+    def close(self):
+        if self._cat_file:
+            self._cat_file.stdin.close()
+            self._cat_file.wait()
+            self._cat_file = None
+
+
+class GitIndexStorage(_VirtualStorage):
+    '''
+    Reads files staged in the index of a GitRepository.
+    Paths are relative to a virtual root "/" as the repository's root.
+    '''
+
+    def __init__(self, repository):
+        super(GitIndexStorage, self).__init__()
+        self.repository = repository
+        # path -> object name
+        self._objects = {}
+        for (mode, name, path) in repository.list_index():
+            if mode in _SKIPPED_MODES:
+                continue
+            # Sizes are not known until read. mtime doesn't exist.
+            path = self._add_file(path, 0, 0)
+            self._objects[path] = name
+
+    def _read_file(self, path):
+        content = self.repository.cat_file(self._objects[path])
+        if content is None:
+            raise IOError(2, 'Object missing in repository', path)
+        return content
+
+    def stat(self, path):
+        path = self._normpath(path)
+        if path in self._files and not self._files[path][0]:
+            self._files[path] = (len(self._read_file(path)), 0)
+        return super(GitIndexStorage, self).stat(path)
+
+    def close(self):
+        self.repository.close()
+
+
+def to_storage_path(storage_root, repo_path):
+    '''
+    Converts a path relative to the repository's root (posix-style) into
+    a path in a storage whose root is storage_root.
+    '''
+    return os.path.normpath(os.path.join(storage_root,
+                                         *repo_path.split(posixpath.sep)))
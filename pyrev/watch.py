@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2014 Daisuke Miyakawa d.miyakawa@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Lints a project again whenever its files change, keeping the project and
+results of parsing each file (FileResult) in memory.
+
+Only changed files are parsed again. Results of all files are merged in
+catalog order each time, so checks across files (e.g. references to
+a list in another chapter) follow changes of the files they depend on.
+
+Changes are detected with inotify on Linux, or by polling stats.
+'''
+
+import collections
+import errno
+import os
+import select
+import struct
+import time
+
+from cache import LRUCache
+from imageinfo import ImageInspector
+from parser import Parser, ParseProblem
+from preproc import parse_directive
+from project import ReVIEWProject
+
+import parallel
+
+from logging import getLogger, NullHandler
+from logging import INFO
+
+local_logger = getLogger(__name__)
+local_logger.addHandler(NullHandler())
+
+# Default upper limit for results kept in memory, approximated by total
+# size of their source files.
+WATCH_CACHE_BYTES = 16 * 1024 * 1024
+
+# Changes within this period (in seconds) are handled at once, since
+# editors often write a file several times on a single save.
+COALESCE_SECONDS = 0.05
+POLL_SECONDS = 0.5
+
+
+class PollingMonitor(object):
+    '''
+    Detects changes of files in directories by comparing their stats.
+    '''
+
+    def __init__(self, interval=POLL_SECONDS):
+        self.interval = interval
+        self._dirs = set()
+        # path -> (size, mtime)
+        self._stamps = {}
+
+    def _scan(self, dir_path):
+        stamps = {}
+        try:
+            filenames = os.listdir(dir_path)
+        except OSError:
+            return stamps
+        for filename in filenames:
+            path = os.path.join(dir_path, filename)
+            try:
+                st = os.stat(path)
+                stamps[path] = (st.st_size, st.st_mtime)
+            except OSError:
+                pass
+        return stamps
+
+    def watch(self, dirs):
+        for dir_path in set(dirs) - self._dirs:
+            self._dirs.add(dir_path)
+            self._stamps.update(self._scan(dir_path))
+
+    def poll(self):
+        '''
+        Returns a set of paths changed since the last call.
+        '''
+        stamps = {}
+        for dir_path in self._dirs:
+            stamps.update(self._scan(dir_path))
+        changed = set(path for (path, stamp) in stamps.iteritems()
+                      if self._stamps.get(path) != stamp)
+        changed.update(set(self._stamps) - set(stamps))
+        self._stamps = stamps
+        return changed
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            changed = self.poll()
+            if changed or time.time() >= deadline:
+                return changed
+            time.sleep(min(self.interval, max(0, deadline - time.time())))
+
+    def close(self):
+        pass
+
+
+class InotifyMonitor(object):
+    '''
+    Detects changes of files in directories with Linux inotify, which is
+    called through ctypes. Raises OSError when inotify is not available.
+    '''
+
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+            | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        library = ctypes.util.find_library('c')
+        try:
+            self._libc = ctypes.CDLL(library, use_errno=True)
+            self._fd = self._libc.inotify_init()
+        except (OSError, AttributeError) as e:
+            raise OSError(errno.ENOSYS, u'inotify is not available: {}'
+                          .format(e))
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), u'inotify_init() failed')
+        self._get_errno = ctypes.get_errno
+        # watch descriptor -> directory
+        self._dirs = {}
+
+    def watch(self, dirs):
+        for dir_path in set(dirs) - set(self._dirs.values()):
+            if not os.path.isdir(dir_path):
+                continue
+            encoded = dir_path
+            if type(encoded) is unicode:
+                encoded = encoded.encode('utf-8')
+            wd = self._libc.inotify_add_watch(self._fd, encoded, self.MASK)
+            if wd < 0:
+                raise OSError(self._get_errno(),
+                              u'Failed to watch "{}"'.format(dir_path))
+            self._dirs[wd] = dir_path
+
+    def _read_events(self):
+        changed = set()
+        data = os.read(self._fd, 64 * 1024)
+        pos = 0
+        while pos + self.EVENT_HEADER.size <= len(data):
+            (wd, mask, _, name_len) = self.EVENT_HEADER.unpack_from(data, pos)
+            pos += self.EVENT_HEADER.size
+            name = data[pos:pos + name_len].rstrip('\0')
+            pos += name_len
+            dir_path = self._dirs.get(wd)
+            if mask & self.IN_IGNORED:
+                self._dirs.pop(wd, None)
+            if dir_path is None:
+                continue
+            if name:
+                if type(dir_path) is unicode:
+                    name = name.decode('utf-8', 'replace')
+                changed.add(os.path.join(dir_path, name))
+            else:
+                changed.add(dir_path)
+        return changed
+
+    def wait(self, timeout):
+        '''
+        Returns a set of paths changed, or an empty set after timeout.
+        '''
+        (readable, _, _) = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        return self._read_events()
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_monitor(logger=None):
+    '''
+    Returns InotifyMonitor if available, PollingMonitor otherwise.
+    '''
+    logger = logger or local_logger
+    try:
+        return InotifyMonitor()
+    except OSError as e:
+        logger.debug(u'Falling back to polling: {}'.format(e))
+        return PollingMonitor()
+
+
+class Watcher(object):
+    '''
+    Keeps a project and results of its files for linting it repeatedly.
+    '''
+
+    def __init__(self, source_dir, abort_threshold, logger=None,
+                 cache_bytes=None, parse_cache=None):
+        self.source_dir = os.path.normpath(source_dir)
+        self.abort_threshold = abort_threshold
+        self.logger = logger or local_logger
+        self.project = None
+        self.inspector = None
+        # filename -> (token, FileResult)
+        # where token tells if the result is still valid.
+        self._results = LRUCache(cache_bytes or WATCH_CACHE_BYTES)
+        # filename -> paths included from the file
+        self._includes = {}
+        # ParseCache (see parsecache.py) consulted before parsing a file
+        # not in memory. Optional.
+        self.parse_cache = parse_cache
+        # Parser holding problems of the last lint.
+        self.parser = None
+        # filename -> FileResult merged in the last lint.
+        self.results = collections.OrderedDict()
+        # Problems (lines of Parser._dump_problems()) of the last lint.
+        self.problems = []
+        # Number of files parsed (not reused) in the last lint.
+        self.num_parsed = 0
+
+    def load_project(self):
+        '''
+        (Re)loads the project, which is needed when config, catalog or
+        images change. Returns False if the project is not available.
+        '''
+        self.project = ReVIEWProject.instantiate(self.source_dir,
+                                                 logger=self.logger)
+        if not self.project:
+            return False
+        self.inspector = ImageInspector(logger=self.logger,
+                                        storage=self.project.storage)
+        return True
+
+    def get_watched_dirs(self):
+        dirs = set([self.source_dir])
+        project = self.project
+        if project and os.path.isdir(project.image_dir_path):
+            dirs.add(project.image_dir_path)
+            dirs.update(project.images.get_sub_dir_paths())
+        for paths in self._includes.itervalues():
+            dirs.update(map(os.path.dirname, paths))
+        return dirs
+
+    def is_project_file(self, path):
+        '''
+        Returns True if a change of path requires reloading the project.
+        '''
+        project = self.project
+        if not project:
+            return True
+        if os.path.dirname(path) == self.source_dir:
+            filename = os.path.basename(path)
+            return (filename in ReVIEWProject.RELATED_FILES
+                    or filename == project.config_file
+                    or filename in project._catalog_files)
+        image_dir_path = project.image_dir_path
+        return (path == image_dir_path
+                or path.startswith(image_dir_path + os.sep))
+
+    def _stamp(self, path):
+        try:
+            st = self.project.storage.stat(path)
+            return (st.st_size, st.st_mtime)
+        except OSError:
+            return None
+
+    def _get_token(self, filename, path):
+        images = map(lambda x: x.rel_path,
+                     self.project.images.get(filename) or [])
+        includes = map(lambda x: (x, self._stamp(x)),
+                       self._includes.get(filename, []))
+        return (self._stamp(path), tuple(images), tuple(includes))
+
+    def _find_includes(self, path):
+        try:
+            lines = self.project.storage.read(path).splitlines()
+        except (IOError, OSError):
+            return []
+        includes = []
+        for line in lines:
+            directive = parse_directive(line)
+            if directive:
+                includes.append(os.path.normpath(os.path.join(
+                    os.path.dirname(path), directive[0])))
+        return includes
+
+    def _get_result(self, filename):
+        project = self.project
+        path = os.path.normpath(u'{}/{}'.format(project.source_dir,
+                                                filename))
+        entry = self._results.get(filename)
+        if entry and entry[0] == self._get_token(filename, path):
+            return entry[1]
+        self._includes[filename] = self._find_includes(path)
+        token = self._get_token(filename, path)
+        parser = Parser(project=project,
+                        ignore_threshold=INFO,
+                        abort_threshold=self.abort_threshold,
+                        logger=self.logger)
+        key = None
+        result = None
+        if self.parse_cache:
+            key = self.parse_cache.get_key(parser, project, filename)
+            result = key and self.parse_cache.get(key)
+        if result is None:
+            result = parser.parse_file_to_result(path, filename)
+            self.num_parsed += 1
+            if key:
+                self.parse_cache.put(key, result)
+        self._results.put(filename, (token, result), token[0][0]
+                          if token[0] else 0)
+        return result
+
+    def lint(self, overrides=None):
+        '''
+        Lints the project, parsing only files changed since the last lint.
+        Returns a tuple (added, removed) of problems compared to the last
+        lint.
+
+        overrides: a dict mapping filenames to FileResult used instead of
+          files on disk (e.g. documents being edited).
+        '''
+        project = self.project
+        overrides = overrides or {}
+        self.num_parsed = 0
+        parser = Parser(project=project,
+                        ignore_threshold=INFO,
+                        abort_threshold=self.abort_threshold,
+                        logger=self.logger)
+        self.results = collections.OrderedDict()
+        for filename in project.source_filenames:
+            if filename in overrides:
+                result = overrides[filename]
+            else:
+                result = self._get_result(filename)
+            self.results[filename] = result
+            parallel.merge_file_result(parser, project, filename, result)
+        parser.check_images(self.inspector)
+        self.parser = parser
+        problems = []
+        if parser.reporter.problems:
+            parser._dump_problems(dump_func=problems.append)
+            # Drops the header ("Problems:")
+            problems = problems[1:]
+        added = collections.Counter(problems)
+        added.subtract(self.problems)
+        removed = collections.Counter(self.problems)
+        removed.subtract(problems)
+        self.problems = problems
+        return (list((added + collections.Counter()).elements()),
+                list((removed + collections.Counter()).elements()))
+
+    def handle_changes(self, paths):
+        '''
+        Lints the project again for changed paths.
+        Returns (added, removed) like lint(), or None if nothing relevant
+        changed.
+        '''
+        if any(map(self.is_project_file, paths)):
+            self.logger.debug(u'Reloading project')
+            if not self.load_project():
+                return None
+        elif not filter(lambda x: x.endswith('.re'), paths):
+            relevant = set()
+            for includes in self._includes.itervalues():
+                relevant.update(includes)
+            if not relevant & set(paths):
+                return None
+        return self.lint()
+
+    def run(self, monitor, dump_func, max_rounds=None):
+        '''
+        Prints problems, then waits for changes and prints differences of
+        problems for each change, until interrupted (or max_rounds).
+        '''
+        if not self.project and not self.load_project():
+            self.logger.error(u'Failed to instanciate Re:VIEW Project ({}).'
+                              .format(self.source_dir))
+            return 1
+        start = time.time()
+        self.lint()
+        for problem in self.problems:
+            dump_func(problem)
+        dump_func(u'{} problem(s) ({:.0f}ms). Watching changes..'
+                  .format(len(self.problems), (time.time() - start) * 1000))
+        rounds = 0
+        while max_rounds is None or rounds < max_rounds:
+            monitor.watch(self.get_watched_dirs())
+            changed = monitor.wait(POLL_SECONDS)
+            if not changed:
+                continue
+            rounds += 1
+            # Coalesces successive writes.
+            while True:
+                more = monitor.wait(COALESCE_SECONDS)
+                if not more:
+                    break
+                changed.update(more)
+            start = time.time()
+            try:
+                result = self.handle_changes(changed)
+            except ParseProblem as e:
+                dump_func(u'Aborted: {}'.format(unicode(e)))
+                continue
+            if result is None:
+                continue
+            (added, removed) = result
+            for problem in removed:
+                dump_func(u'-{}'.format(problem))
+            for problem in added:
+                dump_func(u'+{}'.format(problem))
+            dump_func(u'{} problem(s), {} parsed ({:.0f}ms)'
+                      .format(len(self.problems), self.num_parsed,
+                              (time.time() - start) * 1000))
+        return 0
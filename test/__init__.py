@@ -11,6 +11,23 @@ sys.path.insert(0, _parent_dir)
 from regtest import RegressionTest
 from parsertest import ParserTest
 from projecttest import ProjectTest
+from imageinfotest import ImageInfoTest
+from toctest import TocTest
+from profilestest import ProfilesTest
+from fingerprinttest import FingerprintTest
+from startuptest import StartupTest
+from loadertest import LoaderTest
+from watchtest import WatchTest
+from lsptest import LspTest
+from snippettest import SnippetTest
+from servertest import ServerTest
+from vcstest import VcsTest
+from depgraphtest import DependencyGraphTest
+from baselinetest import BaselineTest
+from outputtest import OutputTest
+from profilertest import ProfilerTest
+from filestatstest import FileStatsTest
+from tracingtest import TracingTest
 
 if __name__ == '__main__':
 
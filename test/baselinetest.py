@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.baseline import Baseline, get_fingerprint
+from pyrev.parser import get_rule_id
+from pyrev.snippet import SnippetLinter
+import unittest
+
+import shutil
+import tempfile
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+_TEXT = u'= Chap\n@<list>{l1}\n@<list>{l2}\n'
+
+
+class BaselineTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'baseline.txt')
+        self.linter = SnippetLinter(logger=local_logger)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _lint(self, text, source_name=u'ch1.re'):
+        return self.linter.lint(text, source_name)[0]
+
+    def test_rule_id(self):
+        self.assertEqual(u'inline-for-id-found-but-no-block-for-it',
+                         get_rule_id(u'Inline for id "l1" found'
+                                     u' but no block for it.'))
+        self.assertEqual(u'end-is-missing',
+                         get_rule_id(u'"#@end" is missing'))
+        self.assertEqual(u'wrong-charactor-at',
+                         get_rule_id(u'Wrong charactor at C5 ("{" != "x")'))
+
+    def test_fingerprint(self):
+        problems = self._lint(_TEXT)
+        self.assertEqual(2, len(problems))
+        # Same content at another line.
+        shifted = self._lint(u'= Chap\n\nText\n@<list>{l1}\n')
+        self.assertEqual(4, shifted[0].line_num)
+        self.assertEqual(get_fingerprint(problems[0]),
+                         get_fingerprint(shifted[0]))
+        self.assertNotEqual(get_fingerprint(problems[0]),
+                            get_fingerprint(problems[1]))
+        other = self._lint(u'= Chap\n@<list>{l1}\n', u'ch2.re')
+        self.assertNotEqual(get_fingerprint(problems[0]),
+                            get_fingerprint(other[0]))
+
+    def test_filter(self):
+        baseline = Baseline(self.path, update=True, logger=local_logger)
+        self.assertFalse(baseline.load())
+        self.assertEqual([], baseline.filter(self._lint(_TEXT)))
+        baseline.finish()
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual(sorted(lines[1:]), lines[1:])
+
+        baseline = Baseline(self.path, logger=local_logger)
+        self.assertTrue(baseline.load())
+        problems = baseline.filter(
+            self._lint(u'= Chap\n\n@<list>{l2}\n@<list>{l3}\n@<list>{l2}\n'))
+        self.assertEqual([4, 5], map(lambda x: x.line_num, problems))
+        self.assertEqual(1, baseline.num_suppressed)
+
+    def test_update_partially(self):
+        baseline = Baseline(self.path, update=True, logger=local_logger)
+        baseline.filter(self._lint(_TEXT) + self._lint(_TEXT, u'ch2.re'))
+        baseline.finish()
+        # Only ch1.re is linted again, where a problem is fixed.
+        baseline = Baseline(self.path, update=True, logger=local_logger)
+        baseline.load()
+        baseline.filter(self._lint(u'= Chap\n@<list>{l2}\n'))
+        baseline.finish([u'ch1.re'])
+        baseline = Baseline(self.path, logger=local_logger)
+        baseline.load()
+        self.assertEqual([u'ch1.re', u'ch2.re', u'ch2.re'],
+                         sorted(map(lambda x: x[0],
+                                    baseline.fingerprints.elements())))
+        self.assertEqual(1, len(baseline.filter(self._lint(_TEXT))))
+
+
+if __name__ == '__main__':
+    unittest.main()
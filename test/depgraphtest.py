@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.depgraph import DependencyGraph
+from pyrev.parser import Parser
+from pyrev.project import ReVIEWProject
+import unittest
+
+import shutil
+import tempfile
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+
+def _write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class DependencyGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.files = {'config.yml': 'bookname: book\n',
+                      'catalog.yml': ('CHAPS:\n - ch1.re\n - ch2.re\n'
+                                      ' - ch3.re\n - ch4.re\n'),
+                      'ch1.re': ('= Chap1\n//list[l1][List]{\n//}\n'
+                                 '@<list>{l3}\n'),
+                      'ch2.re': '= Chap2\n@<list>{l1}\n',
+                      'ch3.re': ('= Chap3\n//list[l3][List]{\n'
+                                 '#@mapfile(code.rb)\n#@end\n//}\n'),
+                      'ch4.re': 'No chapter\n@<chap>{ch1}\n',
+                      'code.rb': 'puts 1\n'}
+        for (filename, content) in self.files.iteritems():
+            _write(os.path.join(self.tempdir, filename), content)
+        self.project = ReVIEWProject.instantiate(self.tempdir,
+                                                 logger=local_logger)
+        self.parsed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _get_result(self, filename):
+        self.parsed.append(filename)
+        parser = Parser(project=self.project, logger=local_logger)
+        return parser.parse_file_to_result(
+            os.path.join(self.tempdir, filename), filename)
+
+    def _refresh(self):
+        graph = DependencyGraph(self.tempdir, logger=local_logger)
+        graph.load()
+        self.parsed = []
+        graph.refresh(self.project, self._get_result)
+        graph.save()
+        return graph
+
+    def test_get_affected(self):
+        graph = self._refresh()
+        self.assertEqual(['ch1.re', 'ch2.re', 'ch3.re', 'ch4.re'],
+                         self.parsed)
+        self.assertEqual([['list', 'l1']], graph.files['ch2.re']['references'])
+        self.assertEqual(['code.rb'], graph.files['ch3.re']['includes'])
+
+        # ch1.re refers to l3 before ch3.re, which is an error anyway.
+        self.assertEqual(['ch1.re', 'ch2.re'],
+                         graph.get_affected(['ch1.re']))
+        self.assertEqual(['ch3.re'], graph.get_affected(['ch3.re']))
+        self.assertEqual(['ch3.re'], graph.get_affected(['code.rb']))
+        self.assertEqual(['ch2.re', 'ch4.re'], graph.get_referring('ch1.re'))
+        self.assertEqual(['ch2.re'],
+                         graph.get_referring('ch1.re', checked_only=True))
+
+        # Removing the list affects ch2.re through the previous deps.
+        # ch4.re (without chapters) is affected since ch1.re had the only
+        # chapter before it.
+        previous = {'ch1.re': graph.files['ch1.re']}
+        _write(os.path.join(self.tempdir, 'ch1.re'), 'No chapter\n')
+        graph = self._refresh()
+        self.assertEqual(['ch1.re'], self.parsed)
+        self.assertEqual(['ch1.re'], graph.get_affected(['ch1.re']))
+        self.assertEqual(['ch1.re', 'ch2.re', 'ch4.re'],
+                         graph.get_affected(['ch1.re'], previous))
+
+        # Deps of ch3.re depend on the included file.
+        _write(os.path.join(self.tempdir, 'code.rb'), 'puts 2\n')
+        self._refresh()
+        self.assertEqual(['ch3.re'], self.parsed)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
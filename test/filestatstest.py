@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.filestats import FileStats
+from pyrev.parser import Parser
+import unittest
+
+import shutil
+import tempfile
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+
+class FileStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.files = {'ch1.re': '= Chap1\n@<list>{l1}\n',
+                      'ch2.re': ('= Chap2\n'
+                                 + '//list[l1][List]{\nputs 1\n//}\n' * 20)}
+        for (filename, content) in self.files.iteritems():
+            with open(os.path.join(self.tempdir, filename), 'w') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_stats(self):
+        # ch1.re takes 2 seconds, ch2.re 5 seconds.
+        ticks = iter([0, 2, 10, 15])
+        file_stats = FileStats(timer=ticks.next, use_tracemalloc=False)
+        parser = Parser(logger=local_logger)
+        file_stats.attach(parser)
+        for filename in ['ch1.re', 'ch2.re']:
+            parser.parse_file(os.path.join(self.tempdir, filename), 0,
+                              filename)
+        (ch1, ch2) = file_stats.stats
+        self.assertEqual((2, len(self.files['ch1.re']), 2.0),
+                         (ch1.lines, ch1.bytes, ch1.seconds))
+        self.assertEqual((0, 1, 1), (ch1.blocks, ch1.inlines, ch1.problems))
+        self.assertEqual((61, 5.0), (ch2.lines, ch2.seconds))
+        self.assertEqual((20, 0, 0), (ch2.blocks, ch2.inlines, ch2.problems))
+        self.assertEqual(1.0, ch1.lines_per_second)
+        self.assertTrue(0 < ch1.memory < ch2.memory)
+        self.assertEqual([ch2, ch1], file_stats.get_slowest())
+        self.assertEqual([ch2], file_stats.get_heaviest(1))
+
+        lines = []
+        file_stats.dump(lines.append, top=1)
+        self.assertEqual(u'2 file(s), 63 line(s), 7.000s', lines[0])
+        self.assertEqual(7, len(lines))
+        self.assertTrue(u'Est.Mem(KB)' in lines[2])
+        self.assertTrue(u'not measured' in lines[4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+_projects_dir = os.path.join(_cur_dir, 'projects')
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.fingerprint import Fingerprinter
+from pyrev.project import ReVIEWProject
+import unittest
+
+import shutil
+import tempfile
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+
+class FingerprintTest(unittest.TestCase):
+    def test_fingerprint(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            source_dir = os.path.join(tempdir, 'project1')
+            shutil.copytree(os.path.join(_projects_dir, 'project1'),
+                            source_dir)
+            # Old enough to trust (size, mtime).
+            for (dir_path, _, filenames) in os.walk(source_dir):
+                for filename in filenames:
+                    os.utime(os.path.join(dir_path, filename), (0, 0))
+            manifest_path = os.path.join(tempdir, 'manifest.json')
+
+            def _compute():
+                project = ReVIEWProject.instantiate(source_dir,
+                                                    logger=local_logger)
+                fingerprinter = Fingerprinter(project, manifest_path,
+                                              logger=local_logger)
+                fingerprinter.compute()
+                fingerprinter.save()
+                return fingerprinter
+
+            first = _compute()
+            self.assertTrue(first.is_changed())
+            self.assertEqual(['project1.re', 'draft1.re'],
+                             first.get_changed_chapters())
+            # config.yml, catalog.yml, 2 .re files and 2 images
+            self.assertEqual(6, first.num_hashed)
+
+            second = _compute()
+            self.assertEqual(first.digest, second.digest)
+            self.assertFalse(second.is_changed())
+            self.assertEqual([], second.get_changed_chapters())
+            self.assertEqual(0, second.num_hashed)
+
+            # Changing an image only affects the chapter using it.
+            with open(os.path.join(source_dir, 'images', 'draft1',
+                                   'mowa.jpg'), 'ab') as f:
+                f.write('x')
+            third = _compute()
+            self.assertNotEqual(first.digest, third.digest)
+            self.assertFalse(third.is_common_changed())
+            self.assertEqual(['draft1.re'], third.get_changed_chapters())
+            self.assertEqual(first.chapters['project1.re'],
+                             third.chapters['project1.re'])
+            self.assertEqual(1, third.num_hashed)
+        finally:
+            shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
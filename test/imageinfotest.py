@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.cache import StampCache
+from pyrev.imageinfo import ImageInspector, read_image_info
+from pyrev.imageinfo import find_image_problems
+import unittest
+
+import shutil
+import struct
+import tempfile
+from logging import ERROR, WARNING
+
+
+def _png(width, height, ppm=None):
+    def chunk(chunk_type, data):
+        return struct.pack('>I4s', len(data), chunk_type) + data + '\0' * 4
+    content = '\x89PNG\r\n\x1a\n'
+    content += chunk('IHDR', struct.pack('>IIBBBBB', width, height,
+                                         8, 6, 0, 0, 0))
+    if ppm:
+        content += chunk('pHYs', struct.pack('>IIB', ppm, ppm, 1))
+    content += chunk('IDAT', '\0' * 100)
+    return content
+
+
+def _jpeg(width, height, num_components, dpi=72):
+    jfif = 'JFIF\0\x01\x01' + struct.pack('>BHHBB', 1, dpi, dpi, 0, 0)
+    sof = struct.pack('>BHHB', 8, height, width, num_components)
+    return ('\xff\xd8'
+            + '\xff\xe0' + struct.pack('>H', len(jfif) + 2) + jfif
+            + '\xff\xc0' + struct.pack('>H', len(sof) + 2) + sof
+            + '\xff\xda')
+
+
+class ImageInfoTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _write(self, filename, content):
+        path = os.path.join(self.tempdir, filename)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_read_image_info(self):
+        info = read_image_info(self._write('a.png', _png(640, 480, 11811)))
+        self.assertEqual(('png', 640, 480, 300.0),
+                         (info.format, info.width, info.height, info.dpi))
+        info = read_image_info(self._write('b.jpg', _jpeg(800, 600, 4)))
+        self.assertEqual(('jpeg', 800, 600, 72.0, 'cmyk'),
+                         (info.format, info.width, info.height, info.dpi,
+                          info.color_mode))
+        info = read_image_info(self._write('c.gif', 'GIF89a'
+                                          + struct.pack('<HH', 10, 20)))
+        self.assertEqual(('gif', 10, 20), (info.format, info.width,
+                                            info.height))
+        info = read_image_info(self._write(
+                'd.svg', '<?xml version="1.0"?>\n'
+                '<svg xmlns="http://www.w3.org/2000/svg"'
+                ' viewBox="0 0 300 150">'))
+        self.assertEqual(('svg', 300, 150), (info.format, info.width,
+                                              info.height))
+        self.assertEqual(None, read_image_info(self._write('e.png', 'junk')))
+
+    def test_find_image_problems(self):
+        info = read_image_info(self._write('a.png', _png(3000, 2000, 39)))
+        levels = sorted(map(lambda x: x[0], find_image_problems(info)))
+        # Too large for EPUB, unusual dpi (WARNING) and too large for LaTeX
+        self.assertEqual([WARNING, WARNING, ERROR], levels)
+        info = read_image_info(self._write('b.png', _png(640, 480, 11811)))
+        self.assertEqual([], find_image_problems(info))
+
+    def test_inspect_cache(self):
+        path = self._write('a.png', _png(640, 480))
+        cache_path = os.path.join(self.tempdir, 'cache.json')
+        inspector = ImageInspector(cache=StampCache(cache_path), workers=2)
+        self.assertEqual(640, inspector.inspect([path])[path].width)
+        self.assertTrue(os.path.exists(cache_path))
+        # Cached result is used while (size, mtime) stays same.
+        cache = StampCache(cache_path)
+        stamp = (os.path.getsize(path), os.path.getmtime(path))
+        self.assertEqual(480, cache.get(path, stamp)['height'])
+
+    def test_stamp_cache(self):
+        cache_path = os.path.join(self.tempdir, 'cache.json')
+        cache = StampCache(cache_path, max_entries=2)
+        # Non-ASCII paths as str, whose keys are reloaded as unicode.
+        cache.put('/\xe5\x9b\xb3/a.png', (1, 2), 'a')
+        cache.put('/b.png', (1, 2), 'b')
+        cache.put('/c.png', (1, 2), 'c')
+        self.assertEqual('a', cache.get('/\xe5\x9b\xb3/a.png', (1, 2)))
+        cache.save()
+
+        # Only recently used ones are saved.
+        cache = StampCache(cache_path, max_entries=2)
+        self.assertEqual('a', cache.get('/\xe5\x9b\xb3/a.png', (1, 2)))
+        self.assertEqual('a', cache.get(u'/\u56f3/a.png', (1, 2)))
+        self.assertIsNone(cache.get(u'/\u56f3/a.png', (1, 3)))
+        self.assertIsNone(cache.get('/b.png', (1, 2)))
+        self.assertEqual('c', cache.get('/c.png', (1, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
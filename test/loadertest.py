@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.loader import load_project
+from pyrev.parser import Parser
+from pyrev.project import ReVIEWProject
+from pyrev.storage import ArchiveStorage, MemoryStorage
+import unittest
+
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+
+from io import BytesIO
+
+from logging import INFO, CRITICAL
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+NUM_CHAPTERS = 10
+NUM_ARCHIVE_CHAPTERS = 50
+
+
+class SlowStorage(object):
+    '''
+    Wraps a storage and sleeps on each call, like a network filesystem.
+    Counts calls in progress at the same time.
+    '''
+
+    def __init__(self, storage, latency):
+        self.storage = storage
+        self.is_local = storage.is_local
+        self.latency = latency
+        self.num_calls = 0
+        self.max_calls = 0
+        self._lock = threading.Lock()
+
+    def abspath(self, path):
+        return self.storage.abspath(path)
+
+    def __getattr__(self, name):
+        func = getattr(self.storage, name)
+
+        def _slow(*args):
+            with self._lock:
+                self.num_calls += 1
+                self.max_calls = max(self.max_calls, self.num_calls)
+            try:
+                time.sleep(self.latency)
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.num_calls -= 1
+        return _slow
+
+
+def _create_storage():
+    files = {'/book/config.yml': 'bookname: book\n',
+             '/book/catalog.yml': 'CHAPS:\n'}
+    for i in xrange(NUM_CHAPTERS):
+        files['/book/catalog.yml'] += ' - ch{}.re\n'.format(i)
+        files['/book/ch{}.re'.format(i)] = ('= Chap{0}\n\n'
+                                            '//image[a][A]{{\n//}}\n'
+                                            .format(i))
+        files['/book/images/ch{}/a.png'.format(i)] = ''
+    return MemoryStorage(files)
+
+
+def _lint(project):
+    project.parse_source_files()
+    parser = Parser(project=project,
+                    ignore_threshold=INFO,
+                    abort_threshold=CRITICAL,
+                    logger=local_logger)
+    for filename in project.source_filenames:
+        parser.parse_file(os.path.join(project.source_dir, filename),
+                          0, filename)
+    return (map(lambda x: x['title'], project.bookmarks),
+            map(lambda x: (x.source_name, x.line_num, x.desc),
+                parser.reporter.problems))
+
+
+class LoaderTest(unittest.TestCase):
+    def test_load_project(self):
+        storage = SlowStorage(_create_storage(), 0.01)
+
+        project = ReVIEWProject.instantiate('/book', logger=local_logger,
+                                            storage=storage)
+        expected = _lint(project)
+        self.assertEqual(1, storage.max_calls)
+
+        project = load_project('/book', logger=local_logger,
+                               storage=storage)
+        try:
+            self.assertEqual(expected, _lint(project))
+        finally:
+            project.storage.close()
+
+        self.assertEqual(NUM_CHAPTERS, len(expected[0]))
+        # Calls overlapped, instead of waiting for each other.
+        self.assertTrue(storage.max_calls > 1, storage.max_calls)
+
+    def test_load_archive(self):
+        # Large chapters (mostly comments, which are cheap to parse), so
+        # that concurrent reads would overlap.
+        files = {'book/config.yml': 'bookname: book\n',
+                 'book/catalog.yml': 'CHAPS:\n'}
+        for i in xrange(NUM_ARCHIVE_CHAPTERS):
+            files['book/catalog.yml'] += ' - ch{}.re\n'.format(i)
+            files['book/ch{}.re'.format(i)] = (
+                '= Chap{0}\n\n'.format(i)
+                + '#@# {}\n'.format('x' * 1000) * 100
+                + 'Last line of ch{}\n'.format(i))
+        tempdir = tempfile.mkdtemp()
+        try:
+            for (filename, mode) in [('book.tar', 'w'),
+                                     ('book.tgz', 'w:gz')]:
+                archive_path = os.path.join(tempdir, filename)
+                with tarfile.open(archive_path, mode) as tar:
+                    for (path, content) in sorted(files.items()):
+                        info = tarfile.TarInfo(path)
+                        info.size = len(content)
+                        tar.addfile(info, BytesIO(content))
+
+                storage = ArchiveStorage(archive_path)
+                try:
+                    expected = _lint(ReVIEWProject.instantiate(
+                        '/book', logger=local_logger, storage=storage))
+                finally:
+                    storage.close()
+                self.assertEqual(NUM_ARCHIVE_CHAPTERS, len(expected[0]))
+
+                storage = ArchiveStorage(archive_path)
+                try:
+                    project = load_project('/book', io_workers=8,
+                                           logger=local_logger,
+                                           storage=storage)
+                    self.assertIsNotNone(project, filename)
+                    try:
+                        self.assertEqual(expected, _lint(project),
+                                         filename)
+                    finally:
+                        project.storage.close()
+                finally:
+                    storage.close()
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_load_missing_project(self):
+        self.assertIsNone(load_project('/nowhere', logger=local_logger,
+                                       storage=_create_storage()))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
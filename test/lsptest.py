@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.lsp import LanguageServer, MessageReader, TextDocument
+from pyrev.lsp import path_to_uri, write_message
+import unittest
+
+import json
+import shutil
+import tempfile
+
+from StringIO import StringIO
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+
+def _key(result):
+    return (result.problems,
+            map(lambda x: (x.name, x.params, x.line_num), result.blocks),
+            map(lambda x: (x.name, x.line_num), result.inlines),
+            map(lambda x: sorted(x.items()), result.bookmarks))
+
+
+def _change(line, character, end_line, end_character, text):
+    return {'range': {'start': {'line': line, 'character': character},
+                      'end': {'line': end_line, 'character': end_character}},
+            'text': text}
+
+
+def _read_messages(data):
+    reader = MessageReader(None)
+    reader._buffer = data
+    messages = []
+    while True:
+        message = reader._pop_message()
+        if message is None:
+            return messages
+        messages.append(message)
+
+
+class LspTest(unittest.TestCase):
+    def test_incremental_parse(self):
+        text = (u'= Chap\n\n'
+                + u'text @<list>{l1}\n//list[l1][List]{\ncode\n//}\n' * 100
+                + u'== Sec\n//footnote[f1][Note]\n')
+        document = TextDocument(u'file:///tmp/ch1.re', text)
+        document.parse()
+        self.assertEqual(document.num_parsed_lines, len(document.lines))
+
+        changes = [_change(3, 9, 3, 9, u'x'),
+                   # Leaves a block open until the next "//}".
+                   _change(100, 0, 101, 0, u''),
+                   _change(0, 0, 0, 0, u'#@# new\n\n\n'),
+                   _change(400, 0, 400, 0, u'//list[a][b]{\n'),
+                   _change(590, 0, 604, 0, u'')]
+        for change in changes:
+            document.apply_change(change)
+            result = document.parse()
+            self.assertTrue(document.num_parsed_lines < len(document.lines))
+            expected = TextDocument(u'file:///tmp/ch1.re',
+                                    document.get_text()).parse()
+            self.assertEqual(_key(expected), _key(result))
+
+    def test_server(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tempdir, 'config.yml'), 'w') as f:
+                f.write('bookname: book\n')
+            with open(os.path.join(tempdir, 'catalog.yml'), 'w') as f:
+                f.write('CHAPS:\n - ch1.re\n - ch2.re\n')
+            with open(os.path.join(tempdir, 'ch1.re'), 'w') as f:
+                f.write('= Chap1\n//list[l1][List]{\n//}\n')
+            with open(os.path.join(tempdir, 'ch2.re'), 'w') as f:
+                f.write('= Chap2\n')
+            uri = path_to_uri(os.path.join(tempdir, 'ch2.re'))
+
+            requests = StringIO()
+            for message in [
+                    {'id': 1, 'method': 'initialize', 'params': {}},
+                    {'method': 'textDocument/didOpen',
+                     'params': {'textDocument': {
+                         'uri': uri, 'version': 1,
+                         'text': (u'= Chap2\n//list[l3][List]{\n//}\n'
+                                  u'@<list>{l3} @<list>{l2}\n')}}},
+                    {'id': 2, 'method': 'textDocument/definition',
+                     'params': {'textDocument': {'uri': uri},
+                                'position': {'line': 3, 'character': 3}}},
+                    {'method': 'textDocument/didChange',
+                     'params': {'textDocument': {'uri': uri, 'version': 2},
+                                'contentChanges': [
+                                    _change(3, 11, 3, 23, u'')]}},
+                    {'id': 3, 'method': 'shutdown'},
+                    {'method': 'exit'}]:
+                message['jsonrpc'] = '2.0'
+                write_message(requests, message)
+            (read_fd, write_fd) = os.pipe()
+            os.write(write_fd, requests.getvalue())
+            os.close(write_fd)
+            output = StringIO()
+            server = LanguageServer(MessageReader(read_fd), output,
+                                    logger=local_logger)
+            self.assertEqual(0, server.run())
+            os.close(read_fd)
+
+            messages = _read_messages(output.getvalue())
+            self.assertTrue(messages[0]['result']['capabilities']
+                            ['definitionProvider'])
+            # The definition request publishes pending diagnostics first.
+            diagnostics = messages[1]['params']['diagnostics']
+            self.assertEqual(1, len(diagnostics), diagnostics)
+            self.assertEqual(3, diagnostics[0]['range']['start']['line'])
+            self.assertTrue(u'"l2"' in diagnostics[0]['message'])
+            location = messages[2]['result']
+            self.assertEqual(uri, location['uri'])
+            self.assertEqual(1, location['range']['start']['line'])
+            self.assertEqual(3, messages[3]['id'])
+            # The change is not linted until edits stop.
+            self.assertEqual(4, len(messages))
+            server.lint()
+            messages = _read_messages(output.getvalue())
+            self.assertEqual([], messages[4]['params']['diagnostics'])
+            self.assertEqual(2, messages[4]['params']['version'])
+        finally:
+            shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.output import get_writer
+from pyrev.parser import Parser
+import unittest
+
+import json
+from StringIO import StringIO
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+_TEXT = '= Chap\n@<list>{l1}\n@<b>{a @<i>{b}}\n'
+
+
+def _lint(format_name):
+    '''
+    Returns (output, problems) of linting _TEXT, written with a writer
+    as problems are reported.
+    '''
+    stream = StringIO()
+    writer = get_writer(format_name, stream)
+    parser = Parser(logger=local_logger)
+    parser.reporter.add_listener(writer.write)
+    writer.begin()
+    parser._parse_file_inter(_TEXT.splitlines(True), 0, u'ch1.re')
+    parser.end_file()
+    writer.end()
+    return (stream.getvalue(), parser.reporter.problems)
+
+
+class OutputTest(unittest.TestCase):
+    def test_text(self):
+        (output, problems) = _lint('text')
+        lines = []
+        parser = Parser(logger=local_logger)
+        parser.reporter.problems = problems
+        parser._dump_problems(dump_func=lines.append)
+        self.assertEqual(u'\n'.join(lines) + u'\n', output.decode('utf-8'))
+
+    def test_jsonl(self):
+        (output, problems) = _lint('jsonl')
+        records = map(json.loads, output.splitlines())
+        self.assertEqual(len(problems), len(records))
+        self.assertEqual({'rule': u'inline-for-id-found-but-no-block-for-it',
+                          'severity': u'ERROR',
+                          'file': u'ch1.re',
+                          'line': 2,
+                          'column': None,
+                          'message': problems[-1].desc,
+                          'snippet': None},
+                         records[-1])
+        nested = records[0]
+        self.assertEqual(u'possible-nested-inline-tag-at', nested['rule'])
+        self.assertEqual(u'INFO', nested['severity'])
+        self.assertEqual(3, nested['line'])
+        # "C8" in the description, which is 0-based.
+        self.assertEqual(9, nested['column'])
+
+    def test_sarif(self):
+        (output, problems) = _lint('sarif')
+        log = json.loads(output)
+        self.assertEqual(u'2.1.0', log['version'])
+        run = log['runs'][0]
+        self.assertEqual(len(problems), len(run['results']))
+        self.assertEqual([u'inline-for-id-found-but-no-block-for-it',
+                          u'possible-nested-inline-tag-at'],
+                         map(lambda x: x['id'],
+                             run['tool']['driver']['rules']))
+        self.assertEqual(u'note', run['results'][0]['level'])
+        region = run['results'][0]['locations'][0]['physicalLocation'][
+            'region']
+        self.assertEqual(3, region['startLine'])
+        self.assertEqual(9, region['startColumn'])
+        self.assertEqual(u'@<b>{a @<i>{b}}', region['snippet']['text'])
+
+    def test_empty(self):
+        stream = StringIO()
+        writer = get_writer('sarif', stream)
+        writer.begin()
+        writer.end(aborted=True)
+        log = json.loads(stream.getvalue())
+        self.assertEqual([], log['runs'][0]['results'])
+        self.assertFalse(log['runs'][0]['invocations'][0][
+            'executionSuccessful'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,10 @@
 from pyrev.parser import Parser
 import unittest
 
+import os
+import shutil
+import tempfile
+
 from logging import getLogger, DEBUG
 
 local_logger = getLogger(__name__)
@@ -77,6 +81,42 @@ class ParserTest(unittest.TestCase):
         self.assertEqual((u'b', u'C-]', 2),
                          (inline.name, inline.raw_content, inline.line_num))
 
+    def test_mapfile(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tempdir, 'hello.rb'), 'w') as f:
+                f.write('# #@range_begin(main)\n'
+                        'puts "hello"\n'
+                        '# #@range_end(main)\n'
+                        'exit\n')
+            lines = ['= title',
+                     '//list[hello][Hello]{',
+                     '#@mapfile(hello.rb)',
+                     'stale content',
+                     '#@end',
+                     '//}',
+                     '//emlist[Range]{',
+                     '#@maprange(hello.rb,main)',
+                     '#@end',
+                     '//}',
+                     '#@mapfile(missing.rb)',
+                     '#@end']
+            parser = Parser(project=None, logger=local_logger)
+            parser._parse_file_inter(lines, 0, 'fake.re', include_dir=tempdir)
+            self.assertEqual(2, len(parser.all_blocks))
+            self.assertEqual([u'# #@range_begin(main)', u'puts "hello"',
+                              u'# #@range_end(main)', u'exit'],
+                             map(lambda x: x.rstrip(),
+                                 parser.all_blocks[0].uni_lines))
+            self.assertEqual([u'puts "hello"'],
+                             map(lambda x: x.rstrip(),
+                                 parser.all_blocks[1].uni_lines))
+            problems = parser.reporter.problems
+            self.assertEqual(1, len(problems), msg=_msg(problems))
+            self.assertEqual(11, problems[0].line_num)
+        finally:
+            shutil.rmtree(tempdir)
+
 
 
 
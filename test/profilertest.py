@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.parser import Parser
+from pyrev.profiler import RuleProfiler
+import unittest
+
+import itertools
+import json
+import shutil
+import tempfile
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+_TEXT = ('= Chap\n//list[l1][List]{\n//}\n@<list>{l1}\n@<list>{l2}\n'
+         '//lead[x]{\n//}\n')
+
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_profile(self):
+        # Each call takes 1 second.
+        profiler = RuleProfiler(timer=itertools.count().next)
+        parser = Parser(logger=local_logger)
+        profiler.attach(parser)
+        parser._parse_file_inter(_TEXT.splitlines(True), 0, u'ch1.re')
+        rows = dict(map(lambda x: (x[0], x[1:]), profiler.get_rows()))
+        # (calls, total, mean, max, problems)
+        self.assertEqual((2, 2, 1, 1, 1), rows['inline:list:endfile'])
+        self.assertEqual((1, 1, 1, 1, 0), rows['block:list:lastline'])
+        # "Illegal number of params"
+        self.assertEqual(1, rows['block:lead:lastline'][4])
+        self.assertEqual(7, rows['phase:parse_line'][0])
+        # All but the bookmark.
+        self.assertEqual(6, rows['phase:block_state_machine'][0])
+        # "l2"
+        self.assertEqual(1, rows['phase:end_of_document'][4])
+        self.assertNotIn('inline:img:endfile', rows)
+
+        lines = []
+        profiler.dump(lines.append)
+        self.assertEqual(len(rows) + 1, len(lines))
+        path = os.path.join(self.tempdir, 'profile.json')
+        profiler.save(path)
+        with open(path) as f:
+            d = json.load(f)
+        self.assertEqual(2, d['rules']['inline:list:endfile']['calls'])
+
+    def test_not_attached(self):
+        parser = Parser(logger=local_logger)
+        self.assertNotIn('_parse_line', vars(parser))
+        self.assertEqual('__list_block_exist',
+                         parser.allowed_inlines['list'][1].__name__)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.main import lint_profiles, STATUS_FAILED
+from pyrev.profiles import load_profiles, ProfileLinter
+from pyrev.storage import MemoryStorage
+import unittest
+
+import struct
+
+from logging import CRITICAL
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+_gif = 'GIF89a' + struct.pack('<HH', 1, 1)
+
+
+class ProfilesTest(unittest.TestCase):
+    def test_lint_profiles(self):
+        storage = MemoryStorage(
+            {'/book/config-print.yml': ('bookname: print\n'
+                                        'catalogfile: catalog-print.yml\n'
+                                        'imagedir: images-print\n'),
+             '/book/config-ebook.yml': ('bookname: ebook\n'
+                                        'catalogfile: catalog-ebook.yml\n'),
+             '/book/catalog-print.yml': 'CHAPS:\n - ch1.re\n - ch2.re\n',
+             '/book/catalog-ebook.yml': ('CHAPS:\n'
+                                         ' - {"Part1": [ch1.re, ch3.re]}\n'),
+             '/book/ch1.re': ('= Chap1\n'
+                              '//image[fig][Figure]{\n//}\n'
+                              'See @<chap>{ch3}.\n'),
+             '/book/ch2.re': '= Chap2\n',
+             '/book/ch3.re': '= Chap3\n== Sec\n',
+             '/book/images/ch1-fig.gif': _gif,
+             '/book/images-print/other.gif': _gif})
+        profiles = load_profiles('/book',
+                                 ['config-print.yml', 'config-ebook.yml'],
+                                 logger=local_logger, storage=storage)
+        linter = ProfileLinter(profiles, logger=local_logger)
+        (print_profile, ebook_profile) = linter.lint()
+        # Each file is parsed once, though ch1.re is in both profiles.
+        self.assertEqual(['ch1.re', 'ch2.re', 'ch3.re'],
+                         sorted(linter.results.keys()))
+
+        self.assertEqual('images-print', print_profile.project.image_dir)
+        self.assertEqual([(2, u'Image file for image "fig" does not exist'
+                              u' in "images-print"'),
+                          (4, u'Chapter "ch3" is not in "catalog-print.yml"')],
+                         map(lambda x: (x.line_num, x.desc),
+                             print_profile.problems))
+
+        self.assertEqual([], ebook_profile.problems)
+        self.assertEqual([(1, u'Part1'), (2, u'Chap1'),
+                          (2, u'Chap3'), (3, u'Sec')],
+                         map(lambda x: (x['level'], x['title']),
+                             ebook_profile.bookmarks))
+
+    def test_refs_across_files(self):
+        storage = MemoryStorage(
+            {'/book/config.yml': 'bookname: book\n',
+             '/book/catalog.yml': 'CHAPS:\n - ch1.re\n - ch2.re\n',
+             '/book/ch1.re': '= Chap1\n//list[l1][List]{\nputs 1\n//}\n',
+             '/book/ch2.re': '= Chap2\nSee @<list>{l1}.\n'})
+        profiles = load_profiles('/book', ['config.yml'],
+                                 logger=local_logger, storage=storage)
+        (profile,) = ProfileLinter(profiles, logger=local_logger).lint()
+        self.assertEqual([], profile.problems)
+
+    def test_check_parts(self):
+        storage = MemoryStorage(
+            {'/book/config.yml': 'bookname: book\n',
+             '/book/catalog.yml': ('CHAPS:\n'
+                                   ' - {"Part1": [ch1.re]}\n'
+                                   ' - {"Part2": []}\n'
+                                   ' - {"Part1": [ch2.re]}\n'),
+             '/book/ch1.re': '= Chap1\n',
+             '/book/ch2.re': '= Chap2\n'})
+        profiles = load_profiles('/book', ['config.yml'],
+                                 logger=local_logger, storage=storage)
+        (profile,) = ProfileLinter(profiles, logger=local_logger).lint()
+        self.assertEqual([('catalog.yml', u'Part "Part2" has no chapter'),
+                          ('catalog.yml',
+                           u'Part "Part1" appears more than once')],
+                         map(lambda x: (x.source_name, x.desc),
+                             profile.problems))
+
+    def test_broken_catalog(self):
+        storage = MemoryStorage(
+            {'/book/config.yml': 'bookname: book\n',
+             '/book/catalog.yml': 'CHAPS: [ch1.re\n',
+             '/book/ch1.re': '= Chap1\n'})
+        lines = []
+        self.assertEqual(STATUS_FAILED,
+                         lint_profiles('/book', ['config.yml'], CRITICAL,
+                                       local_logger, storage=storage,
+                                       dump_func=lines.append))
+        self.assertEqual([], lines)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
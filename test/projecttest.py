@@ -8,9 +8,14 @@ _projects_dir = os.path.join(_cur_dir, 'projects')
 import sys
 sys.path.insert(0, _parent_dir)
 
-from pyrev.project import ReVIEWProject
+from pyrev.project import ReVIEWProject, ProjectImageIndex
+from pyrev.storage import MemoryStorage, ArchiveStorage
 import unittest
 
+import shutil
+import tempfile
+import zipfile
+
 from testutil import setup_logger
 
 _debug = False
@@ -44,6 +49,143 @@ class ProjectTest(unittest.TestCase):
         self.assertEqual('draft1', img2.parent_id)
         self.assertEqual('mowa', img2.id)
 
+    def test_guess_source_dir(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            def _touch(*parts):
+                path = os.path.join(tempdir, *parts)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                open(path, 'w').close()
+            # Must be ignored though they are shallower than the project.
+            _touch('.git', 'catalog.yml')
+            _touch('node_modules', 'catalog.yml')
+            _touch('book-pdf', 'chap1.re')
+            _touch('misc', 'deep', 'chap1.re')
+            _touch('doc', 'article', 'config.yml')
+            _touch('doc', 'article', 'chap1.re')
+            # Loop
+            os.symlink(tempdir, os.path.join(tempdir, 'doc', 'loop'))
+            self.assertEqual(os.path.join(tempdir, 'doc', 'article'),
+                             ReVIEWProject.guess_source_dir(tempdir))
+            self.assertEqual(None,
+                             ReVIEWProject.guess_source_dir(tempdir, 1))
+            self.assertEqual(os.path.join(tempdir, 'misc', 'deep'),
+                             ReVIEWProject.guess_source_dir(
+                                 os.path.join(tempdir, 'misc')))
+        finally:
+            shutil.rmtree(tempdir)
+
+
+    def test_image_index(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            image_dir_path = os.path.join(tempdir, 'images')
+            os.makedirs(os.path.join(image_dir_path, 'chap10'))
+            for filename in ['chap1-a.png', 'chap10-b.png', 'chap1-x-c.png',
+                             'chap1-.png', 'chap10/d.png', 'other.png']:
+                open(os.path.join(image_dir_path, filename), 'w').close()
+            index = ProjectImageIndex('images', image_dir_path,
+                                      ['chap1.re', 'chap10.re', 'chap1-x.re'])
+            self.assertEqual(['chap1-.png', 'other.png'],
+                             sorted(index.unmappable_images))
+            # Sub directories are not scanned until requested.
+            self.assertEqual({}, index._images)
+            self.assertEqual(['a'],
+                             map(lambda x: x.id, index['chap1.re']))
+            self.assertEqual(['c'],
+                             map(lambda x: x.id, index['chap1-x.re']))
+            self.assertFalse(index.has_image('chap1.re', 'b'))
+            self.assertTrue(index.has_image('chap10.re', 'b'))
+            self.assertEqual('images/chap10/d.png',
+                             index.find('chap10.re', 'd').rel_path)
+            self.assertEqual(None, index.get('chap2.re'))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_get_document(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            source_dir = os.path.join(tempdir, 'project1')
+            shutil.copytree(os.path.join(_projects_dir, 'project1'),
+                            source_dir)
+            path = os.path.join(source_dir, 'project1.re')
+            with open(path, 'w') as f:
+                f.write('= Chap1\n== Sec1\n'
+                        '//image[mowadeco][Mowa]{\n//}\n')
+            project = ReVIEWProject.instantiate(source_dir,
+                                                logger=local_logger,
+                                                document_cache_bytes=1)
+            document = project.get_document('project1.re')
+            self.assertFalse(document.is_parsed())
+            self.assertEqual(['Chap1', 'Sec1'],
+                             map(lambda x: x['title'], document.bookmarks))
+            self.assertEqual(['images/project1-mowadeco.png'],
+                             map(lambda x: x.rel_path, document.images))
+            self.assertTrue(document is project.get_document('project1.re'))
+            self.assertEqual(None, project.get_document('unknown.re'))
+
+            # Only one document is kept since the cache is small.
+            project.get_document('draft1.re')
+            self.assertEqual(['draft1.re'], project._documents.keys())
+
+            document = project.get_document('project1.re')
+            self.assertEqual(2, len(document.bookmarks))
+            with open(path, 'w') as f:
+                f.write('= Chap1 modified\n')
+            os.utime(path, (0, 0))
+            self.assertTrue(document.is_stale())
+            document = project.get_document('project1.re')
+            self.assertEqual(['Chap1 modified'],
+                             map(lambda x: x['title'], document.bookmarks))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_memory_storage(self):
+        storage = MemoryStorage({'/book/src/config.yml': 'bookname: book\n',
+                                 '/book/src/catalog.yml': 'CHAPS:\n - ch1.re\n',
+                                 '/book/src/ch1.re': '= Chap1\n',
+                                 '/book/src/images/ch1-a.png': '',
+                                 '/book/.git/catalog.yml': ''})
+        source_dir = ReVIEWProject.guess_source_dir('/book', storage=storage)
+        self.assertEqual('/book/src', source_dir)
+        project = ReVIEWProject.instantiate(source_dir, logger=local_logger,
+                                            storage=storage)
+        self.assertEqual(['ch1.re'], project.source_filenames)
+        self.assertTrue(project.images.has_image('ch1.re', 'a'))
+        self.assertEqual(['Chap1'],
+                         map(lambda x: x['title'],
+                             project.get_document('ch1.re').bookmarks))
+
+    def test_archive_storage(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            archive_path = os.path.join(tempdir, 'project1.zip')
+            base_dir = os.path.join(_projects_dir, 'project1')
+            with zipfile.ZipFile(archive_path, 'w') as z:
+                for (dir_path, _, filenames) in os.walk(base_dir):
+                    for filename in filenames:
+                        path = os.path.join(dir_path, filename)
+                        z.write(path, os.path.join(
+                            'project1', os.path.relpath(path, base_dir)))
+            self.assertTrue(ArchiveStorage.is_archive(archive_path))
+            storage = ArchiveStorage(archive_path)
+            try:
+                source_dir = ReVIEWProject.guess_source_dir('/',
+                                                            storage=storage)
+                self.assertEqual('/project1', source_dir)
+                project = ReVIEWProject.instantiate(source_dir,
+                                                    logger=local_logger,
+                                                    storage=storage)
+                self.assertEqual(['project1.re'], project.source_filenames)
+                self.assertEqual(['draft1.re'], project.draft_filenames)
+                self.assertEqual('images/draft1/mowa.jpg',
+                                 project.images.find('draft1.re',
+                                                     'mowa').rel_path)
+            finally:
+                storage.close()
+        finally:
+            shutil.rmtree(tempdir)
 
 
 if __name__ == '__main__':
@@ -25,6 +25,7 @@ sys.path.insert(0, parent_dir)
 
 from pyrev.parser import Parser
 from pyrev.project import ReVIEWProject
+from pyrev import main
 from pyrev import utils
 
 import unittest
@@ -167,6 +168,114 @@ class RegressionTest(unittest.TestCase):
         finally:
             shutil.rmtree(tempdir)
 
+    def test_lint_projects(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            for project_name in ['project1', 'project2']:
+                shutil.copytree(os.path.join(projects_dir, project_name),
+                                os.path.join(tempdir, 'books', project_name))
+            # config.yml without bookname
+            broken_dir = os.path.join(tempdir, 'broken')
+            os.mkdir(broken_dir)
+            with open(os.path.join(broken_dir, 'config.yml'), 'w') as f:
+                f.write('booktitle: broken\n')
+            lines = []
+            ret = main.lint_projects(tempdir, main.CRITICAL, 1, local_logger,
+                                     dump_func=lines.append)
+            self.assertEqual(main.STATUS_FAILED, ret)
+            headers = filter(lambda x: x.startswith('=='), lines)
+            self.assertEqual(3, len(headers))
+            self.assertTrue(headers[0].startswith('== broken '))
+            self.assertTrue(headers[0].endswith(': FAILED =='))
+            self.assertTrue(headers[1].startswith('== books/project1 '))
+            self.assertTrue(lines[-1].endswith('2 ok, 0 with problems,'
+                                               ' 1 failed'))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def _write_chapters(self, tempdir):
+        contents = {'ch1.re': ('Before a heading\n= Chap1\n'
+                               '//list[l1][List]{\n//}\n'),
+                    'ch2.re': ('No heading @<list>{l1} @<list>{l2}\n'
+                               '* Bad list\n'),
+                    'ch3.re': '= Chap3\n//list[l3][List]{\n',
+                    'ch4.re': '= Chap4\n' + 'text\n' * 1000}
+        with open(os.path.join(tempdir, 'config.yml'), 'w') as f:
+            f.write('bookname: book\n')
+        with open(os.path.join(tempdir, 'catalog.yml'), 'w') as f:
+            f.write('CHAPS:\n - ch1.re\n - ch2.re\n'
+                    ' - ch3.re\n - ch4.re\n')
+        for (filename, content) in contents.iteritems():
+            with open(os.path.join(tempdir, filename), 'w') as f:
+                f.write(content)
+
+    def test_lint_project_in_parallel(self):
+        from pyrev import parallel
+        tempdir = tempfile.mkdtemp()
+        original_min_bytes = parallel.PARALLEL_MIN_BYTES
+        try:
+            self._write_chapters(tempdir)
+            parallel.PARALLEL_MIN_BYTES = 0
+            outputs = []
+            for jobs in [1, 3]:
+                project = ReVIEWProject.instantiate(tempdir,
+                                                    logger=local_logger)
+                parser = main._lint_project(project, main.CRITICAL,
+                                            local_logger, jobs)
+                lines = []
+                parser._dump_problems(dump_func=lines.append)
+                outputs.append(lines)
+            self.assertTrue(parallel.should_parse_in_parallel(
+                project, project.source_filenames, 3))
+            self.assertEqual(outputs[0], outputs[1])
+            self.assertEqual(5, len(outputs[0]), msg=outputs[0])
+        finally:
+            parallel.PARALLEL_MIN_BYTES = original_min_bytes
+            shutil.rmtree(tempdir)
+
+    def test_lint_project_with_parse_cache(self):
+        from pyrev.parsecache import ParseCache
+        tempdir = tempfile.mkdtemp()
+        try:
+            source_dir = os.path.join(tempdir, 'book')
+            os.mkdir(source_dir)
+            self._write_chapters(source_dir)
+            cache = ParseCache(os.path.join(tempdir, 'cache'),
+                               logger=local_logger)
+
+            def _lint(parse_cache):
+                project = ReVIEWProject.instantiate(source_dir,
+                                                    logger=local_logger)
+                parser = main._lint_project(project, main.CRITICAL,
+                                            local_logger,
+                                            parse_cache=parse_cache)
+                lines = []
+                parser._dump_problems(dump_func=lines.append)
+                return lines
+
+            expected = _lint(None)
+            self.assertEqual(expected, _lint(cache))
+            self.assertEqual((0, 4), (cache.hits, cache.misses))
+            self.assertEqual(expected, _lint(cache))
+            self.assertEqual((4, 4), (cache.hits, cache.misses))
+
+            with open(os.path.join(source_dir, 'ch2.re'), 'a') as f:
+                f.write('//list[l2][List]{\n//}\n')
+            expected = _lint(None)
+            self.assertEqual(expected, _lint(cache))
+            self.assertEqual((7, 5), (cache.hits, cache.misses))
+
+            # Evicts only the oldest one.
+            paths = map(lambda x: os.path.join(cache.cache_dir, x),
+                        os.listdir(cache.cache_dir))
+            self.assertEqual(5, len(paths))
+            cache.max_bytes = sum(map(os.path.getsize, paths)) - 1
+            cache._modified = True
+            cache.evict()
+            self.assertEqual(4, len(os.listdir(cache.cache_dir)))
+        finally:
+            shutil.rmtree(tempdir)
+
 
 if __name__ == '__main__':
     unittest.main()
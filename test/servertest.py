@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.client import send_request, SOCKET_ENV
+from pyrev.main import _can_use_server, _lint_with_server
+from pyrev.main import add_lint_arguments
+from pyrev.server import LintServer
+from pyrev.version import VERSION
+import unittest
+
+import shutil
+import signal
+import tempfile
+import time
+
+from argparse import ArgumentParser, Namespace
+from io import BytesIO
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+
+def _write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tempdir, 'book')
+        os.mkdir(self.source_dir)
+        _write(os.path.join(self.source_dir, 'config.yml'),
+               'bookname: book\n')
+        _write(os.path.join(self.source_dir, 'catalog.yml'),
+               'CHAPS:\n - ch1.re\n - ch2.re\n')
+        _write(os.path.join(self.source_dir, 'ch1.re'),
+               '= Chap1\n//list[l1][List]{\n//}\n')
+        _write(os.path.join(self.source_dir, 'ch2.re'),
+               '= Chap2\n@<list>{l1}\n')
+        self.socket_path = os.path.join(self.tempdir, 'serve.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _request(self, server, path):
+        return server.handle({'path': path, 'version': VERSION,
+                              'unacceptable_level': 'CRITICAL'})
+
+    def test_handle(self):
+        server = LintServer(self.socket_path, logger=local_logger)
+        response = self._request(server, self.source_dir)
+        self.assertIsNone(response['error'])
+        self.assertEqual([u'No problem'], response['lines'])
+        watcher = server._watchers.values()[0][1]
+
+        # Only the changed file is parsed again.
+        ch1_path = os.path.join(self.source_dir, 'ch1.re')
+        _write(ch1_path, '= Chap1\n')
+        os.utime(ch1_path, (0, 0))
+        response = self._request(server, self.source_dir)
+        self.assertEqual(2, len(response['lines']), response['lines'])
+        self.assertTrue(u'ch2.re L2' in response['lines'][1])
+        self.assertEqual(1, watcher.num_parsed)
+        self.assertTrue(watcher is server._watchers.values()[0][1])
+
+        # Changing catalog reloads the project.
+        catalog_path = os.path.join(self.source_dir, 'catalog.yml')
+        _write(catalog_path, 'CHAPS:\n - ch1.re\n')
+        os.utime(catalog_path, (0, 0))
+        response = self._request(server, self.source_dir)
+        self.assertEqual([u'No problem'], response['lines'])
+        self.assertFalse(watcher is server._watchers.values()[0][1])
+
+        # A single file is linted without its project.
+        response = self._request(server,
+                                 os.path.join(self.source_dir, 'ch2.re'))
+        self.assertIsNone(response['error'])
+        self.assertTrue(u'ch2.re L2' in response['lines'][1])
+
+        response = self._request(server, os.path.join(self.tempdir, 'none'))
+        self.assertTrue(response['error'])
+        response = server.handle({'path': self.source_dir, 'version': '0'})
+        self.assertTrue(response['error'])
+
+    def _fork_server(self):
+        '''
+        Starts a server in a child process and returns its pid with
+        the first response for source_dir.
+        '''
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                server = LintServer(self.socket_path, workers=1,
+                                    logger=local_logger)
+                status = server.serve_forever()
+            finally:
+                os._exit(status)
+        for _ in xrange(100):
+            response = send_request({'path': self.source_dir},
+                                    socket_path=self.socket_path)
+            if response:
+                break
+            time.sleep(0.05)
+        return (pid, response)
+
+    def _stop_server(self, pid):
+        os.kill(pid, signal.SIGTERM)
+        (_, status) = os.waitpid(pid, 0)
+        return status
+
+    def test_serve(self):
+        self.assertIsNone(send_request({'path': self.source_dir},
+                                       socket_path=self.socket_path))
+        (pid, response) = self._fork_server()
+        try:
+            self.assertIsNotNone(response)
+            self.assertIsNone(response['error'])
+            self.assertEqual([u'No problem'], response['lines'])
+            self.assertNotEqual(os.getpid(), response['pid'])
+        finally:
+            status = self._stop_server(pid)
+        self.assertEqual(0, status)
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_can_use_server(self):
+        parser = ArgumentParser()
+        add_lint_arguments(parser)
+        can_use = lambda *args: _can_use_server(
+            self.source_dir, parser.parse_args(list(args) + ['book']),
+            None)
+        self.assertTrue(can_use())
+        self.assertTrue(can_use('-u', 'ERROR'))
+        # Not sent to the server, which would ignore them.
+        for args in [['--no-cache'], ['-j', '2'], ['--io-workers', '4'],
+                     ['--no-server'], ['--format', 'jsonl']]:
+            self.assertFalse(can_use(*args), args)
+
+    def test_lint_with_server(self):
+        _write(os.path.join(self.source_dir, 'ch2.re'),
+               '= Chap2\n@<list>{\xe3\x83\xaa\xe3\x82\xb9\xe3\x83\x88}\n')
+        (pid, response) = self._fork_server()
+        old_socket_path = os.environ.get(SOCKET_ENV)
+        os.environ[SOCKET_ENV] = self.socket_path
+        # Accepts bytes only, like stdout piped to another command.
+        stdout = sys.stdout
+        sys.stdout = BytesIO()
+        try:
+            self.assertIsNotNone(response)
+            self.assertTrue(_lint_with_server(
+                self.source_dir, Namespace(unacceptable_level='CRITICAL'),
+                local_logger))
+            output = sys.stdout.getvalue().decode('utf-8')
+        finally:
+            sys.stdout = stdout
+            if old_socket_path is None:
+                del os.environ[SOCKET_ENV]
+            else:
+                os.environ[SOCKET_ENV] = old_socket_path
+            self._stop_server(pid)
+        self.assertTrue(u'\u30ea\u30b9\u30c8' in output, output)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.snippet import SnippetLinter
+import unittest
+
+import json
+
+from StringIO import StringIO
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+
+class SnippetTest(unittest.TestCase):
+    def test_serve(self):
+        requests = [{'id': 1, 'source_name': 'a.re',
+                     'text': (u'= Title\n//list[l1][List]{\n//}\n'
+                              u'@<list>{l1}\n')},
+                    {'id': 'b', 'text': u'@<list>{l1}\n* bad list\n'},
+                    {'id': 3,
+                     'text': u'= Title\n#@mapfile(/etc/hosts)\n#@end\n'},
+                    {'id': 4}]
+        input_stream = StringIO(u'\n'.join(map(json.dumps, requests))
+                                + u'\nbroken\n')
+        output_stream = StringIO()
+        linter = SnippetLinter(logger=local_logger)
+        self.assertEqual(5, linter.serve(input_stream, output_stream))
+        responses = map(json.loads, output_stream.getvalue().splitlines())
+        self.assertEqual([1, 'b', 3, 4, None],
+                         map(lambda x: x['id'], responses))
+
+        self.assertEqual('a.re', responses[0]['source_name'])
+        self.assertEqual([], responses[0]['problems'])
+
+        # Blocks of previous snippets are not visible.
+        self.assertEqual('snippet.re', responses[1]['source_name'])
+        self.assertEqual(set([(1, 'ERROR'), (2, 'WARNING'), (1, 'INFO'),
+                              (2, 'INFO')]),
+                         set(map(lambda x: (x['line'], x['level']),
+                                 responses[1]['problems'])))
+
+        # Files are never read.
+        self.assertEqual(1, len(responses[2]['problems']))
+        self.assertTrue(u'does not exist'
+                        in responses[2]['problems'][0]['message'])
+
+        self.assertTrue('error' in responses[3])
+        self.assertTrue('error' in responses[4])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
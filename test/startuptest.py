@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+import unittest
+
+import subprocess
+import time
+
+# Modules which must not be imported just by starting pyrev.
+HEAVY_MODULES = ['yaml', 'PIL', 'multiprocessing', 'pyrev.parser',
+                 'pyrev.project', 'pyrev.imageinfo', 'pyrev.storage',
+                 'pyrev.utils']
+
+# Acceptable startup time of "--version" on top of a bare interpreter,
+# in seconds. Importing PyYAML and the parser eagerly exceeds this.
+STARTUP_BUDGET = 0.1
+
+# Wall time depends on the machine, so test_startup_time runs only when
+# this is set (e.g. PYREV_BENCHMARK=1). Run this file with "--benchmark"
+# to just print the times.
+BENCHMARK_ENV = 'PYREV_BENCHMARK'
+
+SCRIPTS = ['main.py', 'devel.py']
+
+
+def _run(args):
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call([sys.executable] + args,
+                              stdout=devnull, stderr=devnull)
+
+
+def measure(args, repeat=5):
+    '''
+    Returns the best wall time of running python with args.
+    '''
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        _run(args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure_overheads():
+    '''
+    Returns a list of (script, seconds) of "--version" on top of
+    a bare interpreter.
+    '''
+    baseline = measure(['-c', 'pass'])
+    return map(lambda script:
+               (script,
+                measure([os.path.join(_parent_dir, 'pyrev', script),
+                         '--version']) - baseline),
+               SCRIPTS)
+
+
+class StartupTest(unittest.TestCase):
+    def test_lazy_imports(self):
+        code = ('import sys; sys.path.insert(0, {!r});'
+                ' import pyrev.main, pyrev.devel;'
+                ' print(",".join(m for m in {!r} if sys.modules.get(m)))'
+                .format(_parent_dir, HEAVY_MODULES))
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual('', output.strip())
+
+    @unittest.skipUnless(os.environ.get(BENCHMARK_ENV),
+                         '{} is not set'.format(BENCHMARK_ENV))
+    def test_startup_time(self):
+        for (script, overhead) in measure_overheads():
+            self.assertTrue(overhead < STARTUP_BUDGET,
+                            u'{} took {:.3f}s to start'
+                            .format(script, overhead))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--benchmark']:
+        for (script, overhead) in measure_overheads():
+            print(u'{}: {:.1f}ms'.format(script, overhead * 1000))
+    else:
+        unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.toc import scan_toc, format_pdftk
+import unittest
+
+
+class TocTest(unittest.TestCase):
+    def test_scan_toc(self):
+        content = (u'= Chap1\n'
+                   u'//list[l1][List]{\n'
+                   u'= not a heading\n'
+                   u'//}\n'
+                   u'//footnote[fn][Footnote]\n'
+                   u'=== Jumped\n'
+                   u'==[column] Column\n'
+                   u'= Chap2\n')
+        problems = []
+        bookmarks = scan_toc(content, 'chap1.re', 1, problems)
+        self.assertEqual([(2, u'Chap1', 0, 1),
+                          (4, u'Jumped', None, 6),
+                          (3, u'Column', None, 7),
+                          (2, u'Chap2', 1, 8)],
+                         map(lambda x: (x['level'], x['title'],
+                                        x['source_chap_index'],
+                                        x['line_num']),
+                             bookmarks))
+        self.assertEqual(1, len(problems))
+        self.assertEqual(6, problems[0].line_num)
+        self.assertEqual([u'BookmarkBegin',
+                          u'BookmarkTitle: Chap1',
+                          u'BookmarkLevel: 2',
+                          u'BookmarkPageNumber: 1'],
+                         list(format_pdftk(bookmarks))[:4])
+        # Column is omitted.
+        self.assertEqual(12, len(list(format_pdftk(bookmarks))))
+
+
+if __name__ == '__main__':
+    unittest.main()
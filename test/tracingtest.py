@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev import tracing
+from pyrev.parser import Parser
+import unittest
+
+import json
+import shutil
+import tempfile
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+
+class TracingTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        tracing.stop()
+        shutil.rmtree(self.tempdir)
+
+    def test_not_tracing(self):
+        self.assertFalse(tracing.is_tracing())
+        self.assertIs(tracing.NULL_SPAN, tracing.span(u'parse', file=u'a'))
+        self.assertEqual([], tracing.take_worker_events())
+        self.assertIsNone(tracing.stop())
+
+    def test_spans(self):
+        tracer = tracing.start()
+        with tracing.span(u'lint', path=u'/tmp') as outer:
+            with tracing.span(u'parse', file=u'ch1.re') as s:
+                s.set(lines=3)
+            outer.set(files=1)
+        with self.assertRaises(ValueError):
+            with tracing.span(u'parse', file=u'ch2.re'):
+                raise ValueError()
+        self.assertIs(tracer, tracing.stop())
+        self.assertFalse(tracing.is_tracing())
+        # Inner spans end first.
+        (parse1, lint, parse2) = tracer.events
+        self.assertEqual(u'lint', lint['name'])
+        self.assertEqual('X', lint['ph'])
+        self.assertEqual({'path': u'/tmp', 'files': 1}, lint['args'])
+        self.assertEqual({'file': u'ch1.re', 'lines': 3}, parse1['args'])
+        self.assertEqual({'file': u'ch2.re', 'error': 'ValueError'},
+                         parse2['args'])
+        self.assertLessEqual(lint['ts'], parse1['ts'])
+        self.assertLessEqual(parse1['ts'] + parse1['dur'],
+                             lint['ts'] + lint['dur'])
+        self.assertEqual(os.getpid(), lint['pid'])
+
+    def test_worker_events(self):
+        tracing.init_worker(True)
+        with tracing.span(u'parse', file=u'ch1.re'):
+            pass
+        events = tracing.take_worker_events()
+        self.assertEqual(['process_name', 'thread_name', 'parse'],
+                         map(lambda x: x['name'], events))
+        self.assertEqual([], tracing.take_worker_events())
+
+        # Events sent by a worker appear in the parent's trace.
+        tracer = tracing.start()
+        self.assertEqual([], tracing.take_worker_events())
+        tracing.add_events(events)
+        tracing.stop()
+        self.assertEqual([events[2]], tracer.events)
+        path = os.path.join(self.tempdir, 'trace.json')
+        tracer.save(path)
+        with open(path) as f:
+            data = json.load(f)
+        self.assertEqual(['process_name', 'thread_name', 'parse'],
+                         map(lambda x: x['name'], data['traceEvents']))
+
+    def test_parse_file(self):
+        path = os.path.join(self.tempdir, 'ch1.re')
+        with open(path, 'w') as f:
+            f.write('= Chap1\n\nText\n')
+        tracer = tracing.start()
+        parser = Parser(logger=local_logger)
+        parser.parse_file(path, 0, 'ch1.re')
+        tracing.stop()
+        parse = filter(lambda x: x['name'] == u'parse', tracer.events)
+        self.assertEqual(1, len(parse))
+        self.assertEqual({'file': 'ch1.re', 'lines': 3}, parse[0]['args'])
+
+
+if __name__ == '__main__':
+    unittest.main()
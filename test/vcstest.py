@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.main import lint_changes, STATUS_OK, STATUS_PROBLEM
+from pyrev.vcs import GitRepository, GitIndexStorage
+import unittest
+
+import shutil
+import subprocess
+import tempfile
+
+from logging import CRITICAL
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+
+def _write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class VcsTest(unittest.TestCase):
+    def _git(self, *args):
+        subprocess.check_call(('git', '-c', 'user.name=pyrev',
+                               '-c', 'user.email=pyrev@example.com',
+                               '-c', 'commit.gpgsign=false')
+                              + args, cwd=self.tempdir,
+                              stdout=open(os.devnull, 'w'))
+
+    def setUp(self):
+        self.tempdir = os.path.realpath(tempfile.mkdtemp())
+        self.source_dir = os.path.join(self.tempdir, 'book')
+        os.mkdir(self.source_dir)
+        _write(os.path.join(self.source_dir, 'config.yml'),
+               'bookname: book\n')
+        _write(os.path.join(self.source_dir, 'catalog.yml'),
+               'CHAPS:\n - ch1.re\n - ch2.re\n - ch3.re\n')
+        _write(os.path.join(self.source_dir, 'ch1.re'),
+               '= Chap1\n//list[l1][List]{\n//}\n')
+        _write(os.path.join(self.source_dir, 'ch2.re'),
+               '= Chap2\n@<list>{l1}\n')
+        _write(os.path.join(self.source_dir, 'ch3.re'),
+               '= Chap3\n@<b>{bold}\n')
+        try:
+            self._git('init', '-q')
+        except OSError:
+            self.skipTest('git is not available')
+        self._git('add', '-A')
+        self._git('commit', '-q', '-m', 'Initial')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _lint(self, **kwargs):
+        lines = []
+        status = lint_changes(self.source_dir, CRITICAL, local_logger,
+                              dump_func=lines.append, **kwargs)
+        return (status, lines)
+
+    def test_lint_changes(self):
+        self.assertEqual((STATUS_OK, [u'No problem']), self._lint())
+
+        # ch2.re refers to the removed list, so is linted too.
+        _write(os.path.join(self.source_dir, 'ch1.re'), '= Chap1\n')
+        (status, lines) = self._lint(since='HEAD')
+        self.assertEqual(STATUS_PROBLEM, status)
+        self.assertEqual(2, len(lines), lines)
+        self.assertTrue(u'ch2.re L2' in lines[1])
+
+        # Only ch3.re is changed and linted.
+        _write(os.path.join(self.source_dir, 'ch1.re'),
+               '= Chap1\n//list[l1][List]{\n//}\n')
+        _write(os.path.join(self.source_dir, 'ch3.re'),
+               '= Chap3\n@<list>{none}\n')
+        self._git('commit', '-q', '-a', '-m', 'Second')
+        (status, lines) = self._lint(since='HEAD~1')
+        self.assertEqual([u'ch3.re L2'],
+                         map(lambda x: x.split(':')[0].split('] ')[1],
+                             lines[1:]))
+
+    def test_staged(self):
+        _write(os.path.join(self.source_dir, 'ch1.re'), '= Chap1\n')
+        self._git('add', 'book/ch1.re')
+        # Not staged, so not linted.
+        _write(os.path.join(self.source_dir, 'ch1.re'),
+               '= Chap1\n//list[l1][List]{\n//}\n')
+        (status, lines) = self._lint(staged=True)
+        self.assertEqual(STATUS_PROBLEM, status)
+        self.assertEqual(2, len(lines), lines)
+        self.assertTrue(u'ch2.re L2' in lines[1])
+
+        repository = GitRepository(self.source_dir, logger=local_logger)
+        storage = GitIndexStorage(repository)
+        try:
+            self.assertEqual('= Chap1\n', storage.read('/book/ch1.re'))
+            self.assertEqual(8, storage.stat('/book/ch1.re').st_size)
+            self.assertEqual(['catalog.yml', 'ch1.re', 'ch2.re', 'ch3.re',
+                              'config.yml'], storage.listdir('/book'))
+            self.assertIsNone(repository.cat_file('HEAD:none.re'))
+        finally:
+            storage.close()
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+_cur_dir = os.path.dirname(os.path.realpath(__file__))
+_parent_dir = os.path.dirname(_cur_dir)
+import sys
+sys.path.insert(0, _parent_dir)
+
+from pyrev.watch import Watcher, PollingMonitor, InotifyMonitor
+import unittest
+
+import shutil
+import tempfile
+
+from logging import CRITICAL
+
+from testutil import setup_logger
+
+_debug = False
+local_logger = setup_logger(__name__, _debug)
+
+
+def _write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class WatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        _write(os.path.join(self.tempdir, 'config.yml'), 'bookname: book\n')
+        _write(os.path.join(self.tempdir, 'catalog.yml'),
+               'CHAPS:\n - ch1.re\n - ch2.re\n')
+        _write(os.path.join(self.tempdir, 'ch1.re'),
+               '= Chap1\n//list[l1][List]{\n//}\n')
+        _write(os.path.join(self.tempdir, 'ch2.re'),
+               '= Chap2\n@<list>{l1}\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_lint_changes(self):
+        watcher = Watcher(self.tempdir, CRITICAL, logger=local_logger)
+        self.assertTrue(watcher.load_project())
+        self.assertEqual(([], []), watcher.lint())
+        self.assertEqual(2, watcher.num_parsed)
+
+        # Removing the list breaks the reference in ch2.re,
+        # though only ch1.re is parsed again.
+        ch1_path = os.path.join(self.tempdir, 'ch1.re')
+        _write(ch1_path, '= Chap1\n')
+        os.utime(ch1_path, (0, 0))
+        (added, removed) = watcher.handle_changes(set([ch1_path]))
+        self.assertEqual(1, watcher.num_parsed)
+        self.assertEqual(1, len(added), added)
+        self.assertTrue(u'ch2.re L2' in added[0], added[0])
+        self.assertEqual([], removed)
+
+        _write(ch1_path, '= Chap1\n//list[l1][List]{\n//}\n')
+        (added, removed) = watcher.handle_changes(set([ch1_path]))
+        self.assertEqual([], added)
+        self.assertEqual(1, len(removed))
+        self.assertEqual([], watcher.problems)
+
+        # Unrelated files are ignored.
+        self.assertIsNone(watcher.handle_changes(
+            set([os.path.join(self.tempdir, 'memo.txt')])))
+
+    def _check_monitor(self, monitor):
+        try:
+            monitor.watch([self.tempdir])
+            self.assertEqual(set(), monitor.wait(0))
+            path = os.path.join(self.tempdir, 'ch2.re')
+            _write(path, '= Chap2 (modified)\n')
+            self.assertTrue(path in monitor.wait(1))
+        finally:
+            monitor.close()
+
+    def test_polling_monitor(self):
+        self._check_monitor(PollingMonitor(interval=0.01))
+
+    def test_inotify_monitor(self):
+        try:
+            monitor = InotifyMonitor()
+        except OSError:
+            # Not on Linux.
+            return
+        self._check_monitor(monitor)
+
+
+if __name__ == '__main__':
+
+    unittest.main()